@@ -1,22 +1,15 @@
+import argparse
 import os
 import yaml
-from stable_baselines3 import DQN
-from stable_baselines3.dqn.policies import MlpPolicy
-
-from stable_baselines3.common.env_checker import check_env
-from stable_baselines3.common.evaluation import evaluate_policy
-from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv
-from stable_baselines3.common.monitor import Monitor
-from stable_baselines3.common.logger import configure
-from modules.callbacks import GPUMemoryCallback, CheckpointCallback, InfoLoggerCallback
-
-from modules.solitaire_env import SolitaireEnv
+from modules.placement import Placement
 import shutil
 
+# torch, SB3 and the env are imported where they are used, so that env worker
+# processes and short-lived tools importing this module start quickly
+
 import cProfile
 import pstats
 
-
 def load_config(path):
     """Load YAML configuration file."""
     with open(path, "r") as file:
@@ -24,31 +17,91 @@ def load_config(path):
 
 
 def create_vector_env(config, num_envs):
-    """Create a vectorized environment for parallel training."""
-    env_fns = [lambda i=i: make_env(config, instance=i) for i in range(num_envs)]
+    """
+    Create a vectorized environment for parallel training, with the worker CPU
+    pinning, thread counts and start method of the ``resources`` config section.
+    """
+    from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv
+
+    placement = Placement(config, num_envs)
+    # Parse the reward table once here instead of in every worker
+    if "reward_dict" not in config:
+        with open(config.get("rewards_path", "configs/rewards.yaml"), "r") as file:
+            config = dict(config, reward_dict=yaml.safe_load(file))
+    if config["env"].get("kernel", False):
+        from stable_baselines3.common.vec_env import VecMonitor
+
+        from modules.kernel_env import KernelVecEnv
+
+        # All games step together in this process
+        monitor_path = config.get("monitor_path", "/home/chris/Solitaire/logs")
+        os.makedirs(monitor_path, exist_ok=True)
+        return VecMonitor(
+            KernelVecEnv(config, num_envs), os.path.join(monitor_path, "kernel")
+        )
     if config.get("debug"):
+        env_fns = [lambda i=i: make_env(config, instance=i) for i in range(num_envs)]
         envs = DummyVecEnv(env_fns)  # Replace with SubprocVecEnv for multiprocessing
     else:
-        envs = SubprocVecEnv(env_fns)
+        env_fns = [
+            placement.wrap_env_fn(lambda i=i: make_env(config, instance=i), i)
+            for i in range(num_envs)
+        ]
+        placement.prepare_start_method()
+        envs = SubprocVecEnv(env_fns, start_method=placement.start_method)
+    placement.report(subprocess_envs=not config.get("debug"))
     return envs
 
 
 def make_env(config, instance=None):
     """Environment factory that creates and wraps the environment with a Monitor."""
+    from modules.memory import MemoryMonitor
+    from modules.solitaire_env import SolitaireEnv
+
     env = SolitaireEnv(config=config, instance=instance)
     if instance is not None:
-        log_path = os.path.join("/home/chris/Solitaire/logs", f"env_{instance}")
-        env = Monitor(env, log_path)
+        monitor_path = config.get("monitor_path", "/home/chris/Solitaire/logs")
+        log_path = os.path.join(monitor_path, f"env_{instance}")
+        env = MemoryMonitor(env, log_path)
     return env
 
 
-def train_dqn_agent(vec_env, config):
-    log_path = config.get("tb_log_path", "/home/chris/Solitaire/tb_logs")
-    new_logger = configure(log_path, ["stdout", "tensorboard"])
-    model_config = config["dqn"]["model"]
+def model_settings(config):
+    """
+    Resolve ``dqn.model`` into the algorithm class and its keyword arguments.
+
+    Returns:
+        tuple: (DQN or PrioritizedDQN, model kwargs).
+    """
+    from stable_baselines3 import DQN
+
+    from modules.prioritized_dqn import PrioritizedDQN
+    from modules.replay_buffers import PrioritizedReplayBuffer, REPLAY_BUFFER_CLASSES
+
+    model_config = dict(config["dqn"]["model"])
     if isinstance(model_config.get("train_freq"), list):
         model_config["train_freq"] = tuple(model_config["train_freq"])
-    model = DQN(
+    if isinstance(model_config.get("replay_buffer_class"), str):
+        model_config["replay_buffer_class"] = REPLAY_BUFFER_CLASSES[
+            model_config["replay_buffer_class"]
+        ]
+    # Prioritized buffers need the training loop that feeds TD errors back as priorities
+    algorithm = DQN
+    buffer_class = model_config.get("replay_buffer_class")
+    if buffer_class is not None and issubclass(buffer_class, PrioritizedReplayBuffer):
+        algorithm = PrioritizedDQN
+    return algorithm, model_config
+
+
+def build_model(vec_env, config):
+    """Create the DQN model described by ``dqn.model``."""
+    from stable_baselines3.common.logger import configure
+    from stable_baselines3.dqn.policies import MlpPolicy
+
+    log_path = config.get("tb_log_path", "/home/chris/Solitaire/tb_logs")
+    new_logger = configure(log_path, ["stdout", "tensorboard"])
+    algorithm, model_config = model_settings(config)
+    model = algorithm(
         policy=MlpPolicy,
         env=vec_env,
         verbose=3,
@@ -57,7 +110,52 @@ def train_dqn_agent(vec_env, config):
     )
     model.set_logger(new_logger)
 
+    # A reopened on-disk buffer counts towards learning_starts
+    stored_transitions = model.replay_buffer.size() * model.replay_buffer.n_envs
+    if stored_transitions:
+        model.learning_starts = max(0, model.learning_starts - stored_transitions)
+        print(
+            f"Replay buffer warm start: {stored_transitions} transitions, "
+            f"learning_starts={model.learning_starts}"
+        )
+
     print(f"Model device: {model.policy.device}")
+    return model
+
+
+def load_model(path, vec_env, config, replay_buffer_path=None):
+    """Reopen a saved model to train it further, with its replay buffer if saved."""
+    from stable_baselines3.common.logger import configure
+
+    log_path = config.get("tb_log_path", "/home/chris/Solitaire/tb_logs")
+    algorithm, _ = model_settings(config)
+    model = algorithm.load(path, env=vec_env, tensorboard_log=log_path)
+    model.set_logger(configure(log_path, ["stdout", "tensorboard"]))
+    if replay_buffer_path and os.path.exists(replay_buffer_path):
+        model.load_replay_buffer(replay_buffer_path)
+    return model
+
+
+def train_dqn_agent(vec_env, config, model=None):
+    """
+    Train a new model, or keep training ``model`` until it has seen
+    ``dqn.train.total_timesteps`` steps per env in total.
+    """
+    # Pinned after the env workers have started, so they do not inherit it
+    Placement(config, vec_env.num_envs).pin_learner()
+    resume = model is not None
+    if not resume:
+        model = build_model(vec_env, config)
+        from modules.expert_data import pretrain
+
+        pretrain(model, config)
+
+    from modules.callbacks import (
+        GPUMemoryCallback,
+        CheckpointCallback,
+        InfoLoggerCallback,
+        MemoryCallback,
+    )
 
     # Instantiate your existing GPU callback
     gpu_callback = GPUMemoryCallback()
@@ -65,20 +163,32 @@ def train_dqn_agent(vec_env, config):
     # Instantiate your new Checkpoint callback
     checkpoint_callback = CheckpointCallback(
         save_freq=config["dqn"].get("save_interval",500_000),
-        save_path="/home/chris/Solitaire/checkpoints",
+        save_path=config.get("checkpoint_path", "/home/chris/Solitaire/checkpoints"),
         verbose=2,
     )
     
     info_logger_callback = InfoLoggerCallback()
 
+    memory_config = config["dqn"].get("memory", {})
+    memory_callback = MemoryCallback(
+        log_freq=memory_config.get("log_interval", 10000),
+        tracemalloc_freq=memory_config.get("tracemalloc_interval", 0),
+        tracemalloc_top=memory_config.get("tracemalloc_top", 10),
+        verbose=1,
+    )
+
     # Combine callbacks
     from stable_baselines3.common.callbacks import CallbackList
 
-    callback_list = CallbackList([gpu_callback, checkpoint_callback, info_logger_callback])
+    callback_list = CallbackList(
+        [gpu_callback, checkpoint_callback, info_logger_callback, memory_callback]
+    )
 
     # Train with both callbacks
     model.learn(
-        total_timesteps=config["dqn"]["train"]["total_timesteps"] * vec_env.num_envs,
+        total_timesteps=config["dqn"]["train"]["total_timesteps"] * vec_env.num_envs
+        - (model.num_timesteps if resume else 0),
+        reset_num_timesteps=not resume,
         tb_log_name="DQN_Solitaire",
         log_interval=config["dqn"]["train"].get("log_interval", 4),
         callback=callback_list,
@@ -88,23 +198,12 @@ def train_dqn_agent(vec_env, config):
     return model
 
 
-def test_dqn_agent(model, env, config):
-    """Evaluate and test the trained agent."""
-    mean_reward, std_reward = evaluate_policy(
-        model, env, n_eval_episodes=config["dqn"]["test"].get("episodes", 10)
-    )
-    print(f"Mean reward: {mean_reward}, std: {std_reward}")
-    obs, info = env.reset()
-    for step in range(config["dqn"]["test"].get("steps", 10000)):
-        action, _ = model.predict(obs, deterministic=True)
-        obs, rewards, terminated, truncated, info = env.step(action)
-        if terminated or truncated:
-            env.render()
-            obs, _ = env.reset()
-
-
 if __name__ == "__main__":
-    config = load_config("/home/chris/Solitaire/configs/config.yaml")
+    parser = argparse.ArgumentParser(description="Train a DQN agent on Solitaire.")
+    parser.add_argument("--config", default="/home/chris/Solitaire/configs/config.yaml")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
     log_path = config.get("log_path", "/home/chris/Solitaire/logs")
     if config.get("clear_logs", False):
         shutil.rmtree(log_path, ignore_errors=True)
@@ -125,8 +224,9 @@ if __name__ == "__main__":
     model_path = "/home/chris/Solitaire/models/dqn_solitaire"
     model.save(model_path)
 
-    test_env = make_env(
-        config, instance="test"
-    )  # Single environment for testing without a unique log path
-    test_dqn_agent(model, test_env, config)
+    # Win rate on the fixed evaluation deals, comparable between checkpoints
+    evaluation = config["dqn"]["test"].get("evaluation", {})
+    from modules.evaluation import evaluate_checkpoints
+
+    evaluate_checkpoints([model_path + ".zip"], config, **evaluation)
     print("Done!")
@@ -0,0 +1,149 @@
+import numpy as np
+
+# Env actions encode (source stack, destination stack, number of cards) as
+# (source * (num_t_stacks + 4) + dest) * MAX_CARDS_PER_MOVE + num_cards - 1, with the
+# last action of the space dealing the next cards. Stack indices are the tableau
+# stacks, then the foundations f1-f4, then the next cards as a source.
+MAX_CARDS_PER_MOVE = 13
+
+
+def num_actions(num_t_stacks):
+    """Size of the env action space."""
+    return (num_t_stacks + 5) * (num_t_stacks + 4) * MAX_CARDS_PER_MOVE + 1
+
+
+def deal_source_index(num_t_stacks):
+    """Source index decode_action returns for the deal action."""
+    return num_t_stacks + 5
+
+
+def decode_action(action, num_t_stacks):
+    """
+    Decode an env action.
+
+    Returns:
+        tuple: (source index, destination index, number of cards).
+    """
+    num_destinations = num_t_stacks + 4
+    if action == num_actions(num_t_stacks) - 1:
+        return deal_source_index(num_t_stacks), 1, 1
+    source_stack = action // (num_destinations * MAX_CARDS_PER_MOVE)
+    action %= num_destinations * MAX_CARDS_PER_MOVE
+    destination_stack = action // MAX_CARDS_PER_MOVE
+    num_cards = action % MAX_CARDS_PER_MOVE + 1
+    return source_stack, destination_stack, num_cards
+
+
+def encode_action(source_idx, dest_idx, num_cards, num_t_stacks):
+    """Inverse of decode_action for a move between stacks."""
+    num_destinations = num_t_stacks + 4
+    return (source_idx * num_destinations + dest_idx) * MAX_CARDS_PER_MOVE + num_cards - 1
+
+
+def _fits_on(card, top_card):
+    # A card goes on a tableau stack with this top card (None: empty stack)
+    if top_card is None:
+        return card.number == 13
+    return top_card.color != card.color and top_card.number == card.number + 1
+
+
+def action_mask(game):
+    """
+    Legal actions of a game, following the rules of Solitaire.validate_move.
+
+    Dealing is always allowed, so every mask has at least one legal action.
+
+    Returns:
+        np.ndarray: Boolean mask over the env action space.
+    """
+    num_t_stacks = game.num_t_stacks
+    mask = np.zeros(num_actions(num_t_stacks), dtype=bool)
+    mask[-1] = True
+    tops = [stack.get_top_card() for stack in game.t_stack]
+    foundation_index = {
+        suit: num_t_stacks + idx for idx, suit in enumerate(game.foundation.keys())
+    }
+
+    for source, stack in enumerate(game.t_stack):
+        visible = 0
+        while visible < len(stack.cards) and stack.cards[-visible - 1].visible:
+            visible += 1
+        for num_cards in range(1, min(visible, MAX_CARDS_PER_MOVE) + 1):
+            card = stack.cards[-num_cards]
+            if num_cards == 1 and game.can_move_to_foundation(card):
+                mask[encode_action(source, foundation_index[card.suit], 1, num_t_stacks)] = True
+            for dest, top_card in enumerate(tops):
+                if dest != source and _fits_on(card, top_card):
+                    mask[encode_action(source, dest, num_cards, num_t_stacks)] = True
+
+    for suit, stack in game.foundation.items():
+        card = stack.get_top_card()
+        if card is not None:
+            for dest, top_card in enumerate(tops):
+                if _fits_on(card, top_card):
+                    mask[encode_action(foundation_index[suit], dest, 1, num_t_stacks)] = True
+
+    card = game.next_cards.get_top_card()
+    if card is not None:
+        source = num_t_stacks + 4
+        if game.can_move_to_foundation(card):
+            mask[encode_action(source, foundation_index[card.suit], 1, num_t_stacks)] = True
+        for dest, top_card in enumerate(tops):
+            if _fits_on(card, top_card):
+                mask[encode_action(source, dest, 1, num_t_stacks)] = True
+    return mask
+
+
+def stack_id(idx, num_t_stacks):
+    """Map a stack index to its identifier in Solitaire.execute_move."""
+    if idx < num_t_stacks:
+        return str(idx + 1)  # Tableau stacks
+    elif num_t_stacks - 1 < idx < num_t_stacks + 4:
+        return f"f{idx + 1 - num_t_stacks}"  # Foundation stacks
+    elif idx == num_t_stacks + 4:
+        return "n"  # Next cards stack
+    else:
+        raise ValueError(f"Invalid stack index: {idx}")
+
+
+def play_action(game, source_idx, dest_idx, num_cards, env_config):
+    """
+    Play a decoded action on a game, including the automatic moves the env settings
+    add to it (``macro_actions``, ``auto_complete``).
+
+    Args:
+        game (Solitaire): The game.
+        source_idx (int): Source stack index, or deal_source_index for a deal.
+        dest_idx (int): Destination stack index.
+        num_cards (int): Number of cards to move.
+        env_config (dict): The ``env`` section of the config.
+
+    Returns:
+        tuple: (move_result, messages) - whether a move was made and the reward
+            messages of everything played.
+    """
+    macro_actions = env_config.get("macro_actions", False)
+    if source_idx == deal_source_index(game.num_t_stacks):
+        if macro_actions:
+            messages = game.deal_until_playable()
+        else:
+            messages = game.deal_next_cards()
+        move_result = False
+    else:
+        move_result, messages = game.execute_move(
+            stack_id(source_idx, game.num_t_stacks),
+            stack_id(dest_idx, game.num_t_stacks),
+            num_cards=num_cards,
+        )
+
+    if macro_actions:
+        # Collapse forced follow-up moves into this step, keeping their rewards
+        auto_messages = game.apply_safe_foundation_moves()
+        if auto_messages:
+            messages = messages + auto_messages
+            move_result = True
+
+    if env_config.get("auto_complete", False) and game.can_auto_complete():
+        messages = messages + game.auto_complete()
+        move_result = True
+    return move_result, messages
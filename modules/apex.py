@@ -0,0 +1,364 @@
+import argparse
+import contextlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+import yaml
+
+from modules.inference import NumpyQNetwork
+from modules.solitaire_env import SolitaireEnv
+
+
+def actor_epsilon(actor_id, num_actors, epsilon=0.4, alpha=7.0):
+    """
+    Exploration rate of an actor, from ``epsilon`` for the first actor down to
+    ``epsilon ** (1 + alpha)`` for the last (Horgan et al., 2018).
+    """
+    if num_actors <= 1:
+        return epsilon
+    return epsilon ** (1 + actor_id / (num_actors - 1) * alpha)
+
+
+def parse_address(address):
+    """``"host:port"`` or ``[host, port]`` to a (host, port) tuple."""
+    if isinstance(address, str):
+        host, port = address.rsplit(":", 1)
+        return host, int(port)
+    return address[0], int(address[1])
+
+
+def td_priorities(network, transitions, gamma):
+    """
+    Absolute one-step TD errors of a batch under an actor's copy of the network,
+    used as the initial replay priorities.
+    """
+    q_values = network.q_values(transitions["obs"])
+    next_q_values = network.q_values(transitions["next_obs"]).max(axis=1)
+    current = q_values[np.arange(len(q_values)), transitions["actions"]]
+    # Truncated episodes still bootstrap from the next state
+    terminal = transitions["dones"] & ~transitions["timeouts"]
+    targets = transitions["rewards"] + gamma * (1 - terminal) * next_q_values
+    return np.abs(targets - current)
+
+
+class Actor(object):
+    def __init__(self, address, authkey, config, actor_id, num_actors):
+        """
+        Ape-X actor: plays SolitaireEnv with an epsilon-greedy copy of the learner's
+        network and sends transitions with their TD error priorities to the learner.
+
+        Args:
+            address: Learner address, see parse_address.
+            authkey (bytes): Shared connection secret.
+            config (dict): The training config, with its ``apex`` section.
+            actor_id (int): Index of this actor.
+            num_actors (int): Total number of actors, sets this actor's epsilon.
+        """
+        self.config = config
+        apex_config = config["apex"]
+        self.actor_id = actor_id
+        self.epsilon = actor_epsilon(
+            actor_id,
+            num_actors,
+            apex_config.get("epsilon", 0.4),
+            apex_config.get("epsilon_alpha", 7.0),
+        )
+        self.send_size = apex_config.get("send_size", 50)
+        self.gamma = config["dqn"]["model"].get("gamma", 0.99)
+        self.rng = np.random.default_rng(actor_id)
+        self.connection = self.connect(parse_address(address), authkey)
+        self.network = None
+        self.version = -1
+
+    @staticmethod
+    def connect(address, authkey, timeout=60):
+        # A remote learner may still be building its model
+        deadline = time.time() + timeout
+        while True:
+            try:
+                return Client(address, authkey=authkey)
+            except ConnectionRefusedError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(1)
+
+    def request(self, message):
+        """Send a message and apply the weights the learner sends back, if any."""
+        self.connection.send(message)
+        version, weights, stop = self.connection.recv()
+        if weights is not None:
+            self.network = NumpyQNetwork(*weights)
+            self.version = version
+        return stop
+
+    def act(self, env, obs):
+        if self.network is None or self.rng.random() < self.epsilon:
+            return int(self.rng.integers(env.action_space.n))
+        return int(self.network.predict(obs[None])[0])
+
+    def run(self):
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            env = SolitaireEnv(config=self.config, instance=f"actor_{self.actor_id}")
+            stop = self.request(("hello", self.actor_id, self.version))
+            obs, _ = env.reset()
+            rows = []
+            episodes = []
+            episode_reward = 0.0
+            episode_length = 0
+            while not stop:
+                action = self.act(env, obs)
+                next_obs, reward, terminated, truncated, _ = env.step(action)
+                rows.append((obs, next_obs, action, reward, terminated or truncated, truncated and not terminated))
+                episode_reward += reward
+                episode_length += 1
+                obs = next_obs
+                if terminated or truncated:
+                    episodes.append((episode_reward, episode_length, env.game.complete))
+                    episode_reward, episode_length = 0.0, 0
+                    obs, _ = env.reset()
+                if len(rows) >= self.send_size:
+                    transitions = {
+                        "obs": np.stack([row[0] for row in rows]),
+                        "next_obs": np.stack([row[1] for row in rows]),
+                        "actions": np.array([row[2] for row in rows]),
+                        "rewards": np.array([row[3] for row in rows], dtype=np.float32),
+                        "dones": np.array([row[4] for row in rows]),
+                        "timeouts": np.array([row[5] for row in rows]),
+                    }
+                    if self.network is None:
+                        transitions["priorities"] = np.ones(len(rows))
+                    else:
+                        transitions["priorities"] = td_priorities(
+                            self.network, transitions, self.gamma
+                        )
+                    stop = self.request(
+                        ("transitions", self.actor_id, self.version, transitions, episodes)
+                    )
+                    rows, episodes = [], []
+            env.close()
+        self.connection.close()
+
+
+def run_actor(address, authkey, config, actor_id, num_actors):
+    Actor(address, authkey, config, actor_id, num_actors).run()
+
+
+class Learner(object):
+    def __init__(self, config):
+        """
+        Ape-X learner: owns the prioritized replay buffer and the DQN model, accepts
+        actor connections over local sockets (TCP, so actors may run on other hosts)
+        and trains continuously while actors keep generating experience.
+
+        Args:
+            config (dict): The training config. Model settings come from
+                ``dqn.model``, the distributed settings from ``apex``.
+        """
+        from stable_baselines3.common.logger import configure
+
+        from modules.prioritized_dqn import PrioritizedDQN
+        from modules.replay_buffers import PrioritizedReplayBuffer, REPLAY_BUFFER_CLASSES
+
+        self.config = config
+        apex_config = config["apex"]
+        model_config = dict(config["dqn"]["model"])
+        # Rollout settings belong to the actors
+        for key in ["train_freq", "gradient_steps", "exploration_fraction", "exploration_final_eps"]:
+            model_config.pop(key, None)
+        buffer_class = REPLAY_BUFFER_CLASSES[
+            model_config.pop("replay_buffer_class", "PrioritizedReplayBuffer")
+        ]
+        if not issubclass(buffer_class, PrioritizedReplayBuffer):
+            raise ValueError("The Ape-X learner needs a prioritized replay buffer.")
+
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            env = SolitaireEnv(config=config, instance="learner")
+        self.model = PrioritizedDQN(
+            "MlpPolicy", env, replay_buffer_class=buffer_class, **model_config
+        )
+        log_path = config.get("tb_log_path", "/home/chris/Solitaire/tb_logs")
+        self.model.set_logger(configure(log_path, ["stdout", "tensorboard"]))
+
+        self.address = parse_address(apex_config.get("address", ["localhost", 6000]))
+        self.authkey = apex_config.get("authkey", "solitaire").encode()
+        self.total_timesteps = config["dqn"]["train"]["total_timesteps"]
+        self.gradient_steps = apex_config.get("gradient_steps", 4)
+        self.target_update_interval = apex_config.get("target_update_interval", 2500)
+        self.weight_sync_interval = apex_config.get("weight_sync_interval", 100)
+        self.save_interval = config["dqn"].get("save_interval", 500_000)
+        self.save_path = apex_config.get("save_path", "/home/chris/Solitaire/checkpoints")
+
+        # Batches received by the connection threads. Only the training loop touches
+        # the buffer, adding them between gradient steps, so actors never wait on it
+        self.incoming = queue.Queue()
+        self.weights = None
+        self.version = 0
+        self.publish_weights()
+        self.timesteps = 0
+        self.episodes = []
+        self.stop = threading.Event()
+        # Bound before any actor starts, so connections queue until serve accepts them
+        self.listener = Listener(self.address, authkey=self.authkey)
+
+    def publish_weights(self):
+        network = NumpyQNetwork.from_model(self.model)
+        # Actors rebuild NumpyQNetwork from these arrays, no torch needed on their side
+        self.weights = ([w.T for w in network.weights], network.biases, network.activations)
+        self.version += 1
+
+    def serve(self):
+        while True:
+            connection = self.listener.accept()
+            if self.stop.is_set():
+                # The wake-up connection made by train once training is done
+                connection.close()
+                break
+            threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+        self.listener.close()
+
+    def handle(self, connection):
+        try:
+            while True:
+                message = connection.recv()
+                if message[0] == "transitions":
+                    _, _, _, transitions, episodes = message
+                    self.incoming.put((transitions, episodes))
+                actor_version = message[2]
+                weights = self.weights if actor_version != self.version else None
+                connection.send((self.version, weights, self.stop.is_set()))
+        except (EOFError, ConnectionResetError):
+            connection.close()
+
+    def add_incoming(self):
+        """Add the batches received since the last call to the replay buffer."""
+        # Only those queued now, so fast actors cannot keep the learner from training
+        for _ in range(self.incoming.qsize()):
+            transitions, episodes = self.incoming.get_nowait()
+            self.model.replay_buffer.add_batch(
+                transitions["obs"],
+                transitions["next_obs"],
+                transitions["actions"],
+                transitions["rewards"],
+                transitions["dones"],
+                transitions["timeouts"],
+                transitions["priorities"],
+            )
+            self.timesteps += len(transitions["actions"])
+            self.episodes.extend(episodes)
+
+    def train(self):
+        from stable_baselines3.common.utils import polyak_update
+
+        threading.Thread(target=self.serve, daemon=True).start()
+        model = self.model
+        learning_starts = model.learning_starts
+        last_target_update = last_sync = last_save = last_log = 0
+        start = time.time()
+        while self.timesteps < self.total_timesteps:
+            self.add_incoming()
+            if model.replay_buffer.size() < max(learning_starts, model.batch_size):
+                time.sleep(0.1)
+                continue
+            model._current_progress_remaining = 1.0 - self.timesteps / self.total_timesteps
+            model.train(gradient_steps=self.gradient_steps, batch_size=model.batch_size)
+            if model._n_updates - last_target_update >= self.target_update_interval:
+                polyak_update(model.q_net.parameters(), model.q_net_target.parameters(), model.tau)
+                polyak_update(model.batch_norm_stats, model.batch_norm_stats_target, 1.0)
+                last_target_update = model._n_updates
+            if model._n_updates - last_sync >= self.weight_sync_interval:
+                self.publish_weights()
+                last_sync = model._n_updates
+            if self.timesteps - last_save >= self.save_interval:
+                os.makedirs(self.save_path, exist_ok=True)
+                model.save(os.path.join(self.save_path, f"apex_{self.timesteps}_steps.zip"))
+                last_save = self.timesteps
+            if model._n_updates - last_log >= 1000:
+                self.log(start)
+                last_log = model._n_updates
+        self.stop.set()
+        # Wake serve from accept so it closes the listener, connected actors still
+        # get the stop flag in their replies
+        Client(self.address, authkey=self.authkey).close()
+        return model
+
+    def log(self, start):
+        elapsed = time.time() - start
+        episodes, self.episodes = self.episodes, []
+        logger = self.model.logger
+        logger.record("apex/env_steps_per_second", self.timesteps / elapsed)
+        logger.record("apex/updates_per_second", self.model._n_updates / elapsed)
+        logger.record("apex/buffer_size", self.model.replay_buffer.size())
+        logger.record("apex/weights_version", self.version)
+        if episodes:
+            logger.record("rollout/ep_rew_mean", np.mean([e[0] for e in episodes]))
+            logger.record("rollout/ep_len_mean", np.mean([e[1] for e in episodes]))
+            logger.record("rollout/win_rate", np.mean([e[2] for e in episodes]))
+        logger.dump(self.timesteps)
+
+
+def start_actors(config, num_actors, first_actor=0, total_actors=None):
+    """Start actor processes on this machine."""
+    apex_config = config["apex"]
+    address = apex_config.get("address", ["localhost", 6000])
+    authkey = apex_config.get("authkey", "solitaire").encode()
+    total_actors = total_actors or num_actors
+    actors = []
+    for actor_id in range(first_actor, first_actor + num_actors):
+        process = multiprocessing.Process(
+            target=run_actor,
+            args=(address, authkey, config, actor_id, total_actors),
+            daemon=True,
+        )
+        process.start()
+        actors.append(process)
+    return actors
+
+
+def train_apex(config):
+    """
+    Train with a learner in this process and ``apex.num_actors`` local actors.
+
+    Returns:
+        DQN: The trained model.
+    """
+    learner = Learner(config)
+    actors = start_actors(config, config["apex"].get("num_actors", 4))
+    model = learner.train()
+    for actor in actors:
+        actor.join(timeout=10)
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ape-X style distributed DQN training.")
+    parser.add_argument("role", choices=["learner", "actors"])
+    parser.add_argument("--config", default="configs/config.yaml")
+    parser.add_argument(
+        "--num-actors", type=int, default=None, help="Actors to start on this host."
+    )
+    parser.add_argument(
+        "--first-actor", type=int, default=0, help="Index of this host's first actor."
+    )
+    parser.add_argument(
+        "--total-actors", type=int, default=None, help="Actors across all hosts."
+    )
+    parser.add_argument("--output", default="/home/chris/Solitaire/models/apex_solitaire")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as file:
+        config = yaml.safe_load(file)
+    if args.role == "learner":
+        if args.num_actors is not None:
+            config["apex"]["num_actors"] = args.num_actors
+        model = train_apex(config)
+        model.save(args.output)
+    else:
+        # Actors for a learner on another host, at apex.address
+        num_actors = args.num_actors or config["apex"].get("num_actors", 4)
+        for actor in start_actors(config, num_actors, args.first_actor, args.total_actors):
+            actor.join()
@@ -0,0 +1,136 @@
+import argparse
+import contextlib
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+# Worker start modes compared by the startup benchmark: (start method, forkserver preload)
+STARTUP_MODES = [
+    ("fork", False),
+    ("spawn", False),
+    ("forkserver", False),
+    ("forkserver", True),
+]
+
+
+def benchmark_config(config, start_method, preload, log_path):
+    """Copy of a training config that starts SubprocVecEnv workers in the given mode."""
+    config = dict(config, debug=False, log_path=log_path, monitor_path=log_path)
+    config["env"] = dict(config.get("env", {}), record_games=False)
+    config["resources"] = dict(
+        config.get("resources") or {},
+        start_method=start_method,
+        preload=preload,
+        auto=False,
+        learner_cpus=None,
+        env_cpus=None,
+    )
+    return config
+
+
+def first_step(config, num_envs):
+    """
+    Start the training env workers and take one step.
+
+    Returns:
+        dict: Seconds to import dqn.py, to start the workers and reset them, and to
+            take the first step.
+    """
+    start = time.perf_counter()
+    from dqn import create_vector_env
+
+    imported = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        envs = create_vector_env(config, num_envs=num_envs)
+        envs.reset()
+        reset = time.perf_counter()
+        envs.step([envs.action_space.n - 1] * num_envs)  # Deal in every env
+        stepped = time.perf_counter()
+        envs.close()
+    return {
+        "import": imported - start,
+        "start_and_reset": reset - imported,
+        "first_step": stepped - start,
+    }
+
+
+def time_to_first_step(config_path, num_envs, start_method, preload, repeats=3):
+    """
+    Measure time to first step in fresh interpreters, since a forkserver and the
+    imports of the parent are only paid once per process.
+
+    Returns:
+        dict: Median of each timing of :func:`first_step`, plus ``process``, the wall
+            time of the whole interpreter run.
+    """
+    runs = []
+    for _ in range(repeats):
+        command = [
+            sys.executable,
+            "-m",
+            "modules.benchmark",
+            "first-step",
+            "--config",
+            config_path,
+            "--num-envs",
+            str(num_envs),
+            "--start-method",
+            start_method,
+        ]
+        if preload:
+            command.append("--preload")
+        start = time.perf_counter()
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        timings = yaml.safe_load(output.strip().splitlines()[-1])
+        timings["process"] = time.perf_counter() - start
+        runs.append(timings)
+    return {key: sorted(run[key] for run in runs)[len(runs) // 2] for key in runs[0]}
+
+
+def startup_benchmark(config_path, num_envs=4, repeats=3):
+    """Print time to first step of every mode of :data:`STARTUP_MODES`."""
+    print(f"Time to first step, {num_envs} env workers, median of {repeats} runs:")
+    results = {}
+    for start_method, preload in STARTUP_MODES:
+        name = start_method + (" + preload" if preload else "")
+        results[name] = timings = time_to_first_step(
+            config_path, num_envs, start_method, preload, repeats
+        )
+        print(
+            f"  {name:<22} first step {timings['first_step']:6.2f}s "
+            f"(import {timings['import']:.2f}s, "
+            f"workers {timings['start_and_reset']:.2f}s), "
+            f"process {timings['process']:.2f}s"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solitaire training benchmarks.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    startup_parser = subparsers.add_parser(
+        "startup", help="Time to first step of each worker start method."
+    )
+    first_step_parser = subparsers.add_parser(
+        "first-step", help="One time to first step measurement (used by startup)."
+    )
+    for subparser in [startup_parser, first_step_parser]:
+        subparser.add_argument("--config", default="configs/config.yaml")
+        subparser.add_argument("--num-envs", type=int, default=4)
+    startup_parser.add_argument("--repeats", type=int, default=3)
+    first_step_parser.add_argument("--start-method", default="forkserver")
+    first_step_parser.add_argument("--preload", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "startup":
+        startup_benchmark(args.config, args.num_envs, args.repeats)
+    else:
+        with open(args.config, "r") as file:
+            config = yaml.safe_load(file)
+        with tempfile.TemporaryDirectory() as log_path:
+            config = benchmark_config(config, args.start_method, args.preload, log_path)
+            print(yaml.safe_dump(first_step(config, args.num_envs), default_flow_style=True))
@@ -63,4 +63,63 @@ class InfoLoggerCallback(BaseCallback):
             if "move_count" in info:
                 self.logger.record("custom/move_count", info["move_count"])
 
-        return True
\ No newline at end of file
+        return True
+
+
+class MemoryCallback(BaseCallback):
+    """
+    Logs the memory held by each component of training to TensorBoard under
+    ``memory/``: replay storage and the learner's RSS, and for the envs the engine
+    undo history, logs and observation buffers, summed over all envs and for the
+    largest env (``memory/env_max/...``) to size machines by worker count.
+
+    With ``tracemalloc_freq`` set, the learner process is also traced and the
+    allocation sites that grew most are printed every ``tracemalloc_freq`` steps.
+    """
+    def __init__(self, log_freq=10000, tracemalloc_freq=0, tracemalloc_top=10, verbose=0):
+        super(MemoryCallback, self).__init__(verbose)
+        self.log_freq = log_freq
+        self.tracemalloc_freq = tracemalloc_freq
+        self.tracemalloc_top = tracemalloc_top
+        self.tracemalloc_diff = None
+
+    def _on_training_start(self) -> None:
+        if self.tracemalloc_freq:
+            from modules.memory import TracemallocDiff
+
+            self.tracemalloc_diff = TracemallocDiff(top=self.tracemalloc_top)
+
+    def _on_step(self) -> bool:
+        if self.log_freq and self.n_calls % self.log_freq == 0:
+            self.log_memory()
+        if self.tracemalloc_diff is not None and self.n_calls % self.tracemalloc_freq == 0:
+            traced = self.tracemalloc_diff.report()
+            self.logger.record("memory/learner/tracemalloc_MB", traced / 1024 / 1024)
+        return True
+
+    def log_memory(self):
+        from modules.memory import replay_buffer_memory, vec_env_memory
+
+        mb = 1024 * 1024
+        self.logger.record(
+            "memory/learner/rss_MB", psutil.Process().memory_info().rss / mb
+        )
+        replay_buffer = getattr(self.model, "replay_buffer", None)
+        if replay_buffer is not None:
+            for component, size in replay_buffer_memory(replay_buffer).items():
+                self.logger.record(f"memory/{component}_MB", size / mb)
+
+        reports = vec_env_memory(self.training_env)
+        components = sorted(set(component for report in reports for component in report))
+        for component in components:
+            sizes = [report.get(component, 0) for report in reports]
+            self.logger.record(f"memory/{component}_MB", sum(sizes) / mb)
+            self.logger.record(f"memory/env_max/{component}_MB", max(sizes) / mb)
+        totals = [sum(report.values()) for report in reports]
+        self.logger.record("memory/env_total_MB", sum(totals) / mb)
+        self.logger.record("memory/env_max/total_MB", max(totals) / mb)
+        if self.verbose > 0:
+            print(
+                f"Memory: learner RSS {psutil.Process().memory_info().rss / mb:.1f} MB, "
+                f"envs {sum(totals) / mb:.1f} MB (largest {max(totals) / mb:.1f} MB)"
+            )
@@ -0,0 +1,65 @@
+from modules.state import RANK, SUIT, state_from_game
+
+# Suit permutations (Hearts, Diamonds, Clubs, Spades order) that swap suits of the
+# same color. The rules only look at rank and color, so these are symmetries.
+SAME_COLOR_SUIT_MAPS = [(0, 1, 2, 3), (1, 0, 2, 3), (0, 1, 3, 2), (1, 0, 3, 2)]
+# Card code translation table for each suit permutation
+_CODE_MAPS = [
+    [0] + [suit_map[SUIT[code]] * 13 + RANK[code] for code in range(1, 53)]
+    for suit_map in SAME_COLOR_SUIT_MAPS
+]
+
+
+def _sorted_tableau(tableau):
+    # Columns sort by their contents; empty columns all become (0, ()) and sort first
+    return tuple(sorted(tableau))
+
+
+def _remap(state, code_map, suit_map):
+    tableau, foundation, stock, pointer, num_next = state
+    tableau = tuple(
+        (hidden, tuple(code_map[code] for code in cards)) for hidden, cards in tableau
+    )
+    remapped_foundation = [0] * 4
+    for suit, count in enumerate(foundation):
+        remapped_foundation[suit_map[suit]] = count
+    stock = tuple(code_map[code] for code in stock)
+    return tableau, tuple(remapped_foundation), stock, pointer, num_next
+
+
+def canonical_state(state, remap_suits=False):
+    """
+    Reduce a compact solver state to a canonical representative.
+
+    Positions that only differ by the order of the tableau stacks (including which
+    stacks are empty) map to the same canonical state. Foundations are already
+    stored per suit, so their f1-f4 order never matters. With ``remap_suits``, the
+    two red suits and the two black suits may also be swapped, and the smallest of
+    the four variants is kept.
+
+    Args:
+        state (tuple): A state from :func:`modules.state.state_from_game`.
+        remap_suits (bool): Also collapse same-color suit swaps (4x the work).
+
+    Returns:
+        tuple: The canonical state, usable as a dict/set key.
+    """
+    tableau, foundation, stock, pointer, num_next = state
+    canonical = (_sorted_tableau(tableau), foundation, stock, pointer, num_next)
+    if not remap_suits:
+        return canonical
+    for code_map, suit_map in zip(_CODE_MAPS[1:], SAME_COLOR_SUIT_MAPS[1:]):
+        tableau, foundation, stock, pointer, num_next = _remap(state, code_map, suit_map)
+        variant = (_sorted_tableau(tableau), foundation, stock, pointer, num_next)
+        canonical = min(canonical, variant)
+    return canonical
+
+
+def canonical_hash(state, remap_suits=False):
+    """Hash of the canonical form of a compact solver state."""
+    return hash(canonical_state(state, remap_suits=remap_suits))
+
+
+def canonical_game_hash(game, remap_suits=False):
+    """Hash of the canonical form of a Solitaire game."""
+    return canonical_hash(state_from_game(game), remap_suits=remap_suits)
@@ -1,11 +1,14 @@
 class Card(object):
     SUIT_SYMBOLS = {"Hearts": "♥", "Diamonds": "♦", "Clubs": "♣", "Spades": "♠"}
     SPECIAL_VALUES = {1: "A", 11: "J", 12: "Q", 13: "K"}
+    # Offsets of the 1-52 card codes shared by the env observation and the solver
+    SUIT_OFFSETS = {"Hearts": 0, "Diamonds": 13, "Clubs": 26, "Spades": 39}
+    RED_SUITS = ["Hearts", "Diamonds"]
 
     def __init__(self, suit, number):
         self.suit = suit
         self.number = number
-        self.color = "red" if suit in ["Hearts", "Diamonds"] else "black"
+        self.color = "red" if suit in Card.RED_SUITS else "black"
         self.visible = False
 
 
@@ -25,3 +28,10 @@ class Card(object):
 
     def set_visible(self, visibility):
         self.visible = visibility
+
+    def code(self):
+        """
+        Encode the card as an integer from 1 to 52 (Hearts, Diamonds, Clubs, Spades).
+        """
+        return Card.SUIT_OFFSETS[self.suit] + self.number
+
@@ -0,0 +1,231 @@
+import argparse
+import os
+import time
+import zlib
+
+import numpy as np
+import yaml
+
+from modules.solver import SOLVED, UNSOLVABLE, deal_game, solve_seeds
+
+# One 13-byte record per deal. status: 1 solvable, 0 unsolvable, -1 unknown (budget ran out)
+DEAL_INDEX_DTYPE = np.dtype(
+    [
+        ("seed", "<u4"),
+        ("status", "i1"),
+        ("moves", "<u2"),
+        ("nodes", "<u4"),
+        ("hidden_depth", "<u2"),
+    ]
+)
+STATUS_CODES = {SOLVED: 1, UNSOLVABLE: 0}
+# Config keys that change which deals are winnable
+INDEX_CONFIG_KEYS = ["cards_per_turn", "num_t_stacks"]
+
+
+def hidden_depth(game):
+    """
+    Number of tableau cards covering the aces and twos of a freshly dealt game.
+
+    Low cards buried under many face-down cards are the main reason a deal is hard,
+    so this is a cheap difficulty estimate that needs no search.
+    """
+    depth = 0
+    for stack in game.t_stack:
+        for position, card in enumerate(stack.cards):
+            if card.number <= 2:
+                depth += len(stack.cards) - 1 - position
+    return depth
+
+
+def _metadata_path(path):
+    return os.path.splitext(path)[0] + ".yaml"
+
+
+def build_deal_index(path, seeds, config, processes=None, **solver_kwargs):
+    """
+    Solve a range of deals in parallel and store the results as a deal index.
+
+    The index is a ``.npy`` array of :data:`DEAL_INDEX_DTYPE` records in seed order,
+    written through a memmap as results arrive, plus a YAML file with the game
+    settings it was built for. ``moves`` is the length of the solution found, an
+    upper bound on the minimal number of moves.
+
+    Args:
+        path (str): Output ``.npy`` file.
+        seeds (iterable): Deal seeds to index.
+        config (dict): Game configuration.
+        processes (int, optional): Worker processes for the solver.
+        **solver_kwargs: Budgets passed to :class:`modules.solver.Solver`.
+
+    Returns:
+        np.ndarray: The index, memory-mapped.
+    """
+    seeds = list(seeds)
+    positions = {seed: position for position, seed in enumerate(seeds)}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    index = np.lib.format.open_memmap(
+        path, mode="w+", dtype=DEAL_INDEX_DTYPE, shape=(len(seeds),)
+    )
+    index["seed"] = seeds
+    index["status"] = -1
+
+    for result in solve_seeds(seeds, config, processes=processes, **solver_kwargs):
+        position = positions[result.seed]
+        index["status"][position] = STATUS_CODES.get(result.status, -1)
+        index["moves"][position] = min(len(result.moves), np.iinfo(np.uint16).max)
+        index["nodes"][position] = min(result.nodes, np.iinfo(np.uint32).max)
+        index["hidden_depth"][position] = hidden_depth(deal_game(config, result.seed))
+    index.flush()
+
+    metadata = {key: config.get(key) for key in INDEX_CONFIG_KEYS}
+    metadata["solver"] = solver_kwargs
+    with open(_metadata_path(path), "w") as file:
+        yaml.safe_dump(metadata, file)
+    return index
+
+
+def load_deal_index(path, config=None):
+    """
+    Open a deal index without reading it into memory.
+
+    Args:
+        path (str): The ``.npy`` file written by :func:`build_deal_index`.
+        config (dict, optional): If given, the index must have been built for the
+            same ``cards_per_turn`` and ``num_t_stacks``.
+
+    Returns:
+        np.ndarray: Read-only memory-mapped records.
+    """
+    if config is not None and os.path.exists(_metadata_path(path)):
+        with open(_metadata_path(path), "r") as file:
+            metadata = yaml.safe_load(file)
+        for key in INDEX_CONFIG_KEYS:
+            if metadata.get(key) != config.get(key):
+                raise ValueError(
+                    f"Deal index {path} was built with {key}={metadata.get(key)}, "
+                    f"config has {config.get(key)}"
+                )
+    return np.load(path, mmap_mode="r")
+
+
+class DealSampler(object):
+    def __init__(
+        self,
+        index,
+        num_buckets=4,
+        curriculum_episodes=0,
+        include_unknown=False,
+        random_seed=None,
+    ):
+        """
+        Sample deal seeds from a deal index by difficulty bucket.
+
+        Solvable deals are split into ``num_buckets`` equally sized buckets by solver
+        effort (nodes, then solution length), bucket 0 being the easiest. Deals
+        proven unsolvable (status 0) are never sampled.
+
+        The curriculum unlocks buckets in order: as ``episodes`` goes from 0 to
+        ``curriculum_episodes``, a frontier moves from bucket 0 to the hardest bucket.
+        Buckets behind the frontier are sampled uniformly and the next one is phased in. With ``curriculum_episodes`` at 0,
+        every bucket is available from the start.
+
+        Args:
+            index (np.ndarray): Records from :func:`load_deal_index`.
+            num_buckets (int): Number of difficulty buckets.
+            curriculum_episodes (int): Episodes until every bucket is unlocked.
+            include_unknown (bool): Put deals the solver gave up on in the hardest bucket.
+            random_seed (int, optional): Seed of the sampler's generator.
+        """
+        solvable = index[index["status"] == 1]
+        order = np.lexsort((solvable["moves"], solvable["nodes"]))
+        self.buckets = [
+            np.array(bucket, dtype=np.int64)
+            for bucket in np.array_split(solvable["seed"][order], num_buckets)
+        ]
+        if include_unknown:
+            unknown = index["seed"][index["status"] == -1].astype(np.int64)
+            self.buckets[-1] = np.concatenate([self.buckets[-1], unknown])
+        if not any(len(bucket) for bucket in self.buckets):
+            raise ValueError("Deal index has no deals to sample from.")
+        self.num_buckets = num_buckets
+        self.curriculum_episodes = curriculum_episodes
+        self.rng = np.random.default_rng(random_seed)
+
+    def bucket_weights(self, episodes):
+        """
+        Sampling weight of each bucket after a number of episodes.
+
+        Returns:
+            np.ndarray: Normalized weights, one per bucket.
+        """
+        if self.curriculum_episodes:
+            progress = min(episodes / self.curriculum_episodes, 1.0)
+        else:
+            progress = 1.0
+        frontier = progress * (self.num_buckets - 1)
+        weights = np.clip(1.0 + frontier - np.arange(self.num_buckets), 0.0, 1.0)
+        weights *= [len(bucket) > 0 for bucket in self.buckets]
+        if not weights.any():
+            # Only harder buckets have deals, fall back to whatever exists
+            weights = np.array([len(bucket) > 0 for bucket in self.buckets], dtype=float)
+        return weights / weights.sum()
+
+    def sample(self, episodes=0):
+        """
+        Draw a deal seed for the next episode.
+
+        Returns:
+            tuple: ``(seed, bucket)``.
+        """
+        bucket = self.rng.choice(self.num_buckets, p=self.bucket_weights(episodes))
+        return int(self.rng.choice(self.buckets[bucket])), int(bucket)
+
+
+def make_deal_sampler(config, instance=None):
+    """
+    Create the sampler described by ``config["env"]["deal_index"]``, if any.
+
+    Each env instance gets its own generator so parallel envs draw different deals.
+    """
+    index_config = config.get("env", {}).get("deal_index")
+    if not index_config or not index_config.get("path"):
+        return None
+    index = load_deal_index(index_config["path"], config)
+    random_seed = zlib.crc32(f"{config.get('random_seed')}_{instance}".encode())
+    return DealSampler(
+        index,
+        num_buckets=index_config.get("buckets", 4),
+        curriculum_episodes=index_config.get("curriculum_episodes", 0),
+        include_unknown=index_config.get("include_unknown", False),
+        random_seed=random_seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a deal solvability index.")
+    parser.add_argument("--config", default="configs/config.yaml")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--start", type=int, default=1)
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--max-nodes", type=int, default=200_000)
+    parser.add_argument("--time-limit", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with open(args.config, "r") as file:
+        config = yaml.safe_load(file)
+    start = time.time()
+    index = build_deal_index(
+        args.output,
+        range(args.start, args.start + args.count),
+        config,
+        processes=args.processes,
+        max_nodes=args.max_nodes,
+        time_limit=args.time_limit,
+    )
+    statuses, counts = np.unique(index["status"], return_counts=True)
+    print(
+        f"Indexed {len(index)} deals in {time.time() - start:.1f}s: "
+        f"{dict(zip(statuses.tolist(), counts.tolist()))}"
+    )
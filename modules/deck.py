@@ -4,10 +4,12 @@ import random
 
 
 class Deck(Stack):
-    def __init__(self, random_seed=None):
+    def __init__(self, random_seed=None, shuffle=True):
         Stack.__init__(self, [], stack_type="Deck")
         self.max = 13
         self.suits = ["Spades", "Hearts", "Diamonds", "Clubs"]
+        if not shuffle:
+            return  # Empty, the cards are filled in by the caller
         for s in self.suits:
             for n in range(self.max):
                 self.cards.append(Card(s, n + 1))
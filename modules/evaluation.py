@@ -0,0 +1,405 @@
+import argparse
+import contextlib
+import math
+import multiprocessing
+import os
+import time
+from typing import NamedTuple
+
+import numpy as np
+import torch
+import yaml
+
+from modules.inference import (
+    NumpyQNetwork,
+    QValueCache,
+    TorchScriptQNetwork,
+    export_torchscript,
+    masked_argmax,
+)
+from modules.mcts import MCTSAgent
+from modules.solitaire_env import SolitaireEnv
+
+# Evaluation deal sets. A version is never changed once results have been reported
+# on it; add a new one instead. The seeds are far from the sequential training seeds.
+EVAL_SEED_SETS = {
+    "v1": (10_000_000, 10_000),  # (first seed, number of seeds)
+}
+
+
+def eval_seeds(version="v1", count=None):
+    """
+    The deal seeds of an evaluation set.
+
+    Args:
+        version (str): Key of :data:`EVAL_SEED_SETS`.
+        count (int, optional): Only the first ``count`` seeds.
+
+    Returns:
+        list: The seeds, always in the same order.
+    """
+    start, size = EVAL_SEED_SETS[version]
+    if count is not None:
+        size = min(size, count)
+    return list(range(start, start + size))
+
+
+def wilson_interval(wins, games, z=1.96):
+    """
+    Wilson score interval of a win rate.
+
+    Returns:
+        tuple: (low, high), (0, 1) if no games were played.
+    """
+    if games == 0:
+        return 0.0, 1.0
+    rate = wins / games
+    center = (rate + z * z / (2 * games)) / (1 + z * z / games)
+    half_width = (
+        z * math.sqrt(rate * (1 - rate) / games + z * z / (4 * games * games))
+    ) / (1 + z * z / games)
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+class GameResult(NamedTuple):
+    seed: int
+    won: bool
+    foundation: int
+    steps: int
+    cache_hits: int = 0
+    cache_misses: int = 0
+
+
+class EvaluationReport(NamedTuple):
+    policy: str
+    seed_set: str
+    results: list  # GameResults in seed order
+    elapsed: float
+
+    @property
+    def games(self):
+        return len(self.results)
+
+    @property
+    def wins(self):
+        return sum(result.won for result in self.results)
+
+    @property
+    def win_rate(self):
+        return self.wins / self.games if self.games else 0.0
+
+    @property
+    def interval(self):
+        return wilson_interval(self.wins, self.games)
+
+    @property
+    def foundation_counts(self):
+        """Number of games ending with each foundation count from 0 to 52."""
+        return np.bincount(
+            [result.foundation for result in self.results], minlength=53
+        )
+
+    @property
+    def cache_hit_rate(self):
+        hits = sum(result.cache_hits for result in self.results)
+        lookups = hits + sum(result.cache_misses for result in self.results)
+        return hits / lookups if lookups else None
+
+    @property
+    def steps_per_win(self):
+        steps = [result.steps for result in self.results if result.won]
+        return float(np.mean(steps)) if steps else float("nan")
+
+    def summary(self):
+        low, high = self.interval
+        summary = (
+            f"{self.policy} on {self.seed_set}: {self.wins}/{self.games} won, "
+            f"win rate {self.win_rate:.3f} (95% CI {low:.3f}-{high:.3f}), "
+            f"mean foundation {np.mean([r.foundation for r in self.results]):.1f}, "
+            f"{self.steps_per_win:.0f} steps per win, {self.elapsed:.0f}s"
+        )
+        if self.cache_hit_rate is not None:
+            summary += f", Q-value cache hit rate {self.cache_hit_rate:.2f}"
+        return summary
+
+
+class ModelPolicy(object):
+    def __init__(
+        self,
+        path,
+        inference="sb3",
+        masked=False,
+        quantize=False,
+        cache_size=0,
+        cache_key="observation",
+    ):
+        """
+        Greedy policy of a saved DQN checkpoint, run on the CPU.
+
+        The replay buffer settings are overridden on load so no buffer is allocated
+        or opened just to evaluate.
+
+        Args:
+            path (str): The checkpoint.
+            inference (str): ``"sb3"`` for model.predict, ``"numpy"`` or
+                ``"torchscript"`` for the exported networks of modules.inference.
+            masked (bool): Only choose among the legal actions.
+            quantize (bool): int8 dynamic quantization (TorchScript only).
+            cache_size (int): Entries of the Q-value LRU cache, 0 to disable it.
+            cache_key (str): ``"observation"`` to key the cache by the observation
+                bytes, or ``"state_hash"`` for the game's Zobrist hash.
+        """
+        from stable_baselines3 import DQN
+        from stable_baselines3.common.buffers import ReplayBuffer
+
+        self.model = DQN.load(
+            path,
+            device="cpu",
+            custom_objects={
+                "buffer_size": 1,
+                "replay_buffer_class": ReplayBuffer,
+                "replay_buffer_kwargs": {},
+            },
+        )
+        self.masked = masked
+        self.network = None
+        if inference == "numpy":
+            self.network = NumpyQNetwork.from_model(self.model)
+        elif inference == "torchscript":
+            self.network = TorchScriptQNetwork(
+                export_torchscript(self.model, quantize=quantize)
+            )
+        elif inference != "sb3":
+            raise ValueError(f"Unknown inference backend: {inference}")
+        self.cache = QValueCache(cache_size) if cache_size else None
+        self.cache_key = cache_key
+
+    def weights_version(self):
+        # Exported networks are fixed copies, the SB3 model changes with every update
+        return self.model._n_updates if self.network is None else 0
+
+    def q_values(self, observations):
+        if self.network is None:
+            with torch.no_grad():
+                q_values = self.model.q_net(
+                    torch.as_tensor(np.asarray(observations), device=self.model.device)
+                )
+            return q_values.cpu().numpy()
+        return self.network.q_values(observations)
+
+    def predict_batch(self, observations, masks=None, keys=None):
+        """
+        Greedy actions of a batch of observations, e.g. from a vectorized env.
+
+        Args:
+            observations (np.ndarray): ``(batch, ...)`` observations.
+            masks (np.ndarray, optional): Legal action masks.
+            keys (list, optional): Cache keys of the rows, the observation bytes by
+                default.
+        """
+        if self.cache is None:
+            if self.network is None:
+                return masked_argmax(self.q_values(observations), masks)
+            return self.network.predict(observations, masks)
+        observations = np.asarray(observations)
+        if keys is None:
+            keys = [observation.tobytes() for observation in observations]
+        self.cache.validate(self.weights_version())
+        q_values = self.cache.lookup(
+            keys, lambda indices: self.q_values(observations[indices])
+        )
+        return masked_argmax(q_values, masks)
+
+    def predict(self, env):
+        masks = env.action_masks()[None] if self.masked else None
+        if self.network is None and masks is None and self.cache is None:
+            action, _ = self.model.predict(env.get_observation(), deterministic=True)
+            return int(action)
+        keys = [env.game.state_hash] if self.cache_key == "state_hash" else None
+        return int(self.predict_batch(env.get_observation()[None], masks, keys)[0])
+
+
+def make_policy(spec, config, **policy_kwargs):
+    """
+    Create a policy from its description: ``"mcts"`` for the MCTS agent, otherwise
+    the path of a DQN checkpoint, with ``policy_kwargs`` passed to ModelPolicy.
+    """
+    if spec == "mcts":
+        return MCTSAgent(cards_per_turn=config.get("cards_per_turn", 3), iterations=200)
+    return ModelPolicy(spec, **policy_kwargs)
+
+
+def evaluation_config(config):
+    """Copy of a config with env logging, recording and game messages turned off."""
+    config = dict(config, show_messages=False)
+    config["env"] = dict(
+        config.get("env", {}), record_games=False, save_every=2**62, deal_index=None
+    )
+    return config
+
+
+_worker = {}
+
+
+def _init_worker(policy_spec, config, policy_kwargs):
+    config = evaluation_config(config)
+    _worker["env"] = SolitaireEnv(config=config, instance=f"eval_{os.getpid()}")
+    _worker["policy"] = make_policy(policy_spec, config, **policy_kwargs)
+
+
+def play_game(env, policy, seed):
+    """Play one deal to the end of its episode."""
+    cache = getattr(policy, "cache", None)
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        env.reset(options={"deal_seed": seed})
+        steps = 0
+        while True:
+            _, _, terminated, truncated, _ = env.step(policy.predict(env))
+            steps += 1
+            if terminated or truncated:
+                break
+    env.action_log = []
+    if cache is not None:
+        hits, misses = cache.hits - hits, cache.misses - misses
+    return GameResult(
+        seed, env.game.complete, env.game.get_foundation_count(), steps, hits, misses
+    )
+
+
+def _play_seed(seed):
+    return play_game(_worker["env"], _worker["policy"], seed)
+
+
+def evaluate(
+    policy_spec,
+    config,
+    seed_set="v1",
+    max_games=1000,
+    min_games=100,
+    ci_half_width=0.02,
+    processes=None,
+    chunksize=4,
+    policy_kwargs=None,
+):
+    """
+    Evaluate a policy on a fixed set of deals across a process pool.
+
+    Deals are played in seed order and the evaluation stops once at least
+    ``min_games`` are done and the 95% win rate interval is narrower than
+    ``ci_half_width`` on either side, so every report covers a prefix of the same
+    seed list.
+
+    Args:
+        policy_spec (str): See :func:`make_policy`.
+        config (dict): Game and env configuration.
+        seed_set (str): Evaluation set version, see :data:`EVAL_SEED_SETS`.
+        max_games (int): Deals to play at most.
+        min_games (int): Deals to play before stopping early.
+        ci_half_width (float): Target half-width of the interval, 0 to play all.
+        processes (int, optional): Worker processes. Defaults to the CPU count.
+        chunksize (int): Seeds handed to a worker at a time.
+        policy_kwargs (dict, optional): Inference options of ModelPolicy.
+
+    Returns:
+        EvaluationReport: The results.
+    """
+    start = time.time()
+    results = []
+    with multiprocessing.Pool(
+        processes, initializer=_init_worker, initargs=(policy_spec, config, policy_kwargs or {})
+    ) as pool:
+        for result in pool.imap(
+            _play_seed, eval_seeds(seed_set, max_games), chunksize=chunksize
+        ):
+            results.append(result)
+            if ci_half_width and len(results) >= min_games:
+                low, high = wilson_interval(
+                    sum(r.won for r in results), len(results)
+                )
+                if (high - low) / 2 <= ci_half_width:
+                    break
+    return EvaluationReport(policy_spec, seed_set, results, time.time() - start)
+
+
+def compare(reports):
+    """
+    Compare reports against the first one on the deals they have in common.
+
+    Returns:
+        list: ``(policy, games, only_this_won, only_first_won)`` per other report.
+    """
+    baseline = reports[0]
+    rows = []
+    for report in reports[1:]:
+        pairs = list(zip(baseline.results, report.results))
+        rows.append(
+            (
+                report.policy,
+                len(pairs),
+                sum(other.won and not base.won for base, other in pairs),
+                sum(base.won and not other.won for base, other in pairs),
+            )
+        )
+    return rows
+
+
+def evaluate_checkpoints(policy_specs, config, **kwargs):
+    """
+    Evaluate several policies on the same deals and print a comparison.
+
+    Returns:
+        list: One EvaluationReport per policy.
+    """
+    reports = []
+    for spec in policy_specs:
+        reports.append(evaluate(spec, config, **kwargs))
+        print(reports[-1].summary())
+    for policy, games, gained, lost in compare(reports):
+        print(
+            f"{policy} vs {reports[0].policy} on {games} common deals: "
+            f"+{gained} wins, -{lost} wins"
+        )
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Evaluate policies on a fixed set of Solitaire deals."
+    )
+    parser.add_argument(
+        "policies", nargs="+", help="DQN checkpoint paths, or 'mcts'."
+    )
+    parser.add_argument("--config", default="configs/config.yaml")
+    parser.add_argument("--seed-set", default="v1")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--min-games", type=int, default=100)
+    parser.add_argument("--ci-half-width", type=float, default=0.02)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument(
+        "--inference", choices=["sb3", "numpy", "torchscript"], default="sb3"
+    )
+    parser.add_argument("--masked", action="store_true", help="Mask illegal actions.")
+    parser.add_argument("--quantize", action="store_true", help="int8 TorchScript.")
+    parser.add_argument(
+        "--cache-size", type=int, default=0, help="Q-value LRU cache entries."
+    )
+    args = parser.parse_args()
+
+    with open(args.config, "r") as file:
+        config = yaml.safe_load(file)
+    evaluate_checkpoints(
+        args.policies,
+        config,
+        seed_set=args.seed_set,
+        max_games=args.games,
+        min_games=args.min_games,
+        ci_half_width=args.ci_half_width,
+        processes=args.processes,
+        policy_kwargs=dict(
+            inference=args.inference,
+            masked=args.masked,
+            quantize=args.quantize,
+            cache_size=args.cache_size,
+        ),
+    )
@@ -0,0 +1,456 @@
+import argparse
+import contextlib
+import multiprocessing
+import os
+import time
+import zlib
+from functools import partial
+
+import numpy as np
+import yaml
+
+from modules.game_record import config_hash
+from modules.hints import HintEngine
+from modules.solver import SOLVED, Solver
+
+DATASET_VERSION = 1
+# Arrays of a shard, one row per transition. Observations keep the int8 encoding of
+# SolitaireEnv.get_observation.
+TRANSITION_DTYPES = {
+    "observations": np.int8,
+    "next_observations": np.int8,
+    "actions": np.uint16,
+    "rewards": np.float32,
+    "dones": np.bool_,
+    "timeouts": np.bool_,
+    "seeds": np.uint32,
+}
+POLICIES = ["solver", "hint"]
+
+
+def _manifest_path(path):
+    return os.path.join(path, "dataset.yaml")
+
+
+def reward_hash(reward_dict):
+    """CRC32 of a reward table, to notice datasets recorded under other rewards."""
+    return zlib.crc32(yaml.safe_dump(reward_dict, sort_keys=True).encode())
+
+
+def generation_config(config):
+    """
+    Copy of a training config for playing expert games: no action logs, game
+    records or game messages. Macro actions are not supported, the expert's moves
+    are single moves.
+    """
+    if config.get("env", {}).get("macro_actions", False):
+        raise ValueError("Expert data cannot be generated with env.macro_actions.")
+    config = dict(config, show_messages=False)
+    config["env"] = dict(config["env"], record_games=False, save_every=1 << 62)
+    return config
+
+
+def play_expert_game(seed, config, policy="solver", hint_time_limit=0.05, **solver_kwargs):
+    """
+    Play one deal in a SolitaireEnv with an expert policy and record its transitions.
+
+    The ``"solver"`` policy plays the solution :class:`modules.solver.Solver` finds for
+    the deal, and skips deals it does not solve. The ``"hint"`` policy plays
+    :class:`modules.hints.HintEngine` moves until the episode ends or no move is left.
+
+    Args:
+        seed (int): Deal seed.
+        config (dict): Config from :func:`generation_config`.
+        policy (str): One of :data:`POLICIES`.
+        hint_time_limit (float): Search time per move of the hint policy.
+        **solver_kwargs: Budgets passed to the solver.
+
+    Returns:
+        dict: Arrays of :data:`TRANSITION_DTYPES` plus ``won``, or None if the solver
+            policy found no solution.
+    """
+    from modules.solitaire_env import SolitaireEnv
+
+    cards_per_turn = config.get("cards_per_turn", 3)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        env = SolitaireEnv(config=dict(config))
+        observation, _ = env.reset(options={"deal_seed": seed})
+        if policy == "solver":
+            result = Solver(cards_per_turn=cards_per_turn, **solver_kwargs).solve_game(env.game)
+            if result.status != SOLVED:
+                return None
+            moves = iter(result.moves)
+        elif policy == "hint":
+            hints = HintEngine(cards_per_turn=cards_per_turn, time_limit=hint_time_limit)
+        else:
+            raise ValueError(f"Unknown expert policy: {policy}")
+
+        rows = {name: [] for name in TRANSITION_DTYPES}
+        done = False
+        while not done:
+            move = next(moves, None) if policy == "solver" else hints.best_move(env.game)
+            if move is None:
+                break
+            action = env.action_from_move(move.source, move.dest, move.num_cards)
+            next_observation, reward, terminated, truncated, _ = env.step(action)
+            done = terminated or truncated
+            rows["observations"].append(observation)
+            rows["next_observations"].append(next_observation)
+            rows["actions"].append(action)
+            rows["rewards"].append(reward)
+            rows["dones"].append(done)
+            rows["timeouts"].append(truncated and not terminated)
+            rows["seeds"].append(seed)
+            observation = next_observation
+
+    if not rows["actions"]:
+        return None
+    transitions = {
+        name: np.array(values, dtype=TRANSITION_DTYPES[name])
+        for name, values in rows.items()
+    }
+    transitions["won"] = env.game.complete
+    return transitions
+
+
+class ShardWriter(object):
+    def __init__(self, path, shard_size=100_000):
+        """
+        Collect transitions and write them as numbered shards of ``.npy`` files,
+        ``<name>_<shard>.npy``, each holding at most ``shard_size`` rows. Whole
+        episodes are never split across shards.
+        """
+        self.path = path
+        self.shard_size = shard_size
+        self.shards = []
+        self.pending = []
+        self.pending_rows = 0
+        os.makedirs(path, exist_ok=True)
+
+    def add(self, transitions):
+        if self.pending_rows + len(transitions["actions"]) > self.shard_size:
+            self.flush()
+        self.pending.append(transitions)
+        self.pending_rows += len(transitions["actions"])
+
+    def flush(self):
+        if not self.pending:
+            return
+        shard = f"{len(self.shards):05d}"
+        for name in TRANSITION_DTYPES:
+            np.save(
+                os.path.join(self.path, f"{name}_{shard}.npy"),
+                np.concatenate([transitions[name] for transitions in self.pending]),
+            )
+        self.shards.append(
+            {
+                "name": shard,
+                "transitions": self.pending_rows,
+                "episodes": len(self.pending),
+                "won": int(sum(transitions["won"] for transitions in self.pending)),
+            }
+        )
+        self.pending = []
+        self.pending_rows = 0
+
+
+def _play_seed(seed, config, policy, hint_time_limit, solver_kwargs):
+    return play_expert_game(seed, config, policy, hint_time_limit, **solver_kwargs)
+
+
+def generate_dataset(
+    path,
+    seeds,
+    config,
+    policy="solver",
+    processes=None,
+    shard_size=100_000,
+    chunksize=4,
+    hint_time_limit=0.05,
+    **solver_kwargs,
+):
+    """
+    Play expert games over many deals in parallel and store their transitions.
+
+    The dataset is a directory of shards (see :class:`ShardWriter`) and a
+    ``dataset.yaml`` manifest with the shard sizes and the settings the games were
+    played with. Shards are written as games arrive, so memory stays bounded by one
+    shard.
+
+    Args:
+        path (str): Output directory.
+        seeds (iterable): Deal seeds to play.
+        config (dict): Training config, the env settings decide rewards and episode ends.
+        policy (str): Expert policy, see :func:`play_expert_game`.
+        processes (int, optional): Worker processes. Defaults to the CPU count.
+        shard_size (int): Maximum transitions per shard.
+        chunksize (int): Seeds handed to a worker at a time.
+        hint_time_limit (float): Search time per move of the hint policy.
+        **solver_kwargs: Budgets passed to the solver.
+
+    Returns:
+        dict: The manifest.
+    """
+    config = generation_config(config)
+    if "reward_dict" not in config:
+        from modules.solitaire import Solitaire
+
+        config["reward_dict"] = Solitaire(config=config).reward_dict
+    writer = ShardWriter(path, shard_size)
+    worker = partial(
+        _play_seed,
+        config=config,
+        policy=policy,
+        hint_time_limit=hint_time_limit,
+        solver_kwargs=solver_kwargs,
+    )
+    skipped = 0
+    with multiprocessing.Pool(processes) as pool:
+        for transitions in pool.imap_unordered(worker, seeds, chunksize=chunksize):
+            if transitions is None:
+                skipped += 1
+            else:
+                writer.add(transitions)
+    writer.flush()
+
+    manifest = {
+        "version": DATASET_VERSION,
+        "policy": policy,
+        "config_hash": config_hash(config),
+        "reward_hash": reward_hash(config["reward_dict"]),
+        "cards_per_turn": config.get("cards_per_turn"),
+        "num_t_stacks": config.get("num_t_stacks"),
+        "skipped_deals": skipped,
+        "shards": writer.shards,
+    }
+    with open(_manifest_path(path), "w") as file:
+        yaml.safe_dump(manifest, file, sort_keys=False)
+    return manifest
+
+
+class ExpertDataset(object):
+    def __init__(self, path, config=None):
+        """
+        Memory-mapped view of a dataset written by :func:`generate_dataset`.
+
+        Args:
+            path (str): Dataset directory.
+            config (dict, optional): If given, the dataset must have been played under
+                the same game settings (see ``modules.game_record.config_hash``).
+        """
+        with open(_manifest_path(path), "r") as file:
+            self.manifest = yaml.safe_load(file)
+        if self.manifest["version"] != DATASET_VERSION:
+            raise ValueError(f"Unsupported expert dataset version {self.manifest['version']}")
+        if config is not None:
+            if self.manifest["config_hash"] != config_hash(config):
+                raise ValueError(
+                    f"Expert dataset {path} was played under different game settings "
+                    f"(cards_per_turn={self.manifest['cards_per_turn']}, "
+                    f"num_t_stacks={self.manifest['num_t_stacks']})"
+                )
+            if "reward_dict" in config and self.manifest["reward_hash"] != reward_hash(
+                config["reward_dict"]
+            ):
+                print(f"Warning: expert dataset {path} was recorded with other rewards")
+        self.path = path
+        self.shards = [
+            {
+                name: np.load(os.path.join(path, f"{name}_{shard['name']}.npy"), mmap_mode="r")
+                for name in TRANSITION_DTYPES
+            }
+            for shard in self.manifest["shards"]
+        ]
+        self.offsets = np.cumsum([0] + [shard["transitions"] for shard in self.manifest["shards"]])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def gather(self, indices):
+        """
+        Transitions at sorted dataset-wide ``indices``.
+
+        Returns:
+            dict: One array per name of :data:`TRANSITION_DTYPES`.
+        """
+        shard_ids = np.searchsorted(self.offsets, indices, side="right") - 1
+        parts = {name: [] for name in TRANSITION_DTYPES}
+        for shard_id in np.unique(shard_ids):
+            rows = indices[shard_ids == shard_id] - self.offsets[shard_id]
+            for name in TRANSITION_DTYPES:
+                parts[name].append(self.shards[shard_id][name][rows])
+        return {name: np.concatenate(values) for name, values in parts.items()}
+
+    def sample(self, batch_size, rng):
+        return self.gather(np.sort(rng.integers(0, len(self), size=batch_size)))
+
+
+def fill_replay_buffer(replay_buffer, dataset, max_transitions=None):
+    """
+    Add expert transitions to a replay buffer through its regular ``add``, so any
+    buffer class (prioritized, memmap) stays consistent. Rows of ``n_envs``
+    consecutive transitions are added together.
+
+    Returns:
+        int: Number of transitions added.
+    """
+    n_envs = replay_buffer.n_envs
+    limit = min(len(dataset), replay_buffer.buffer_size * n_envs)
+    if max_transitions is not None:
+        limit = min(limit, max_transitions)
+    limit -= limit % n_envs
+    added = 0
+    for shard in dataset.shards:
+        count = min(len(shard["actions"]), limit - added)
+        count -= count % n_envs
+        for start in range(0, count, n_envs):
+            rows = slice(start, start + n_envs)
+            replay_buffer.add(
+                np.asarray(shard["observations"][rows]),
+                np.asarray(shard["next_observations"][rows]),
+                np.asarray(shard["actions"][rows], dtype=np.int64),
+                np.asarray(shard["rewards"][rows]),
+                np.asarray(shard["dones"][rows]),
+                [{"TimeLimit.truncated": bool(timeout)} for timeout in shard["timeouts"][rows]],
+            )
+        added += count
+        if added >= limit:
+            break
+    return added
+
+
+def behavior_cloning(
+    model,
+    dataset,
+    gradient_steps=10_000,
+    batch_size=256,
+    margin=0.8,
+    margin_weight=1.0,
+    target_update_interval=1000,
+    log_interval=1000,
+    random_seed=None,
+):
+    """
+    Warm start the Q-network of a DQN model on expert transitions, as in the
+    pretraining phase of DQfD (Hester et al., 2018): a 1-step TD loss keeps the
+    Q-values on the scale of the rewards, and a large-margin loss makes the expert
+    action the greedy one, ``max_a [Q(s, a) + margin * (a != a_E)] - Q(s, a_E)``.
+
+    Args:
+        model (DQN): The model, its optimizer and learning rate are used.
+        dataset (ExpertDataset): The expert transitions.
+        gradient_steps (int): Number of updates.
+        batch_size (int): Transitions per update.
+        margin (float): Margin of non-expert actions.
+        margin_weight (float): Weight of the margin loss against the TD loss.
+        target_update_interval (int): Gradient steps between target network copies.
+        log_interval (int): Gradient steps between log lines.
+        random_seed (int, optional): Seed of the batch sampler.
+
+    Returns:
+        float: Agreement of the greedy action with the expert on the last batch.
+    """
+    import torch as th
+    from torch.nn import functional as F
+    from stable_baselines3.common.utils import polyak_update
+
+    rng = np.random.default_rng(random_seed)
+    policy = model.policy
+    policy.set_training_mode(True)
+    agreement = 0.0
+    for step in range(1, gradient_steps + 1):
+        batch = dataset.sample(batch_size, rng)
+        observations = th.as_tensor(batch["observations"], device=model.device)
+        next_observations = th.as_tensor(batch["next_observations"], device=model.device)
+        actions = th.as_tensor(batch["actions"].astype(np.int64), device=model.device)
+        rewards = th.as_tensor(batch["rewards"], device=model.device)
+        dones = th.as_tensor(batch["dones"] & ~batch["timeouts"], device=model.device).float()
+
+        with th.no_grad():
+            next_q_values = model.q_net_target(next_observations).max(dim=1).values
+            target_q_values = rewards + (1 - dones) * model.gamma * next_q_values
+        q_values = model.q_net(observations)
+        expert_q_values = q_values.gather(1, actions.reshape(-1, 1)).flatten()
+        td_loss = F.smooth_l1_loss(expert_q_values, target_q_values)
+        margins = th.full_like(q_values, margin).scatter(1, actions.reshape(-1, 1), 0.0)
+        margin_loss = ((q_values + margins).max(dim=1).values - expert_q_values).mean()
+        loss = td_loss + margin_weight * margin_loss
+
+        policy.optimizer.zero_grad()
+        loss.backward()
+        th.nn.utils.clip_grad_norm_(policy.parameters(), model.max_grad_norm)
+        policy.optimizer.step()
+
+        agreement = (q_values.argmax(dim=1) == actions).float().mean().item()
+        if step % target_update_interval == 0:
+            polyak_update(model.q_net.parameters(), model.q_net_target.parameters(), 1.0)
+        if step % log_interval == 0 or step == gradient_steps:
+            print(
+                f"Behavior cloning step {step}/{gradient_steps}: loss {loss.item():.4f} "
+                f"(td {td_loss.item():.4f}, margin {margin_loss.item():.4f}), "
+                f"expert agreement {agreement:.3f}"
+            )
+    polyak_update(model.q_net.parameters(), model.q_net_target.parameters(), 1.0)
+    policy.set_training_mode(False)
+    return agreement
+
+
+def pretrain(model, config):
+    """
+    Apply the ``dqn.pretrain`` config section to a new model: pre-fill its replay
+    buffer with expert transitions and/or run a behavior cloning warm start.
+    """
+    pretrain_config = config["dqn"].get("pretrain")
+    if not pretrain_config or not pretrain_config.get("dataset"):
+        return
+    dataset = ExpertDataset(pretrain_config["dataset"], config)
+    print(f"Expert dataset: {len(dataset)} transitions from {pretrain_config['dataset']}")
+    if pretrain_config.get("fill_replay_buffer", True):
+        added = fill_replay_buffer(
+            model.replay_buffer, dataset, pretrain_config.get("max_transitions")
+        )
+        # Expert transitions count towards learning_starts, like a reopened buffer
+        model.learning_starts = max(0, model.learning_starts - added)
+        print(
+            f"Replay buffer pre-filled with {added} expert transitions, "
+            f"learning_starts={model.learning_starts}"
+        )
+    if pretrain_config.get("behavior_cloning"):
+        behavior_cloning(model, dataset, **pretrain_config["behavior_cloning"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate an expert transition dataset.")
+    parser.add_argument("--config", default="configs/config.yaml")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--policy", choices=POLICIES, default="solver")
+    parser.add_argument("--start", type=int, default=1)
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--shard-size", type=int, default=100_000)
+    parser.add_argument("--max-nodes", type=int, default=200_000)
+    parser.add_argument("--time-limit", type=float, default=5.0)
+    parser.add_argument("--hint-time-limit", type=float, default=0.05)
+    args = parser.parse_args()
+
+    with open(args.config, "r") as file:
+        config = yaml.safe_load(file)
+    start = time.time()
+    manifest = generate_dataset(
+        args.output,
+        range(args.start, args.start + args.count),
+        config,
+        policy=args.policy,
+        processes=args.processes,
+        shard_size=args.shard_size,
+        hint_time_limit=args.hint_time_limit,
+        max_nodes=args.max_nodes,
+        time_limit=args.time_limit,
+    )
+    shards = manifest["shards"]
+    print(
+        f"{sum(shard['transitions'] for shard in shards)} transitions from "
+        f"{sum(shard['episodes'] for shard in shards)} games "
+        f"({sum(shard['won'] for shard in shards)} won, {manifest['skipped_deals']} "
+        f"deals skipped) in {len(shards)} shards, {time.time() - start:.1f}s"
+    )
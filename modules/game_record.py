@@ -0,0 +1,201 @@
+import argparse
+import time
+import zlib
+from typing import NamedTuple
+
+import numpy as np
+import yaml
+
+from modules.actions import decode_action, play_action
+from modules.solitaire import Solitaire
+
+RECORD_VERSION = 1
+RECORD_HEADER_DTYPE = np.dtype(
+    [
+        ("version", "u1"),
+        ("seed", "<u4"),
+        ("config_hash", "<u4"),
+        ("num_actions", "<u4"),
+    ]
+)
+# Actions are stored as 2 bytes each, the action space has fewer than 65536 actions
+ACTION_DTYPE = np.dtype("<u2")
+# Settings that change how a sequence of actions plays out
+RECORD_CONFIG_KEYS = ["cards_per_turn", "num_t_stacks"]
+RECORD_ENV_CONFIG_KEYS = ["macro_actions", "auto_complete"]
+
+
+def config_hash(config):
+    """
+    CRC32 of the settings a game record depends on, so a record is never replayed
+    under rules it was not played with.
+    """
+    settings = {key: config.get(key) for key in RECORD_CONFIG_KEYS}
+    env_config = config.get("env", {})
+    settings.update({key: env_config.get(key, False) for key in RECORD_ENV_CONFIG_KEYS})
+    return zlib.crc32(yaml.safe_dump(settings, sort_keys=True).encode())
+
+
+class GameRecord(NamedTuple):
+    """
+    A played game: the deal seed (for a deal index, the seed stored at the bank
+    index), the hash of the settings it was played with and its env actions.
+    """
+
+    seed: int
+    config_hash: int
+    actions: np.ndarray
+
+    def to_bytes(self):
+        header = np.zeros(1, dtype=RECORD_HEADER_DTYPE)
+        header["version"] = RECORD_VERSION
+        header["seed"] = self.seed
+        header["config_hash"] = self.config_hash
+        header["num_actions"] = len(self.actions)
+        return header.tobytes() + np.asarray(self.actions, dtype=ACTION_DTYPE).tobytes()
+
+
+def read_records(data):
+    """
+    Parse concatenated game records.
+
+    Args:
+        data (bytes): Records as written by GameRecord.to_bytes.
+
+    Returns:
+        list: The GameRecords.
+    """
+    records = []
+    offset = 0
+    while offset < len(data):
+        header = np.frombuffer(data, dtype=RECORD_HEADER_DTYPE, count=1, offset=offset)[0]
+        if header["version"] != RECORD_VERSION:
+            raise ValueError(f"Unsupported game record version {header['version']}")
+        offset += RECORD_HEADER_DTYPE.itemsize
+        actions = np.frombuffer(
+            data, dtype=ACTION_DTYPE, count=int(header["num_actions"]), offset=offset
+        )
+        offset += actions.nbytes
+        records.append(
+            GameRecord(int(header["seed"]), int(header["config_hash"]), actions)
+        )
+    return records
+
+
+def append_record(path, record):
+    with open(path, "ab") as file:
+        file.write(record.to_bytes())
+
+
+def load_records(path):
+    with open(path, "rb") as file:
+        return read_records(file.read())
+
+
+class Replayer(object):
+    def __init__(self, config):
+        """
+        Re-run game records deterministically.
+
+        Games are replayed on the engine directly, with messages, printing and the
+        undo history turned off, and score the move rewards and the game completion
+        bonus as the env does. Env-level penalties such as ``repeated_state`` are
+        not replayed.
+
+        Args:
+            config (dict): The configuration the games were played with.
+        """
+        self.config = dict(config, show_messages=False, keep_history=False)
+        self.env_config = self.config.get("env", {})
+        self.config_hash = config_hash(self.config)
+        # Load the reward table once rather than for every replayed game
+        self.config["reward_dict"] = Solitaire(config=self.config).reward_dict
+
+    def new_game(self, seed):
+        return Solitaire(config=dict(self.config, random_seed=seed))
+
+    def step(self, game, action):
+        """Play one env action on a game."""
+        source_idx, dest_idx, num_cards = decode_action(int(action), game.num_t_stacks)
+        _, messages = play_action(game, source_idx, dest_idx, num_cards, self.env_config)
+        game.reward_points(messages, hide=True)
+        if game.complete:
+            game.reward_points(["game_complete"], hide=True)
+
+    def replay(self, record, step=None, checkpoints=None, checkpoint_every=None):
+        """
+        Reconstruct the game of a record after a number of actions.
+
+        Args:
+            record (GameRecord): The record.
+            step (int, optional): Number of actions to play, all by default.
+            checkpoints (list, optional): Snapshots from :meth:`checkpoints`, to start
+                from the nearest one instead of the deal.
+            checkpoint_every (int, optional): Spacing the checkpoints were made with.
+
+        Returns:
+            Solitaire: The game after ``step`` actions.
+        """
+        if record.config_hash != self.config_hash:
+            raise ValueError(
+                "Game record was played with different settings than this replayer."
+            )
+        if step is None:
+            step = len(record.actions)
+        start = 0
+        if checkpoints:
+            start = min(step // checkpoint_every, len(checkpoints) - 1) * checkpoint_every
+            game = Solitaire.from_bytes(checkpoints[start // checkpoint_every], self.config)
+        else:
+            game = self.new_game(record.seed)
+        for action in record.actions[start:step].tolist():
+            self.step(game, action)
+        return game
+
+    def states(self, record):
+        """
+        Iterate over the states of a record.
+
+        Yields:
+            tuple: (step, game) after each action. The same game object is updated in
+                place, snapshot it with to_bytes to keep a state.
+        """
+        game = self.replay(record, step=0)
+        for step, action in enumerate(record.actions.tolist(), 1):
+            self.step(game, action)
+            yield step, game
+
+    def checkpoints(self, record, every=1000):
+        """
+        Snapshot a record every ``every`` actions, for fast random access with replay.
+
+        Returns:
+            list: Snapshot bytes at actions 0, every, 2 * every, ...
+        """
+        checkpoints = [self.new_game(record.seed).to_bytes()]
+        for step, game in self.states(record):
+            if step % every == 0:
+                checkpoints.append(game.to_bytes())
+        return checkpoints
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded Solitaire games.")
+    parser.add_argument("records", help="File of game records written by the env.")
+    parser.add_argument("--config", default="configs/config.yaml")
+    parser.add_argument("--game", type=int, default=0, help="Record to show.")
+    parser.add_argument("--step", type=int, default=None, help="Show the game at this step.")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as file:
+        config = yaml.safe_load(file)
+    records = load_records(args.records)
+    replayer = Replayer(config)
+    start = time.time()
+    game = replayer.replay(records[args.game], step=args.step)
+    print(
+        f"Replayed {args.step if args.step is not None else len(records[args.game].actions)} "
+        f"actions of seed {records[args.game].seed} in {(time.time() - start) * 1000:.1f}ms"
+    )
+    game.show_cards()
+    game.show_score()
@@ -0,0 +1,89 @@
+import time
+
+from modules.mcts import evaluate
+from modules.solver import Solver
+from modules.state import state_from_game
+
+
+class _Timeout(Exception):
+    pass
+
+
+class HintEngine(object):
+    def __init__(self, cards_per_turn=3, time_limit=0.05, max_depth=50):
+        """
+        Time-budgeted move suggestions for interactive play.
+
+        Runs iterative-deepening depth-first search from the current position and
+        returns the best first move of the deepest completed iteration. Moves that
+        turn over a face-down card end a line, so a hint never depends on the
+        identity of a hidden card.
+
+        Args:
+            cards_per_turn (int): Cards dealt from the stock per deal.
+            time_limit (float): Hard latency budget in seconds.
+            max_depth (int): Deepest iteration to try if time allows.
+        """
+        self.solver = Solver(cards_per_turn=cards_per_turn)
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+
+    def best_move(self, game):
+        """
+        Suggest a move for the current position.
+
+        Returns:
+            Move: The suggested move, or None if there is no legal move.
+        """
+        state = state_from_game(game)
+        initial_hidden = sum(hidden for hidden, _ in state[0])
+        root_moves = self.solver.successors(state)
+        if not root_moves:
+            return None
+        if len(root_moves) == 1:
+            return root_moves[0][0]
+
+        self.deadline = time.perf_counter() + self.time_limit
+        self.initial_hidden = initial_hidden
+        best = root_moves[0][0]
+        for depth in range(1, self.max_depth + 1):
+            try:
+                best_value, best_depth_move = -1.0, None
+                self.table = {}
+                for move, child in root_moves:
+                    value = self._search(child, depth - 1, reveals=self._reveals(state, child))
+                    if value > best_value:
+                        best_value, best_depth_move = value, move
+            except _Timeout:
+                break
+            best = best_depth_move
+            # Search the best move first in the next iteration
+            root_moves.sort(key=lambda pair: pair[0] != best)
+            if best_value >= 1.0:
+                break
+        return best
+
+    @staticmethod
+    def _reveals(state, child):
+        return sum(hidden for hidden, _ in child[0]) < sum(hidden for hidden, _ in state[0])
+
+    def _search(self, state, depth, reveals=False):
+        if time.perf_counter() > self.deadline:
+            raise _Timeout()
+        value = evaluate(state, self.initial_hidden)
+        if depth == 0 or reveals or value >= 1.0:
+            return value
+
+        # A position already searched as deep this iteration adds nothing new
+        if self.table.get(state, -1) >= depth:
+            return -1.0
+        self.table[state] = depth
+        best = value
+        # Later plies are worth slightly less so shorter lines win ties
+        for _, child in self.solver.successors(state):
+            best = max(
+                best,
+                0.999 * self._search(child, depth - 1, reveals=self._reveals(state, child)),
+            )
+        return best
+
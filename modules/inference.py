@@ -0,0 +1,228 @@
+import copy
+from collections import OrderedDict
+
+import numpy as np
+import torch
+from torch import nn
+
+# Activations of the SB3 MlpPolicy Q-network that the NumPy forward pass supports
+NUMPY_ACTIVATIONS = {
+    "ReLU": lambda x: np.maximum(x, 0, out=x),
+    "Tanh": np.tanh,
+    "ELU": lambda x: np.where(x > 0, x, np.expm1(np.minimum(x, 0))),
+}
+
+
+def masked_argmax(q_values, masks=None):
+    """
+    Greedy actions of a batch, restricted to the legal actions when masks are given.
+
+    Args:
+        q_values (np.ndarray): ``(batch, actions)`` Q-values.
+        masks (np.ndarray, optional): ``(batch, actions)`` boolean legal action masks.
+
+    Returns:
+        np.ndarray: ``(batch,)`` actions.
+    """
+    if masks is not None:
+        q_values = np.where(masks, q_values, -np.inf)
+    return q_values.argmax(axis=1)
+
+
+class NumpyQNetwork(object):
+    def __init__(self, weights, biases, activations):
+        """
+        Plain NumPy forward pass of a DQN MlpPolicy Q-network, batch first.
+
+        Args:
+            weights (list): ``(out, in)`` float32 weight matrix of each linear layer.
+            biases (list): Bias vector of each linear layer.
+            activations (list): Activation name after each hidden layer, see
+                :data:`NUMPY_ACTIVATIONS`.
+        """
+        # Stored transposed so a batch multiplies from the left without copies
+        self.weights = [np.ascontiguousarray(w.T, dtype=np.float32) for w in weights]
+        self.biases = [np.asarray(b, dtype=np.float32) for b in biases]
+        self.activations = list(activations)
+
+    @classmethod
+    def from_model(cls, model):
+        """Extract the online Q-network of an SB3 DQN model."""
+        weights, biases, activations = [], [], []
+        for layer in model.policy.q_net.q_net:
+            if isinstance(layer, nn.Linear):
+                weights.append(layer.weight.detach().cpu().numpy())
+                biases.append(layer.bias.detach().cpu().numpy())
+            else:
+                name = type(layer).__name__
+                if name not in NUMPY_ACTIVATIONS:
+                    raise ValueError(f"Unsupported activation for NumPy inference: {name}")
+                activations.append(name)
+        return cls(weights, biases, activations)
+
+    def save(self, path):
+        arrays = {f"weight_{i}": w.T for i, w in enumerate(self.weights)}
+        arrays.update({f"bias_{i}": b for i, b in enumerate(self.biases)})
+        np.savez(path, activations=np.array(self.activations), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            num_layers = len([key for key in arrays.files if key.startswith("weight_")])
+            return cls(
+                [arrays[f"weight_{i}"] for i in range(num_layers)],
+                [arrays[f"bias_{i}"] for i in range(num_layers)],
+                arrays["activations"].tolist(),
+            )
+
+    def q_values(self, observations):
+        """
+        Args:
+            observations (np.ndarray): ``(batch, ...)`` observations.
+
+        Returns:
+            np.ndarray: ``(batch, actions)`` Q-values.
+        """
+        x = np.asarray(observations, dtype=np.float32).reshape(len(observations), -1)
+        for i, (weight, bias) in enumerate(zip(self.weights, self.biases)):
+            x = x @ weight
+            x += bias
+            if i < len(self.activations):
+                x = NUMPY_ACTIVATIONS[self.activations[i]](x)
+        return x
+
+    def predict(self, observations, masks=None):
+        """Greedy (optionally masked) actions of a batch of observations."""
+        return masked_argmax(self.q_values(observations), masks)
+
+
+class MaskedQNetwork(nn.Module):
+    """Q-network plus masked argmax, as one TorchScript module."""
+
+    def __init__(self, q_net):
+        super().__init__()
+        self.q_net = q_net
+
+    def forward(self, observations: torch.Tensor, masks: torch.Tensor) -> torch.Tensor:
+        q_values = self.q_net(observations.flatten(1).float())
+        return q_values.masked_fill(~masks, float("-inf")).argmax(dim=1)
+
+    @torch.jit.export
+    def q_values(self, observations: torch.Tensor) -> torch.Tensor:
+        return self.q_net(observations.flatten(1).float())
+
+
+def export_torchscript(model, path=None, quantize=False):
+    """
+    Export the online Q-network of an SB3 DQN model as a TorchScript module that
+    maps ``(observations, masks)`` batches to greedy actions.
+
+    Args:
+        model (DQN): The trained model.
+        path (str, optional): File to save the module to.
+        quantize (bool): Apply int8 dynamic quantization to the linear layers.
+
+    Returns:
+        torch.jit.ScriptModule: The exported module, on the CPU.
+    """
+    q_net = copy.deepcopy(model.policy.q_net.q_net).cpu().eval()
+    if quantize:
+        q_net = torch.ao.quantization.quantize_dynamic(q_net, {nn.Linear}, dtype=torch.qint8)
+    module = torch.jit.script(MaskedQNetwork(q_net))
+    if path:
+        module.save(path)
+    return module
+
+
+class TorchScriptQNetwork(object):
+    def __init__(self, module):
+        """
+        NumPy-in, NumPy-out wrapper of a module from :func:`export_torchscript`.
+
+        Args:
+            module (torch.jit.ScriptModule or str): The module, or the file it was
+                saved to.
+        """
+        if isinstance(module, str):
+            module = torch.jit.load(module, map_location="cpu")
+        self.module = module
+
+    def predict(self, observations, masks=None):
+        """Greedy (optionally masked) actions of a batch of observations."""
+        observations = torch.as_tensor(np.asarray(observations))
+        if masks is None:
+            masks = torch.ones(
+                (observations.shape[0], 1), dtype=torch.bool
+            )  # Broadcasts over every action
+        else:
+            masks = torch.as_tensor(np.asarray(masks, dtype=bool))
+        with torch.inference_mode():
+            return self.module(observations, masks).numpy()
+
+    def q_values(self, observations):
+        with torch.inference_mode():
+            return self.module.q_values(torch.as_tensor(np.asarray(observations))).numpy()
+
+
+class QValueCache(object):
+    def __init__(self, max_size=10_000):
+        """
+        Bounded LRU cache of Q-values for greedy evaluation, where agents revisit the
+        same positions (e.g. while cycling the stock).
+
+        Keys are anything hashable that determines the network input, such as the
+        observation bytes or a game's state hash. Each entry holds one row of
+        Q-values (about 7KB with the default action space).
+
+        Args:
+            max_size (int): Entries kept before the least recently used is dropped.
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+    def validate(self, version):
+        """Drop every entry when the weights version changed since the last call."""
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def clear(self):
+        self.entries.clear()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def lookup(self, keys, compute):
+        """
+        Q-values of a batch, computing only the rows that are not cached.
+
+        Args:
+            keys (list): One key per row of the batch.
+            compute (callable): Maps a list of row indices to their Q-values.
+
+        Returns:
+            np.ndarray: ``(batch, actions)`` Q-values.
+        """
+        rows = [None] * len(keys)
+        missing = []
+        for index, key in enumerate(keys):
+            q_values = self.entries.get(key)
+            if q_values is None:
+                missing.append(index)
+            else:
+                self.entries.move_to_end(key)
+                rows[index] = q_values
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            for index, q_values in zip(missing, compute(missing)):
+                # Copied so the cache does not keep the whole batch alive
+                rows[index] = self.entries[keys[index]] = np.array(q_values)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return np.stack(rows)
@@ -0,0 +1,196 @@
+import os
+
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv
+
+from modules import solitaire_env
+from modules.actions import MAX_CARDS_PER_MOVE, encode_action, num_actions
+from modules.game_record import GameRecord, append_record, config_hash
+from modules.state import FOUNDATION_IDS, RANK, RED, SUIT
+from modules.step_kernel import (
+    CURRENT_STEP,
+    GAMES_COMPLETED,
+    MOVE_COUNT,
+    OBSERVATION_COLUMNS,
+    OBSERVATION_ROWS,
+    StepKernel,
+)
+
+
+def state_action_mask(state, num_t_stacks):
+    """
+    Legal actions of a game state from :func:`modules.state.state_from_game`, with
+    the rules of :func:`modules.actions.action_mask`.
+
+    Returns:
+        np.ndarray: Boolean mask over the env action space.
+    """
+    tableau, foundation, stock, pointer, num_next = state
+    mask = np.zeros(num_actions(num_t_stacks), dtype=bool)
+    mask[-1] = True
+    tops = [cards[-1] if cards else None for _, cards in tableau]
+    foundation_index = [num_t_stacks + int(FOUNDATION_IDS[suit][1:]) - 1 for suit in range(4)]
+
+    def fits_on(code, top):
+        if top is None:
+            return RANK[code] == 13
+        return RED[top] != RED[code] and RANK[top] == RANK[code] + 1
+
+    def add_moves(source, code, num_cards, to_foundation=True):
+        if to_foundation and num_cards == 1 and foundation[SUIT[code]] == RANK[code] - 1:
+            mask[encode_action(source, foundation_index[SUIT[code]], 1, num_t_stacks)] = True
+        for dest, top in enumerate(tops):
+            if dest != source and fits_on(code, top):
+                mask[encode_action(source, dest, num_cards, num_t_stacks)] = True
+
+    for source, (hidden, cards) in enumerate(tableau):
+        for num_cards in range(1, min(len(cards) - hidden, MAX_CARDS_PER_MOVE) + 1):
+            add_moves(source, cards[-num_cards], num_cards)
+    for suit, count in enumerate(foundation):
+        if count:
+            add_moves(foundation_index[suit], suit * 13 + count, 1, to_foundation=False)
+    if num_next:
+        add_moves(num_t_stacks + 4, stock[pointer - 1], 1)
+    return mask
+
+
+class KernelVecEnv(VecEnv):
+    def __init__(self, config, num_envs, jit=True):
+        """
+        Vectorized SolitaireEnv that steps all its games in one call of the array
+        step kernel, in the training process. Drop-in for the DummyVecEnv or
+        SubprocVecEnv of create_vector_env when ``env.kernel`` is set.
+
+        Deals follow the same sequential seeds as SolitaireEnv. Per-step CSV action
+        logs and game messages are not produced; game records are, with
+        ``env.record_games``.
+
+        Args:
+            config (dict): The training config.
+            num_envs (int): Number of games stepped together.
+            jit (bool): Use the Numba-compiled kernel when Numba is installed.
+        """
+        self.config = config
+        self.kernel = StepKernel(config, num_envs, jit=jit)
+        observation_space = spaces.Box(
+            low=-1, high=52, shape=(OBSERVATION_ROWS * OBSERVATION_COLUMNS,), dtype=np.int32
+        )
+        action_space = spaces.Discrete(self.kernel.num_actions)
+        self.render_mode = None
+        super(KernelVecEnv, self).__init__(num_envs, observation_space, action_space)
+        self.seeds = np.zeros(num_envs, dtype=np.int64)
+        self.actions = None
+        self.record_games = config["env"].get("record_games", False)
+        self.log_path = config.get("log_path")
+        self.config_hash = config_hash(config)
+        if self.record_games:
+            self.episode_actions = np.zeros(
+                (num_envs, self.kernel.max_steps + 1), dtype=np.uint16
+            )
+
+    def reset_game(self, index):
+        # Shares the seed sequence of the SolitaireEnv instances of this process
+        self.seeds[index] = next(solitaire_env.number_gen)
+        self.kernel.reset(index, self.seeds[index])
+
+    def reset(self):
+        for index in range(self.num_envs):
+            self.reset_game(index)
+        return self.kernel.observations.copy()
+
+    def step_async(self, actions):
+        self.actions = np.asarray(actions, dtype=np.int64).reshape(self.num_envs)
+
+    def step_wait(self):
+        scalars = self.kernel.games.scalars
+        if self.record_games:
+            self.episode_actions[np.arange(self.num_envs), scalars[:, CURRENT_STEP]] = self.actions
+        observations, rewards, terminated, truncated = self.kernel.step(self.actions)
+        dones = terminated | truncated
+        infos = [
+            {
+                "games_completed": int(scalars[index, GAMES_COMPLETED]),
+                "move_count": int(scalars[index, MOVE_COUNT]),
+                "repeated_states": 0,
+                "TimeLimit.truncated": bool(truncated[index] and not terminated[index]),
+            }
+            for index in range(self.num_envs)
+        ]
+        for index in np.flatnonzero(dones):
+            infos[index]["terminal_observation"] = observations[index].copy()
+            if self.record_games:
+                self.save_game_record(index)
+            self.reset_game(index)
+        return observations.copy(), rewards.astype(np.float32), dones.copy(), infos
+
+    def save_game_record(self, index):
+        """Append a finished episode to ``<log_path>/kernel_<index>_games.bin``."""
+        num_actions = self.kernel.games.scalars[index, CURRENT_STEP]
+        os.makedirs(self.log_path, exist_ok=True)
+        append_record(
+            os.path.join(self.log_path, f"kernel_{index}_games.bin"),
+            GameRecord(
+                int(self.seeds[index]),
+                self.config_hash,
+                self.episode_actions[index, :num_actions].copy(),
+            ),
+        )
+
+    def action_masks(self):
+        """Legal actions of every game, one row per env."""
+        return np.stack([self.action_mask(index) for index in range(self.num_envs)])
+
+    def action_mask(self, index):
+        return state_action_mask(self.kernel.games.state(index), self.kernel.num_t_stacks)
+
+    def memory_usage(self):
+        """Bytes of the game, observation and episode action arrays of all games."""
+        games = self.kernel.games
+        usage = {
+            "kernel/games": sum(
+                array.nbytes
+                for array in [
+                    games.tableau,
+                    games.t_len,
+                    games.t_hidden,
+                    games.foundation,
+                    games.stock,
+                    games.scalars,
+                ]
+            ),
+            "kernel/observations": self.kernel.observations.nbytes,
+        }
+        if self.record_games:
+            usage["kernel/episode_actions"] = self.episode_actions.nbytes
+        return usage
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        # There are no per-env objects, only the SolitaireEnv methods used through a
+        # VecEnv are answered, per game
+        indices = self._get_indices(indices)
+        if method_name == "action_masks":
+            return [self.action_mask(index) for index in indices]
+        if method_name == "memory_usage":
+            # The arrays hold all games, each gets an equal share
+            usage = self.memory_usage()
+            return [
+                {component: size // self.num_envs for component, size in usage.items()}
+                for _ in indices
+            ]
+        raise NotImplementedError(
+            f"KernelVecEnv only supports env_method for action_masks and memory_usage, "
+            f"not {method_name}."
+        )
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
@@ -0,0 +1,245 @@
+import math
+import multiprocessing
+import random
+import time
+
+from modules.solver import Solver
+from modules.state import is_won, state_from_game
+
+
+def determinize(state, rng, hidden_stock=False):
+    """
+    Sample an assignment of the hidden cards consistent with what is visible.
+
+    The face-down tableau cards are shuffled among the face-down slots. The engine
+    deals the stock face up, so the stock keeps its order unless ``hidden_stock`` is
+    set, in which case the cards not dealt yet are shuffled in with the others.
+
+    Args:
+        state (tuple): A state from :func:`modules.state.state_from_game`.
+        rng (random.Random): Random generator.
+        hidden_stock (bool): Also treat the undealt stock cards as unknown.
+
+    Returns:
+        tuple: A fully determined state.
+    """
+    tableau, foundation, stock, pointer, num_next = state
+    unknown = [code for hidden, cards in tableau for code in cards[:hidden]]
+    if hidden_stock:
+        unknown.extend(stock[pointer:])
+    rng.shuffle(unknown)
+
+    position = 0
+    columns = []
+    for hidden, cards in tableau:
+        columns.append((hidden, tuple(unknown[position : position + hidden]) + cards[hidden:]))
+        position += hidden
+    if hidden_stock:
+        stock = stock[:pointer] + tuple(unknown[position:])
+    return tuple(columns), foundation, stock, pointer, num_next
+
+
+def evaluate(state, initial_hidden):
+    """
+    Heuristic value in ``[0, 1]``: foundation progress, plus revealed cards.
+    """
+    if is_won(state):
+        return 1.0
+    hidden = sum(hidden for hidden, _ in state[0])
+    revealed = 1.0 - hidden / initial_hidden if initial_hidden else 1.0
+    return 0.75 * sum(state[1]) / 52 + 0.25 * revealed
+
+
+class Node(object):
+    __slots__ = ["children", "visits", "value", "availability"]
+
+    def __init__(self):
+        self.children = {}
+        self.visits = 0
+        self.value = 0.0
+        # Number of times the move leading here was legal when its parent was visited
+        self.availability = 0
+
+
+def run_search(
+    state,
+    cards_per_turn,
+    iterations=1000,
+    time_limit=None,
+    exploration=0.7,
+    rollout_depth=30,
+    rollout_greedy=0.5,
+    hidden_stock=False,
+    random_seed=None,
+):
+    """
+    Single-observer information set MCTS from one position.
+
+    Every iteration samples a new determinization and walks the shared tree using
+    only the moves that are legal in it, selecting with UCB1 where the parent count
+    is how often a child was available. Moves come from the solver's ordered,
+    pruned move generator, so safe foundation moves are forced. Leaves are valued
+    by a short rollout that follows the move ordering with probability
+    ``rollout_greedy`` and plays a random move otherwise.
+
+    Returns:
+        dict: ``{move: (visits, total_value)}`` for the children of the root.
+    """
+    rng = random.Random(random_seed)
+    solver = Solver(cards_per_turn=cards_per_turn)
+    initial_hidden = sum(hidden for hidden, _ in state[0])
+    deadline = time.time() + time_limit if time_limit else None
+    root = Node()
+
+    for iteration in range(iterations):
+        if deadline and time.time() > deadline:
+            break
+        current = determinize(state, rng, hidden_stock=hidden_stock)
+        node = root
+        path = [node]
+
+        # Selection and expansion
+        while not is_won(current):
+            successors = solver.successors(current)
+            if not successors:
+                break
+            for move, _ in successors:
+                child = node.children.get(move)
+                if child is not None:
+                    child.availability += 1
+            unexpanded = [
+                (move, child) for move, child in successors if move not in node.children
+            ]
+            if unexpanded:
+                move, current = unexpanded[0]
+                node.children[move] = Node()
+                node.children[move].availability = 1
+                node = node.children[move]
+                path.append(node)
+                break
+            best_score = -math.inf
+            for move, child_state in successors:
+                child = node.children[move]
+                score = child.value / child.visits + exploration * math.sqrt(
+                    math.log(child.availability) / child.visits
+                )
+                if score > best_score:
+                    best_score, best_move, best_state = score, move, child_state
+            node = node.children[best_move]
+            current = best_state
+            path.append(node)
+
+        # Rollout
+        for _ in range(rollout_depth):
+            if is_won(current):
+                break
+            successors = solver.successors(current)
+            if not successors:
+                break
+            if rng.random() < rollout_greedy:
+                _, current = successors[0]
+            else:
+                _, current = rng.choice(successors)
+        value = evaluate(current, initial_hidden)
+
+        for visited in path:
+            visited.visits += 1
+            visited.value += value
+
+    return {move: (child.visits, child.value) for move, child in root.children.items()}
+
+
+def _run_search(kwargs):
+    return run_search(**kwargs)
+
+
+class MCTSAgent(object):
+    def __init__(
+        self,
+        cards_per_turn=3,
+        iterations=1000,
+        time_limit=None,
+        processes=1,
+        exploration=0.7,
+        rollout_depth=30,
+        hidden_stock=False,
+        random_seed=None,
+    ):
+        """
+        Determinized MCTS player with root parallelization.
+
+        Each worker process searches its own tree with its own determinizations for
+        the per-move budget. The root visit counts are summed and the most visited
+        move is played.
+
+        Args:
+            cards_per_turn (int): Cards dealt from the stock per deal.
+            iterations (int): Iterations per worker and per move.
+            time_limit (float, optional): Seconds per move, stops workers early.
+            processes (int): Worker processes; 1 searches in this process.
+            exploration (float): UCB1 exploration constant.
+            rollout_depth (int): Moves per rollout before the position is evaluated.
+            hidden_stock (bool): Treat undealt stock cards as unknown.
+            random_seed (int, optional): Base seed, each worker and move gets its own.
+        """
+        self.cards_per_turn = cards_per_turn
+        self.iterations = iterations
+        self.time_limit = time_limit
+        self.processes = processes
+        self.exploration = exploration
+        self.rollout_depth = rollout_depth
+        self.hidden_stock = hidden_stock
+        self.rng = random.Random(random_seed)
+        self.pool = None
+
+    def search(self, game):
+        """
+        Choose a move for the current position of a Solitaire game.
+
+        Returns:
+            Move: The chosen move (see :class:`modules.solver.Move`), or None if the
+                game has no legal move.
+        """
+        state = state_from_game(game)
+        jobs = [
+            dict(
+                state=state,
+                cards_per_turn=self.cards_per_turn,
+                iterations=self.iterations,
+                time_limit=self.time_limit,
+                exploration=self.exploration,
+                rollout_depth=self.rollout_depth,
+                hidden_stock=self.hidden_stock,
+                random_seed=self.rng.getrandbits(32),
+            )
+            for _ in range(self.processes)
+        ]
+        if self.processes > 1:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(self.processes)
+            results = self.pool.map(_run_search, jobs)
+        else:
+            results = [_run_search(jobs[0])]
+
+        visits = {}
+        for result in results:
+            for move, (count, _) in result.items():
+                visits[move] = visits.get(move, 0) + count
+        if not visits:
+            return None
+        return max(visits, key=visits.get)
+
+    def predict(self, env):
+        """
+        Choose an action for a SolitaireEnv, in the env's action encoding.
+        """
+        move = self.search(env.game)
+        if move is None:
+            return env.action_space.n - 1
+        return env.action_from_move(move.source, move.dest, move.num_cards)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,167 @@
+import sys
+import tracemalloc
+
+import numpy as np
+from stable_baselines3.common.monitor import Monitor
+
+# Items of a container measured by container_sizeof, the rest are assumed alike
+SAMPLE_ITEMS = 32
+MB = 1024 * 1024
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    Bytes held by an object and everything it references, each object counted once.
+    NumPy arrays count their data buffer if they own it (not views or memory-mapped
+    files).
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, np.ndarray):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+def container_sizeof(container, sample=SAMPLE_ITEMS):
+    """
+    Estimated bytes of a list or dict of similar items, from the deep size of up to
+    ``sample`` evenly spaced items. Measuring every item of an undo history or an
+    action log costs as much as the log itself.
+
+    Objects shared between items (dict keys, interned strings, small ints) are
+    counted once: the first item is measured alone, the others only add what they
+    do not share with it.
+    """
+    size = sys.getsizeof(container)
+    count = len(container)
+    if not count:
+        return size
+    items = list(container.items()) if isinstance(container, dict) else container
+    positions = np.linspace(0, count - 1, min(count, sample)).astype(int)
+    seen = set()
+    first = deep_sizeof(items[positions[0]], seen)
+    if len(positions) == 1:
+        return size + first * count
+    # Bytes per item beyond what is shared with the others
+    own = sum(deep_sizeof(items[position], seen) for position in positions[1:]) / (
+        len(positions) - 1
+    )
+    return size + int(first + own * (count - 1))
+
+
+def replay_buffer_memory(replay_buffer):
+    """
+    Bytes of a replay buffer: its transition arrays and, for prioritized buffers,
+    the priority trees.
+
+    Returns:
+        dict: ``replay/<array>`` for arrays in memory, ``replay/mapped`` for arrays in
+            memory-mapped files and ``replay/priorities``.
+    """
+    usage = {}
+    mapped = 0
+    for name in ["observations", "next_observations", "actions", "rewards", "dones", "timeouts"]:
+        array = getattr(replay_buffer, name, None)
+        if array is None:
+            continue
+        if isinstance(array, np.memmap):
+            mapped += array.nbytes
+        else:
+            usage[f"replay/{name}"] = array.nbytes
+    if mapped:
+        usage["replay/mapped"] = mapped
+    trees = [getattr(replay_buffer, name, None) for name in ["sum_tree", "min_tree"]]
+    if any(tree is not None for tree in trees):
+        usage["replay/priorities"] = sum(tree.tree.nbytes for tree in trees if tree is not None)
+    return usage
+
+
+class MemoryMonitor(Monitor):
+    """
+    Monitor that adds its episode buffers to the ``memory_usage`` report of the env
+    it wraps. The buffers keep one entry per finished episode for the whole run.
+    """
+
+    def memory_usage(self):
+        usage = dict(self.env.get_wrapper_attr("memory_usage")())
+        usage["monitor/episodes"] = sum(
+            container_sizeof(buffer)
+            for buffer in [self.episode_returns, self.episode_lengths, self.episode_times]
+        )
+        usage["monitor/rewards"] = container_sizeof(self.rewards)
+        return usage
+
+
+def vec_env_memory(vec_env):
+    """
+    Memory report of every env of a vectorized env, fetched from the worker
+    processes of a SubprocVecEnv.
+
+    Returns:
+        list: One ``{component: bytes}`` dict per env (a single one for envs that step
+            all games together, like KernelVecEnv).
+    """
+    if hasattr(vec_env, "memory_usage"):
+        return [vec_env.memory_usage()]
+    if hasattr(vec_env, "venv"):
+        # VecEnv wrappers (VecMonitor, VecNormalize...) hold no per-step buffers
+        return vec_env_memory(vec_env.venv)
+    reports = vec_env.env_method("memory_usage")
+    buffers = {
+        name: getattr(vec_env, name)
+        for name in ["buf_obs", "buf_rews", "buf_dones"]
+        if hasattr(vec_env, name)
+    }
+    if buffers:
+        # DummyVecEnv keeps the last observations of all its envs
+        reports[0] = dict(reports[0])
+        reports[0]["vec_env/buffers"] = sum(
+            array.nbytes
+            for buffer in buffers.values()
+            for array in (buffer.values() if isinstance(buffer, dict) else [buffer])
+        )
+    return reports
+
+
+class TracemallocDiff(object):
+    def __init__(self, top=10, frames=1):
+        """
+        Periodic ``tracemalloc`` snapshots of this process, each compared to the last.
+
+        Tracing slows allocation-heavy code down noticeably, so it is only started
+        when a report is requested.
+
+        Args:
+            top (int): Allocation sites printed per report.
+            frames (int): Stack frames kept per allocation.
+        """
+        self.top = top
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.snapshot = tracemalloc.take_snapshot()
+
+    def report(self):
+        """
+        Print the allocation sites that grew most since the last report.
+
+        Returns:
+            int: Bytes currently traced.
+        """
+        snapshot = tracemalloc.take_snapshot()
+        statistics = snapshot.compare_to(self.snapshot, "lineno")
+        self.snapshot = snapshot
+        traced, _ = tracemalloc.get_traced_memory()
+        print(f"tracemalloc: {traced / MB:.1f} MB traced, largest changes:")
+        for statistic in statistics[: self.top]:
+            print(f"  {statistic}")
+        return traced
@@ -0,0 +1,163 @@
+import multiprocessing
+import os
+import sys
+
+# Thread pool sizes read by OpenMP, MKL and OpenBLAS when they are first loaded
+THREAD_VARIABLES = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]
+# Imported once by the forkserver, env workers forked from it start with them loaded
+FORKSERVER_PRELOAD = [
+    "__main__",
+    "modules.solitaire_env",
+    "stable_baselines3.common.monitor",
+    "modules.memory",
+    "stable_baselines3.common.vec_env.subproc_vec_env",
+]
+
+
+def parse_cpus(cpus):
+    """
+    CPU list from a config value: a list of ints or a string like ``"0-3,8,10-11"``.
+
+    Returns:
+        list: Sorted CPU ids, or None when ``cpus`` is None.
+    """
+    if cpus is None:
+        return None
+    if isinstance(cpus, int):
+        return [cpus]
+    if isinstance(cpus, str):
+        parsed = []
+        for part in cpus.split(","):
+            start, _, end = part.strip().partition("-")
+            parsed.extend(range(int(start), int(end or start) + 1))
+        cpus = parsed
+    return sorted(set(int(cpu) for cpu in cpus))
+
+
+def format_cpus(cpus):
+    """Inverse of parse_cpus, e.g. ``[0, 1, 2, 5]`` to ``"0-2,5"``."""
+    if not cpus:
+        return "-"
+    ranges = []
+    start = previous = cpus[0]
+    for cpu in list(cpus[1:]) + [None]:
+        if cpu is not None and cpu == previous + 1:
+            previous = cpu
+            continue
+        ranges.append(str(start) if start == previous else f"{start}-{previous}")
+        start = previous = cpu
+    return ",".join(ranges)
+
+
+class Placement(object):
+    def __init__(self, config, num_envs):
+        """
+        CPU sets and thread counts of the learner and the env workers, from the
+        ``resources`` config section.
+
+        With ``auto: true`` the learner takes the first ``learner_threads`` CPUs
+        available to this process and the env workers the rest. Otherwise
+        ``learner_cpus`` and ``env_cpus`` are explicit CPU lists, and anything left
+        out keeps the default of running anywhere. Env workers get one CPU each,
+        round-robin over ``env_cpus``.
+
+        Args:
+            config (dict): The training config.
+            num_envs (int): Number of env workers.
+        """
+        resources = config.get("resources") or {}
+        self.start_method = resources.get("start_method")
+        self.preload = resources.get("preload", True)
+        self.learner_threads = resources.get("learner_threads")
+        self.env_threads = resources.get("env_threads", 1)
+        self.learner_cpus = parse_cpus(resources.get("learner_cpus"))
+        self.env_cpus = parse_cpus(resources.get("env_cpus"))
+        if resources.get("auto", False):
+            available = sorted(os.sched_getaffinity(0))
+            learner_threads = self.learner_threads or 1
+            if len(available) <= learner_threads:
+                raise ValueError(
+                    f"resources.auto needs more than learner_threads={learner_threads} "
+                    f"CPUs, {len(available)} available."
+                )
+            self.learner_cpus = available[:learner_threads]
+            self.env_cpus = available[learner_threads:]
+        if self.learner_cpus and self.learner_threads is None:
+            self.learner_threads = len(self.learner_cpus)
+        self.num_envs = num_envs
+
+    def prepare_start_method(self):
+        """
+        Preload the engine and SB3 worker code in the forkserver. Only takes effect
+        before the first forkserver process of this program is started.
+        """
+        if self.start_method == "forkserver" and self.preload:
+            multiprocessing.set_forkserver_preload(FORKSERVER_PRELOAD)
+
+    def env_worker_cpus(self, instance):
+        """CPUs of env worker ``instance``, or None to leave it unpinned."""
+        if not self.env_cpus:
+            return None
+        return [self.env_cpus[instance % len(self.env_cpus)]]
+
+    def wrap_env_fn(self, env_fn, instance):
+        """Env factory that first pins the worker process it runs in."""
+        cpus = self.env_worker_cpus(instance)
+        threads = self.env_threads
+
+        def pinned_env_fn():
+            pin_process(cpus, threads)
+            return env_fn()
+
+        return pinned_env_fn
+
+    def pin_learner(self):
+        pin_process(self.learner_cpus, self.learner_threads)
+
+    def report(self, subprocess_envs=True):
+        """Print the layout, flagging CPUs shared by the learner and env workers."""
+        learner_cpus = self.learner_cpus or sorted(os.sched_getaffinity(0))
+        print(
+            f"Learner: CPUs {format_cpus(learner_cpus)}, "
+            f"{self.learner_threads or 'default'} torch threads"
+        )
+        if not subprocess_envs:
+            print(f"Env workers: {self.num_envs} in the learner process")
+            return
+        print(
+            f"Env workers: {self.num_envs} processes "
+            f"({self.start_method or 'default'} start method"
+            f"{', preloaded' if self.start_method == 'forkserver' and self.preload else ''}), "
+            f"{self.env_threads} threads each"
+        )
+        if self.env_cpus:
+            for instance in range(self.num_envs):
+                print(
+                    f"  env {instance}: CPU {format_cpus(self.env_worker_cpus(instance))}"
+                )
+            shared = sorted(set(self.env_cpus) & set(learner_cpus))
+            if shared:
+                print(f"Warning: CPUs {format_cpus(shared)} are shared by the learner and envs")
+            if self.num_envs > len(self.env_cpus):
+                print(
+                    f"Warning: {self.num_envs} env workers on {len(self.env_cpus)} CPUs"
+                )
+        else:
+            print("  env workers are not pinned")
+
+
+def pin_process(cpus=None, threads=None):
+    """
+    Restrict the calling process to ``cpus`` and its thread pools to ``threads``.
+
+    The environment variables only reach thread pools that are not loaded yet (and
+    child processes). Torch is limited directly when it is already imported.
+    """
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    if threads:
+        for name in THREAD_VARIABLES:
+            os.environ[name] = str(threads)
+        if "torch" in sys.modules:
+            torch = sys.modules["torch"]
+            torch.set_num_threads(threads)
@@ -0,0 +1,75 @@
+import numpy as np
+import torch as th
+from torch.nn import functional as F
+from stable_baselines3 import DQN
+
+from modules.replay_buffers import PrioritizedReplayBuffer
+
+
+class PrioritizedDQN(DQN):
+    """
+    DQN that trains from a :class:`PrioritizedReplayBuffer`.
+
+    Identical to ``DQN.train`` except that the Huber loss of every sample is scaled
+    by its importance-sampling weight and the absolute TD errors of the batch are
+    written back to the buffer as new priorities.
+    """
+
+    def _setup_model(self):
+        if self.replay_buffer_class is None:
+            self.replay_buffer_class = PrioritizedReplayBuffer
+        super(PrioritizedDQN, self)._setup_model()
+
+    def train(self, gradient_steps, batch_size=100):
+        # Switch to train mode (this affects batch norm / dropout)
+        self.policy.set_training_mode(True)
+        # Update learning rate according to schedule
+        self._update_learning_rate(self.policy.optimizer)
+        self.replay_buffer.set_progress(1.0 - self._current_progress_remaining)
+
+        losses = []
+        for _ in range(gradient_steps):
+            replay_data = self.replay_buffer.sample(
+                batch_size, env=self._vec_normalize_env
+            )
+            discounts = getattr(replay_data, "discounts", None)
+            if discounts is None:
+                discounts = self.gamma
+
+            with th.no_grad():
+                next_q_values = self.q_net_target(replay_data.next_observations)
+                next_q_values, _ = next_q_values.max(dim=1)
+                next_q_values = next_q_values.reshape(-1, 1)
+                target_q_values = (
+                    replay_data.rewards
+                    + (1 - replay_data.dones) * discounts * next_q_values
+                )
+
+            current_q_values = self.q_net(replay_data.observations)
+            current_q_values = th.gather(
+                current_q_values, dim=1, index=replay_data.actions.long()
+            )
+
+            # Importance-sampling weighted Huber loss
+            elementwise_loss = F.smooth_l1_loss(
+                current_q_values, target_q_values, reduction="none"
+            )
+            loss = (replay_data.weights * elementwise_loss).mean()
+            losses.append(loss.item())
+
+            self.policy.optimizer.zero_grad()
+            loss.backward()
+            th.nn.utils.clip_grad_norm_(self.policy.parameters(), self.max_grad_norm)
+            self.policy.optimizer.step()
+
+            td_errors = (current_q_values - target_q_values).detach().abs()
+            self.replay_buffer.update_priorities(
+                replay_data.indices, td_errors.cpu().numpy().flatten()
+            )
+
+        self._n_updates += gradient_steps
+
+        self.logger.record("train/n_updates", self._n_updates, exclude="tensorboard")
+        self.logger.record("train/loss", np.mean(losses))
+        self.logger.record("train/per_alpha", self.replay_buffer.alpha)
+        self.logger.record("train/per_beta", self.replay_buffer.beta)
@@ -0,0 +1,453 @@
+import os
+from typing import NamedTuple
+
+import numpy as np
+import torch as th
+from stable_baselines3.common.buffers import BaseBuffer, ReplayBuffer
+
+
+class SegmentTree(object):
+    """
+    Complete binary tree stored in a flat NumPy array.
+
+    Leaves live at ``[capacity, 2 * capacity)`` and every internal node ``i`` holds
+    ``operation(tree[2 * i], tree[2 * i + 1])``. Updates and queries touch one node per
+    level, so a batch of ``B`` elements costs ``O(B log N)`` and runs level by level in
+    vectorized NumPy rather than element by element in Python.
+    """
+
+    def __init__(self, capacity, operation, neutral_element):
+        # Round up to a power of two so every leaf sits at the same depth
+        self.capacity = 1 << max(int(capacity) - 1, 0).bit_length()
+        self.operation = operation
+        self.neutral_element = neutral_element
+        self.tree = np.full(2 * self.capacity, neutral_element, dtype=np.float64)
+
+    def update(self, indices, values):
+        """
+        Set the leaves at ``indices`` to ``values`` and refresh their ancestors.
+
+        Args:
+            indices (np.ndarray): Leaf indices in ``[0, capacity)``.
+            values (np.ndarray): New leaf values, broadcastable to ``indices``.
+        """
+        nodes = np.asarray(indices, dtype=np.int64) + self.capacity
+        self.tree[nodes] = values
+        nodes = np.unique(nodes // 2)
+        while nodes.size:
+            self.tree[nodes] = self.operation(
+                self.tree[2 * nodes], self.tree[2 * nodes + 1]
+            )
+            nodes = np.unique(nodes[nodes > 1] // 2)
+
+    def __getitem__(self, indices):
+        return self.tree[np.asarray(indices, dtype=np.int64) + self.capacity]
+
+    def reduce(self):
+        """Return the reduction over every leaf."""
+        return self.tree[1]
+
+
+class SumSegmentTree(SegmentTree):
+    def __init__(self, capacity):
+        super(SumSegmentTree, self).__init__(capacity, np.add, 0.0)
+
+    def find_prefixsum_idx(self, prefixsums):
+        """
+        Find, for every prefix sum, the highest leaf ``i`` such that
+        ``sum(tree[:i]) <= prefixsum``.
+
+        Args:
+            prefixsums (np.ndarray): Values in ``[0, reduce())``.
+
+        Returns:
+            np.ndarray: Leaf indices, one per prefix sum.
+        """
+        prefixsums = np.array(prefixsums, dtype=np.float64)
+        nodes = np.ones(prefixsums.shape, dtype=np.int64)
+        # Every node is at the same depth, so the whole batch descends together
+        while nodes.size and nodes[0] < self.capacity:
+            left = 2 * nodes
+            left_sum = self.tree[left]
+            go_right = prefixsums >= left_sum
+            prefixsums = np.where(go_right, prefixsums - left_sum, prefixsums)
+            nodes = left + go_right
+        return nodes - self.capacity
+
+
+class MinSegmentTree(SegmentTree):
+    def __init__(self, capacity):
+        super(MinSegmentTree, self).__init__(capacity, np.minimum, np.inf)
+
+
+class LinearSchedule(object):
+    """
+    Linear interpolation from ``start`` to ``end`` over the first ``end_fraction``
+    of training, then constant. Called with training progress in ``[0, 1]``.
+    """
+
+    def __init__(self, start, end, end_fraction=1.0):
+        self.start = start
+        self.end = end
+        self.end_fraction = end_fraction
+
+    def __call__(self, progress):
+        if self.end_fraction <= 0 or progress >= self.end_fraction:
+            return self.end
+        return self.start + (self.end - self.start) * progress / self.end_fraction
+
+
+class PrioritizedReplayBufferSamples(NamedTuple):
+    observations: th.Tensor
+    actions: th.Tensor
+    next_observations: th.Tensor
+    dones: th.Tensor
+    rewards: th.Tensor
+    weights: th.Tensor
+    indices: np.ndarray
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    Proportional prioritized experience replay (Schaul et al., 2016).
+
+    Transitions are sampled with probability ``p_i ** alpha / sum_k p_k ** alpha``
+    and corrected with importance-sampling weights ``(N * P(i)) ** -beta``, normalized
+    by the largest weight in the buffer. Priorities live in a sum-tree (sampling)
+    and a min-tree (weight normalization) with one leaf per ``(pos, env)`` slot.
+
+    ``alpha`` and ``beta`` are annealed linearly towards ``alpha_final`` and
+    ``beta_final`` as :meth:`set_progress` is fed the training progress. A new
+    ``alpha`` takes effect for priorities as they are written.
+
+    Args:
+        alpha (float): Initial prioritization exponent (0 is uniform sampling).
+        beta (float): Initial importance-sampling exponent.
+        alpha_final (float, optional): Final alpha. Defaults to ``alpha``.
+        beta_final (float): Final beta. Defaults to 1.0.
+        schedule_fraction (float): Fraction of training over which both are annealed.
+        epsilon (float): Added to every priority so no transition becomes unreachable.
+    """
+
+    def __init__(
+        self,
+        buffer_size,
+        observation_space,
+        action_space,
+        device="auto",
+        n_envs=1,
+        optimize_memory_usage=False,
+        handle_timeout_termination=True,
+        alpha=0.6,
+        beta=0.4,
+        alpha_final=None,
+        beta_final=1.0,
+        schedule_fraction=1.0,
+        epsilon=1e-6,
+        **kwargs,
+    ):
+        if optimize_memory_usage:
+            raise ValueError(
+                "PrioritizedReplayBuffer does not support optimize_memory_usage = True."
+            )
+        super(PrioritizedReplayBuffer, self).__init__(
+            buffer_size,
+            observation_space,
+            action_space,
+            device=device,
+            n_envs=n_envs,
+            optimize_memory_usage=False,
+            handle_timeout_termination=handle_timeout_termination,
+            **kwargs,
+        )
+        capacity = self.buffer_size * self.n_envs
+        self.sum_tree = SumSegmentTree(capacity)
+        self.min_tree = MinSegmentTree(capacity)
+        self.max_priority = 1.0
+        self.epsilon = epsilon
+        self.alpha_schedule = LinearSchedule(
+            alpha, alpha if alpha_final is None else alpha_final, schedule_fraction
+        )
+        self.beta_schedule = LinearSchedule(beta, beta_final, schedule_fraction)
+        self.set_progress(0.0)
+        # Storage reopened from disk already holds transitions; give them all the same priority
+        if self.size():
+            self._set_priorities(np.arange(self.size() * self.n_envs), self.max_priority)
+
+    def set_progress(self, progress):
+        """Update alpha and beta for the given training progress in ``[0, 1]``."""
+        self.alpha = self.alpha_schedule(progress)
+        self.beta = self.beta_schedule(progress)
+
+    def _flat_indices(self, pos):
+        return pos * self.n_envs + np.arange(self.n_envs)
+
+    def _set_priorities(self, flat_indices, priorities):
+        scaled = np.power(priorities, self.alpha)
+        self.sum_tree.update(flat_indices, scaled)
+        self.min_tree.update(flat_indices, scaled)
+
+    def add(self, obs, next_obs, action, reward, done, infos):
+        flat_indices = self._flat_indices(self.pos)
+        super(PrioritizedReplayBuffer, self).add(
+            obs, next_obs, action, reward, done, infos
+        )
+        # New transitions get the highest priority seen so far so they are replayed at least once
+        self._set_priorities(flat_indices, self.max_priority)
+
+    def sample(self, batch_size, env=None):
+        """
+        Sample a batch proportionally to priority.
+
+        The total priority mass is split into ``batch_size`` equal segments and one
+        transition is drawn from each, which lowers the variance of the batch.
+
+        Returns:
+            PrioritizedReplayBufferSamples: The batch, its importance-sampling weights
+                and the flat indices to pass back to :meth:`update_priorities`.
+        """
+        num_slots = self.size() * self.n_envs
+        total = self.sum_tree.reduce()
+        bounds = np.linspace(0.0, total, batch_size + 1)
+        prefixsums = np.random.uniform(bounds[:-1], bounds[1:])
+        flat_indices = self.sum_tree.find_prefixsum_idx(prefixsums)
+        # Guard against float round-off landing on an empty leaf past the end
+        flat_indices = np.minimum(flat_indices, num_slots - 1)
+
+        probabilities = self.sum_tree[flat_indices] / total
+        min_probability = self.min_tree.reduce() / total
+        max_weight = (min_probability * num_slots) ** (-self.beta)
+        weights = (probabilities * num_slots) ** (-self.beta) / max_weight
+
+        batch_inds, env_indices = np.divmod(flat_indices, self.n_envs)
+        next_obs = self._normalize_obs(
+            self.next_observations[batch_inds, env_indices, :], env
+        )
+        data = (
+            self._normalize_obs(self.observations[batch_inds, env_indices, :], env),
+            self.actions[batch_inds, env_indices, :],
+            next_obs,
+            (
+                self.dones[batch_inds, env_indices]
+                * (1 - self.timeouts[batch_inds, env_indices])
+            ).reshape(-1, 1),
+            self._normalize_reward(
+                self.rewards[batch_inds, env_indices].reshape(-1, 1), env
+            ),
+            weights.astype(np.float32).reshape(-1, 1),
+        )
+        return PrioritizedReplayBufferSamples(
+            *tuple(map(self.to_torch, data)), flat_indices
+        )
+
+    def add_batch(self, obs, next_obs, actions, rewards, dones, timeouts, priorities):
+        """
+        Add a batch of transitions from one env (``n_envs == 1``) with known priorities,
+        e.g. TD errors computed by a remote actor.
+
+        Args:
+            obs, next_obs, actions, rewards, dones (np.ndarray): One row per transition.
+            timeouts (np.ndarray): Whether each episode ended by truncation.
+            priorities (np.ndarray): Initial priority of each transition.
+        """
+        if self.n_envs != 1:
+            raise ValueError("add_batch needs a buffer with n_envs = 1.")
+        flat_indices = []
+        for i in range(len(actions)):
+            flat_indices.append(self.pos)
+            # Skips this class's add, the priorities are set once for the whole batch
+            super(PrioritizedReplayBuffer, self).add(
+                obs[i : i + 1],
+                next_obs[i : i + 1],
+                actions[i : i + 1],
+                rewards[i : i + 1],
+                dones[i : i + 1],
+                [{"TimeLimit.truncated": bool(timeouts[i])}],
+            )
+        self.update_priorities(np.array(flat_indices), priorities)
+
+    def update_priorities(self, flat_indices, priorities):
+        """
+        Write new priorities, typically the absolute TD errors of a sampled batch.
+
+        Args:
+            flat_indices (np.ndarray): Indices returned in the sampled batch.
+            priorities (np.ndarray): New (non-negative) priorities.
+        """
+        priorities = np.abs(np.asarray(priorities, dtype=np.float64)) + self.epsilon
+        self._set_priorities(flat_indices, priorities)
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+
+
+class MemmapReplayBuffer(ReplayBuffer):
+    """
+    Replay buffer whose arrays live in ``np.memmap`` files under ``path``.
+
+    Every array is a ``.npy`` file opened with :func:`np.lib.format.open_memmap`, plus
+    ``header.npy`` holding ``[version, pos, full, buffer_size, n_envs]``. The header is
+    written after each transition, so a restarted run reopens the directory instantly
+    and continues where the last one stopped; the OS pages data in on demand instead
+    of it being copied into RAM.
+
+    Writes go to the page cache, which outlives a crashed process but not a crash of
+    the machine: the OS writes dirty pages back in any order, so the header on disk
+    can then be ahead of the data. Only what :meth:`flush` wrote (data first, then
+    the header) is known to be consistent on disk.
+
+    ``mode`` controls how an existing buffer is opened:
+
+    - ``"r+"``: read/write, new transitions are persisted (the default).
+    - ``"c"``: copy-on-write. The files are shared read-only and any page the run
+      writes to becomes private, so several runs branching from a common prefix can
+      all start from one buffer on disk without modifying it. The private pages and
+      position cannot be saved, so pickling such a buffer raises.
+    - ``"r"``: read-only, adding transitions raises.
+
+    Args:
+        path (str): Directory holding the memmap files, created if missing.
+        mode (str): One of ``"r+"``, ``"c"`` or ``"r"``.
+    """
+
+    HEADER_VERSION = 1
+
+    def __init__(
+        self,
+        buffer_size,
+        observation_space,
+        action_space,
+        device="auto",
+        n_envs=1,
+        optimize_memory_usage=False,
+        handle_timeout_termination=True,
+        path=None,
+        mode="r+",
+    ):
+        if path is None:
+            raise ValueError("MemmapReplayBuffer needs a path to store its arrays.")
+        if optimize_memory_usage:
+            raise ValueError(
+                "MemmapReplayBuffer does not support optimize_memory_usage = True."
+            )
+        if mode not in ("r+", "c", "r"):
+            raise ValueError(f"Invalid memmap mode: {mode}")
+        # Skip ReplayBuffer.__init__, which would allocate every array in RAM
+        BaseBuffer.__init__(
+            self, buffer_size, observation_space, action_space, device, n_envs=n_envs
+        )
+        self.buffer_size = max(buffer_size // n_envs, 1)
+        self.optimize_memory_usage = False
+        self.handle_timeout_termination = handle_timeout_termination
+        self.path = path
+        self.mode = mode
+
+        action_dtype = self._maybe_cast_dtype(action_space.dtype)
+        self._layout = {
+            "observations": ((*self.obs_shape,), observation_space.dtype),
+            "next_observations": ((*self.obs_shape,), observation_space.dtype),
+            "actions": ((self.action_dim,), action_dtype),
+            "rewards": ((), np.float32),
+            "dones": ((), np.float32),
+            "timeouts": ((), np.float32),
+        }
+        self._open()
+
+    def _file(self, name):
+        return os.path.join(self.path, f"{name}.npy")
+
+    def _open(self):
+        exists = os.path.exists(self._file("header"))
+        if not exists and self.mode != "r+":
+            raise FileNotFoundError(f"No replay buffer found at {self.path}")
+        os.makedirs(self.path, exist_ok=True)
+
+        if exists:
+            self._header = np.lib.format.open_memmap(self._file("header"), mode=self.mode)
+            version, pos, full, buffer_size, n_envs = (int(v) for v in self._header)
+            if version != self.HEADER_VERSION:
+                raise ValueError(f"Unsupported replay buffer version {version}")
+            if (buffer_size, n_envs) != (self.buffer_size, self.n_envs):
+                raise ValueError(
+                    f"Replay buffer at {self.path} has shape ({buffer_size}, {n_envs}), "
+                    f"expected ({self.buffer_size}, {self.n_envs})"
+                )
+        else:
+            self._header = np.lib.format.open_memmap(
+                self._file("header"), mode="w+", dtype=np.int64, shape=(5,)
+            )
+            pos, full = 0, False
+            self._header[:] = [self.HEADER_VERSION, 0, 0, self.buffer_size, self.n_envs]
+
+        for name, (shape, dtype) in self._layout.items():
+            full_shape = (self.buffer_size, self.n_envs, *shape)
+            if exists:
+                array = np.lib.format.open_memmap(self._file(name), mode=self.mode)
+                if array.shape != full_shape or array.dtype != np.dtype(dtype):
+                    raise ValueError(
+                        f"Replay buffer array {name} has shape {array.shape} and dtype "
+                        f"{array.dtype}, expected {full_shape} and {np.dtype(dtype)}"
+                    )
+            else:
+                array = np.lib.format.open_memmap(
+                    self._file(name), mode="w+", dtype=dtype, shape=full_shape
+                )
+            setattr(self, name, array)
+
+        self.pos = pos
+        self.full = bool(full)
+
+    def add(self, obs, next_obs, action, reward, done, infos):
+        if self.mode == "r":
+            raise ValueError("Cannot add transitions to a read-only replay buffer.")
+        super(MemmapReplayBuffer, self).add(obs, next_obs, action, reward, done, infos)
+        # Written after the data, so a process that dies mid-add leaves the slot
+        # outside the stored position (see the class docstring for system crashes)
+        self._header[1] = self.pos
+        self._header[2] = self.full
+
+    def reset(self):
+        super(MemmapReplayBuffer, self).reset()
+        if self.mode != "r":
+            self._header[1:3] = 0
+
+    def flush(self):
+        """Flush dirty pages to disk (no-op for copy-on-write and read-only buffers)."""
+        if self.mode != "r+":
+            return
+        for name in self._layout:
+            getattr(self, name).flush()
+        self._header.flush()
+
+    def __getstate__(self):
+        # Pickle the location only; the arrays are reopened from disk
+        if self.mode == "c":
+            raise ValueError(
+                "Cannot pickle a copy-on-write replay buffer: its transitions and "
+                "position are private to this process and would reload from disk."
+            )
+        self.flush()
+        state = self.__dict__.copy()
+        for name in ["_header", *self._layout]:
+            state.pop(name)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+
+class PrioritizedMemmapReplayBuffer(PrioritizedReplayBuffer, MemmapReplayBuffer):
+    """
+    :class:`PrioritizedReplayBuffer` over :class:`MemmapReplayBuffer` storage.
+
+    Priorities are kept in RAM only. Transitions found on disk when the buffer is
+    reopened all start at the same priority and are refined as they are replayed.
+    """
+
+
+# Replay buffers that can be selected by name with dqn.model.replay_buffer_class
+REPLAY_BUFFER_CLASSES = {
+    "ReplayBuffer": ReplayBuffer,
+    "PrioritizedReplayBuffer": PrioritizedReplayBuffer,
+    "MemmapReplayBuffer": MemmapReplayBuffer,
+    "PrioritizedMemmapReplayBuffer": PrioritizedMemmapReplayBuffer,
+}
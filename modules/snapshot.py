@@ -0,0 +1,141 @@
+import numpy as np
+
+from modules.card import Card
+
+SNAPSHOT_VERSION = 1
+# Suit of each card code block (see Card.code)
+CODE_SUITS = sorted(Card.SUIT_OFFSETS, key=Card.SUIT_OFFSETS.get)
+
+
+def snapshot_dtype(num_t_stacks=7):
+    """
+    Fixed binary layout of a game snapshot, 94 bytes with 7 tableau stacks.
+
+    ``cards`` lists every card code (see Card.code) stack by stack, bottom card
+    first: the tableau stacks, the foundations in f1-f4 order, the waste, the next
+    cards and the deck. ``lengths`` holds the size of each of those stacks and
+    ``hidden`` the number of face-down cards at the bottom of each tableau stack.
+    Every other card is face up. ``random_seed`` is the seed the deck was shuffled
+    with, -1 if there was none.
+    """
+    return np.dtype(
+        [
+            ("version", "u1"),
+            ("num_t_stacks", "u1"),
+            ("cards_per_turn", "u1"),
+            ("complete", "u1"),
+            ("num_waste_cards", "u1"),
+            ("lengths", "u1", (num_t_stacks + 7,)),
+            ("hidden", "u1", (num_t_stacks,)),
+            ("cards", "u1", (52,)),
+            ("points", "<f8"),
+            ("random_seed", "<i8"),
+        ]
+    )
+
+
+def _stacks(game):
+    return (
+        game.t_stack
+        + [game.foundation[suit] for suit in game.FOUNDATION_SUITS]
+        + [game.waste, game.next_cards, game.deck]
+    )
+
+
+def encode_games(games):
+    """
+    Encode games into an array of snapshots.
+
+    Args:
+        games (list): Solitaire games, all with the same number of tableau stacks.
+
+    Returns:
+        np.ndarray: One :func:`snapshot_dtype` record per game.
+    """
+    num_t_stacks = games[0].num_t_stacks if games else 7
+    snapshots = np.zeros(len(games), dtype=snapshot_dtype(num_t_stacks))
+    snapshots["version"] = SNAPSHOT_VERSION
+    snapshots["num_t_stacks"] = num_t_stacks
+    for snapshot, game in zip(snapshots, games):
+        stacks = _stacks(game)
+        snapshot["cards_per_turn"] = game.config.get("cards_per_turn", 3)
+        snapshot["complete"] = game.complete
+        snapshot["num_waste_cards"] = game.num_waste_cards
+        snapshot["lengths"] = [len(stack.cards) for stack in stacks]
+        snapshot["hidden"] = [
+            sum(not card.visible for card in stack.cards) for stack in game.t_stack
+        ]
+        snapshot["cards"] = [card.code() for stack in stacks for card in stack.cards]
+        snapshot["points"] = game.points
+        snapshot["random_seed"] = -1 if game.random_seed is None else game.random_seed
+    return snapshots
+
+
+def restore_game(game, snapshot):
+    """
+    Overwrite the state of a game with a snapshot. The undo history is cleared.
+    """
+    if snapshot["version"] != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {snapshot['version']}")
+    if snapshot["num_t_stacks"] != game.num_t_stacks:
+        raise ValueError(
+            f"Snapshot has {snapshot['num_t_stacks']} tableau stacks, the game has {game.num_t_stacks}."
+        )
+    codes = snapshot["cards"].tolist()
+    position = 0
+    for stack, length in zip(_stacks(game), snapshot["lengths"].tolist()):
+        stack.cards = []
+        for code in codes[position : position + length]:
+            card = Card(CODE_SUITS[(code - 1) // 13], (code - 1) % 13 + 1)
+            card.visible = True
+            stack.cards.append(card)
+        position += length
+    for stack, hidden in zip(game.t_stack, snapshot["hidden"].tolist()):
+        for card in stack.cards[:hidden]:
+            card.visible = False
+
+    points = float(snapshot["points"])
+    game.points = int(points) if points.is_integer() else points
+    game.num_waste_cards = int(snapshot["num_waste_cards"])
+    game.complete = bool(snapshot["complete"])
+    random_seed = int(snapshot["random_seed"])
+    game.random_seed = None if random_seed < 0 else random_seed
+    game.history = []
+    game.num_hidden = int(snapshot["hidden"].sum())
+    game.state_hash = game.compute_hash()
+    game.rebuild_stock_index()
+    game.dead_end_cache = None
+    return game
+
+
+def decode_games(snapshots, config, cls):
+    """
+    Decode an array of snapshots into new games.
+
+    Args:
+        snapshots (np.ndarray): Records of :func:`snapshot_dtype`.
+        config (dict): Game configuration. The deal settings stored in the snapshot
+            (stack count, cards per turn and seed) take precedence.
+        cls (type): The game class, usually Solitaire. It is created with
+            ``deal=False``.
+
+    Returns:
+        list: The games.
+    """
+    games = []
+    for snapshot in snapshots:
+        game_config = dict(
+            config,
+            num_t_stacks=int(snapshot["num_t_stacks"]),
+            cards_per_turn=int(snapshot["cards_per_turn"]),
+        )
+        # An undealt game, so decoding neither shuffles a deck nor reseeds random
+        games.append(restore_game(cls(config=game_config, deal=False), snapshot))
+    return games
+
+
+def read_snapshot(data):
+    """Wrap the bytes of one snapshot as a snapshot record."""
+    if not data or data[0] != SNAPSHOT_VERSION:
+        raise ValueError("Not a Solitaire snapshot of a supported version.")
+    return np.frombuffer(data, dtype=snapshot_dtype(data[1]))[0]
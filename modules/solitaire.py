@@ -1,18 +1,27 @@
 from modules.card import Card
 from modules.deck import Deck
+from modules.snapshot import decode_games, encode_games, read_snapshot, restore_game
 from modules.stack import Stack
+from modules.stock_index import StockIndex
+from modules.zobrist import get_zobrist_keys
 import yaml
 from copy import deepcopy
 
 
 class Solitaire(object):
-    def __init__(self, config=None, config_path=None):
+    # Foundation stacks in the order they are addressed as f1-f4
+    FOUNDATION_SUITS = ["Spades", "Hearts", "Clubs", "Diamonds"]
+
+    def __init__(self, config=None, config_path=None, deal=True):
         """
         Initialize the Solitaire game.
 
         Args:
             config (dict, optional): Configuration dictionary for the game. Defaults to None.
             config_path (str, optional): Path to a YAML file containing game configuration. Defaults to None.
+            deal (bool, optional): Shuffle and deal the cards. Without dealing every stack
+                is empty and the global random state is untouched, for games whose
+                cards are restored afterwards (see modules.snapshot). Defaults to True.
         """
         # Attempt to load configuration from the file if provided
         if config_path:
@@ -20,10 +29,10 @@ class Solitaire(object):
         if config:
             self.config = config
         self.history = []
-        self.num_t_stacks = config.get("num_t_stacks",7)
+        self.num_t_stacks = self.config.get("num_t_stacks",7)
         self.foundation = {
             s: Stack(stack_type=f"Foundation", suit=s)
-            for s in ["Spades", "Hearts", "Clubs", "Diamonds"]
+            for s in self.FOUNDATION_SUITS
         }
         self.t_stack = [
             Stack(stack_type="Tableau Stack") for _ in range(self.num_t_stacks)
@@ -32,13 +41,22 @@ class Solitaire(object):
         self.next_cards = Stack(stack_type="Next Cards")
         self.complete = False
         self.show_messages = self.config.get("show_messages", True)
-        self.deck = Deck(self.config.get("random_seed"))
-        self.reward_dict = self.config.get(
-            "reward_dict", self.open_config("configs/rewards.yaml")
-        )
+        self.random_seed = self.config.get("random_seed")
+        self.deck = Deck(self.random_seed, shuffle=deal)
+        self.reward_dict = self.config.get("reward_dict")
+        if self.reward_dict is None:
+            self.reward_dict = self.open_config("configs/rewards.yaml")
+        # Undo history, turned off for games that are only replayed or simulated
+        self.keep_history = self.config.get("keep_history", True)
         self.points = 0  # Initialize points
         self.num_waste_cards = 0
-        self.deal_cards()
+        self.zobrist_keys = get_zobrist_keys(self.num_t_stacks)
+        self.state_hash = 0
+        self.num_hidden = 0  # Face-down tableau cards, kept up to date as cards turn
+        self.dead_end_cache = None  # (state_hash, result) of the last is_dead_end call
+        self.stock_index = StockIndex(self.config.get("cards_per_turn", 3))
+        if deal:
+            self.deal_cards()
 
     def open_config(self, config_path):
         try:
@@ -72,6 +90,53 @@ class Solitaire(object):
             for _ in range(self.config.get("cards_per_turn", 3)):
                 self.next_cards.add_card(self.deck.remove_card())
 
+        self.num_hidden = sum(
+            not card.visible for stack in self.t_stack for card in stack.cards
+        )
+        self.state_hash = self.compute_hash()
+        self.rebuild_stock_index()
+
+    def rebuild_stock_index(self):
+        self.stock_index.rebuild(self.waste, self.next_cards, self.deck)
+
+    def card_key(self, stack, depth, card):
+        """
+        Zobrist key of a card at a given depth of a stack.
+
+        Args:
+            stack (Stack): The stack holding the card.
+            depth (int): Position of the card in the stack, 0 being the bottom.
+            card (Card): The card.
+
+        Returns:
+            int: A 64-bit key.
+        """
+        if stack.type == "Tableau Stack":
+            return self.zobrist_keys.tableau_key(
+                card.code(), self.t_stack.index(stack), depth, card.visible
+            )
+        return self.zobrist_keys.zone_key(card.code(), stack.type)
+
+    def compute_hash(self):
+        """
+        Compute the 64-bit Zobrist hash of the game state from scratch.
+
+        The game keeps ``state_hash`` up to date incrementally as cards move, so this
+        is only needed after the whole state is replaced.
+
+        Returns:
+            int: The hash of every card's location and visibility.
+        """
+        state_hash = 0
+        for stack in (
+            self.t_stack
+            + list(self.foundation.values())
+            + [self.waste, self.next_cards, self.deck]
+        ):
+            for depth, card in enumerate(stack.cards):
+                state_hash ^= self.card_key(stack, depth, card)
+        return state_hash
+
     def show_cards(self):
         """
         Display the current state of the game, including the Next Cards, Foundation Stacks, and Tableau Stacks.
@@ -156,9 +221,15 @@ class Solitaire(object):
         # Move current next cards to the waste pile
         messages = []
         self.save_state()
+        previous_top = self.next_cards.get_top_card()
+        previous_pointer = len(self.waste.cards) + len(self.next_cards.cards)
+        recycled = False
         while self.next_cards.cards:
             card = self.next_cards.cards.pop(0)
             self.waste.cards.append(card)
+            self.state_hash ^= self.zobrist_keys.zone_key(
+                card.code(), "Next Cards"
+            ) ^ self.zobrist_keys.zone_key(card.code(), "Waste")
 
         # Recycling waste pile if the deck is empty
         if not self.deck.cards and self.waste.cards:
@@ -169,8 +240,13 @@ class Solitaire(object):
                 messages.append("recycling_waste_pile")
             self.num_waste_cards = waste_card_count
 
+            for card in self.waste.cards:
+                self.state_hash ^= self.zobrist_keys.zone_key(
+                    card.code(), "Waste"
+                ) ^ self.zobrist_keys.zone_key(card.code(), "Deck")
             self.deck.cards = self.waste.cards[:]
             self.waste.cards.clear()
+            recycled = True
 
         # Deal new cards from the deck to next cards
         num_cards_to_deal = min(
@@ -181,9 +257,21 @@ class Solitaire(object):
                 card = self.deck.cards.pop(0)
                 card.set_visible(True)
                 self.next_cards.cards.append(card)
+                self.state_hash ^= self.zobrist_keys.zone_key(
+                    card.code(), "Deck"
+                ) ^ self.zobrist_keys.zone_key(card.code(), "Next Cards")
             messages.append("dealing_next_cards")
         else:
             messages.append("no_cards_to_deal")
+
+        if recycled:
+            self.rebuild_stock_index()
+        else:
+            self.stock_index.deal(
+                previous_top,
+                previous_pointer,
+                len(self.waste.cards) + len(self.next_cards.cards) + len(self.deck.cards),
+            )
         return messages
 
     def move_card(self, source, dest, num_cards):
@@ -205,10 +293,17 @@ class Solitaire(object):
             if not result:
                 messages.append("error_moving_cards")
                 return False, messages
+            if source is self.next_cards:
+                # Playing the top card shifts the deal positions of the cards after it
+                self.rebuild_stock_index()
             # Turn over the next card in the tableau stack if applicable
             if source.type == "Tableau Stack" and source.cards:
                 if not source.cards[-1].visible:
+                    depth = len(source.cards) - 1
+                    self.state_hash ^= self.card_key(source, depth, source.cards[-1])
                     source.cards[-1].visible = True
+                    self.state_hash ^= self.card_key(source, depth, source.cards[-1])
+                    self.num_hidden -= 1
                     messages.append("reveal_hidden_card")
             return result, messages
         else:
@@ -228,7 +323,10 @@ class Solitaire(object):
             tuple: (bool, str) - A boolean indicating the success of the move and a string describing the action.
         """
         cards_to_move = self.get_cards_to_move(source, num_cards)
-        for card in cards_to_move:
+        source_depth = len(source.cards) - len(cards_to_move)
+        for offset, card in enumerate(cards_to_move):
+            self.state_hash ^= self.card_key(source, source_depth + offset, card)
+            self.state_hash ^= self.card_key(dest, len(dest.cards), card)
             dest.add_card(card)
             source.remove_card()
         return True
@@ -430,8 +528,8 @@ class Solitaire(object):
         self.complete = self.status()
         while not self.complete:
             self.show_current_state()
-            available_moves = self.check_available_moves()
             if self.show_messages:
+                available_moves = self.check_available_moves()
                 print("Available moves:")
                 for am in available_moves:
                     print(f"{am[0]} > {am[1]} ({am[2]} cards)")
@@ -454,7 +552,7 @@ class Solitaire(object):
         print("Current board:")
         self.show_cards()
         print(
-            "Enter your move or command (Enter to deal, 's' to show, 'u' to undo, 'q' to quit):"
+            "Enter your move or command (Enter to deal, 's' to show, 'u' to undo, 'h' for a hint, 'a' to auto-finish, 'q' to quit):"
         )
 
     def get_user_input(self):
@@ -478,6 +576,10 @@ class Solitaire(object):
             return
         if user_input == "s":
             self.show_cards()
+        elif user_input == "h":
+            self.show_hint()
+        elif user_input == "a":
+            self.auto_finish()
         elif user_input == "":
             self.reward_points(self.deal_next_cards())
         elif user_input == "q":
@@ -503,6 +605,39 @@ class Solitaire(object):
         else:
             print("Invalid input. Please try again.")
 
+    def show_hint(self):
+        """
+        Print the best move found by the hint engine within config["hint_time_limit"] seconds.
+        """
+        from modules.hints import HintEngine
+
+        engine = HintEngine(
+            cards_per_turn=self.config.get("cards_per_turn", 3),
+            time_limit=self.config.get("hint_time_limit", 0.05),
+        )
+        move = engine.best_move(self)
+        if move is None:
+            print("Hint: no moves available.")
+        elif move.source == "deal":
+            print("Hint: deal the next cards (Enter).")
+        else:
+            print(f"Hint: {move.source} > {move.dest} ({move.num_cards} cards)")
+
+    def auto_finish(self):
+        """
+        Play out the game if it is a guaranteed win (see can_auto_complete).
+        """
+        if not self.can_auto_complete():
+            print(
+                "Auto-finish is only available once every tableau card is face up"
+                " (and, drawing several cards at a time, the stock is empty)."
+            )
+            return
+        messages = self.auto_complete()
+        self.reward_points(messages, hide=True)
+        print(f"Auto-finished, {len(messages)} cards moved to the foundations.")
+        self.show_score()
+
     def reward_points(self, messages, hide=False):
         """
         Reward points based on the messages returned from the game.
@@ -654,10 +789,263 @@ class Solitaire(object):
         )
         return total_cards_in_foundation
 
+    def can_move_to_foundation(self, card):
+        """
+        Check whether a card is the next card of its foundation.
+        """
+        return card.number == len(self.foundation[card.suit].cards) + 1
+
+    def is_safe_foundation_move(self, card):
+        """
+        Check whether moving a card to its foundation can never be a mistake: aces and
+        twos always, otherwise when both foundations of the other color already hold
+        the cards that could be placed onto it.
+
+        Args:
+            card (Card): A card that can move to its foundation.
+
+        Returns:
+            bool: True if the move is safe.
+        """
+        # The solver's rule over card codes, so the two can not drift apart
+        from modules.solver import is_safe_foundation_card
+        from modules.state import SUIT_NAMES
+
+        foundation = [len(self.foundation[suit].cards) for suit in SUIT_NAMES]
+        return is_safe_foundation_card(card.code(), foundation)
+
+    def apply_safe_foundation_moves(self):
+        """
+        Move every card that can safely go to the foundation, until none is left.
+
+        Returns:
+            list: The messages of all the moves made, as returned by execute_move.
+        """
+        messages = []
+        foundation_ids = {
+            suit: f"f{idx + 1}" for idx, suit in enumerate(self.foundation.keys())
+        }
+        moved = True
+        while moved and not self.complete:
+            moved = False
+            sources = [(str(idx + 1), stack) for idx, stack in enumerate(self.t_stack)]
+            sources.append(("n", self.next_cards))
+            for source_id, stack in sources:
+                card = stack.get_top_card()
+                if (
+                    card is not None
+                    and card.visible
+                    and self.can_move_to_foundation(card)
+                    and self.is_safe_foundation_move(card)
+                ):
+                    result, move_messages = self.execute_move(
+                        source_id, foundation_ids[card.suit], num_cards=1
+                    )
+                    messages.extend(move_messages)
+                    moved = moved or result
+        return messages
+
+    def is_playable(self, card):
+        """
+        Check whether a card could be moved to its foundation or onto a tableau stack.
+        """
+        if self.can_move_to_foundation(card):
+            return True
+        for stack in self.t_stack:
+            top_card = stack.get_top_card()
+            if top_card is None:
+                if card.number == 13:
+                    return True
+            elif top_card.color != card.color and top_card.number == card.number + 1:
+                return True
+        return False
+
+    def deal_until_playable(self):
+        """
+        Deal from the stock until the top next card is playable, stopping after a full
+        cycle through the stock if none is.
+
+        Returns:
+            list: The messages of every deal, as returned by deal_next_cards.
+        """
+        messages = []
+        seen = set()
+        while self.state_hash not in seen:
+            seen.add(self.state_hash)
+            messages.extend(self.deal_next_cards())
+            top_card = self.next_cards.get_top_card()
+            if top_card is None or self.is_playable(top_card):
+                break
+        return messages
+
+    def reachable_stock_cards(self):
+        """
+        Cards that can reach the top of the next cards by dealing alone.
+
+        Returns:
+            list: The reachable stock cards, in stock order.
+        """
+        return self.stock_index.cards()
+
+    def has_productive_move(self):
+        """
+        Check for a single move that adds to the foundation or reveals a card, treating
+        every reachable stock card as playable.
+        """
+        for card in [stack.get_top_card() for stack in self.t_stack] + (
+            self.reachable_stock_cards()
+        ):
+            if card is not None and card.visible and self.can_move_to_foundation(card):
+                return True
+        for stack in self.t_stack:
+            if stack.cards and not stack.cards[0].visible:
+                base = next(card for card in stack.cards if card.visible)
+                if self.is_playable(base):
+                    return True
+        return False
+
+    def can_make_progress(self, max_nodes=2000):
+        """
+        Search the positions reachable without progress for one that adds to the
+        foundation or reveals a card. Every legal move is searched, including the
+        tableau moves the solver prunes, so a winnable game is never reported stuck.
+
+        Args:
+            max_nodes (int): Positions to expand before giving up.
+
+        Returns:
+            bool: False only if every reachable position was searched without finding
+                progress; True if progress was found or the budget ran out.
+        """
+        from modules.solver import Solver
+        from modules.state import state_from_game
+
+        solver = Solver(
+            cards_per_turn=self.config.get("cards_per_turn", 3),
+            foundation_to_tableau=True,
+            prune_moves=False,
+        )
+        start = state_from_game(self)
+        foundation = sum(start[1])
+        hidden = sum(num_hidden for num_hidden, _ in start[0])
+        seen = {start}
+        frontier = [start]
+        while frontier:
+            for _, child in solver.successors(frontier.pop()):
+                if sum(child[1]) > foundation or (
+                    sum(num_hidden for num_hidden, _ in child[0]) < hidden
+                ):
+                    return True
+                if child not in seen:
+                    if len(seen) >= max_nodes:
+                        return True
+                    seen.add(child)
+                    frontier.append(child)
+        return False
+
+    def is_dead_end(self, max_nodes=2000):
+        """
+        Check whether the game is lost: no sequence of moves adds a card to the
+        foundation or reveals a card. The result is cached until the state changes.
+
+        Args:
+            max_nodes (int): Search budget, see can_make_progress.
+
+        Returns:
+            bool: True if the game can no longer make progress.
+        """
+        if self.dead_end_cache is not None and self.dead_end_cache[0] == self.state_hash:
+            return self.dead_end_cache[1]
+        dead_end = not (
+            self.complete
+            or self.has_productive_move()
+            or self.can_make_progress(max_nodes=max_nodes)
+        )
+        self.dead_end_cache = (self.state_hash, dead_end)
+        return dead_end
+
+    def can_auto_complete(self):
+        """
+        Check whether the game is a guaranteed win that can be completed directly.
+
+        With every tableau card face up, the lowest card not on a foundation is always
+        on top of its tableau stack or in the stock. Drawing one card at a time reaches
+        every stock card, so the game is won; drawing several only when the stock is
+        empty.
+
+        Returns:
+            bool: True if the game can be auto-completed.
+        """
+        if self.complete or self.num_hidden:
+            return False
+        return self.config.get("cards_per_turn", 3) == 1 or not (
+            self.deck.cards or self.waste.cards or self.next_cards.cards
+        )
+
+    def auto_complete(self):
+        """
+        Move every remaining card to its foundation in one call, lowest rank first.
+
+        Returns:
+            list: A foundation move message for every card moved, so the moves are
+                rewarded as if they had been played one by one.
+        """
+        messages = []
+        self.save_state()
+        remaining = [
+            (card.number, stack, card)
+            for stack in self.t_stack + [self.waste, self.next_cards, self.deck]
+            for card in stack.cards
+        ]
+        remaining.sort(key=lambda item: item[0])
+        for number, stack, card in remaining:
+            dest = self.foundation[card.suit]
+            self.state_hash ^= self.card_key(stack, stack.cards.index(card), card)
+            self.state_hash ^= self.card_key(dest, len(dest.cards), card)
+            stack.cards.remove(card)
+            dest.add_card(card)
+            messages.append(
+                "ace_to_foundation" if number == 1 else "successful_foundation_move"
+            )
+        self.rebuild_stock_index()
+        self.complete = self.status()
+        return messages
+
+    def to_bytes(self):
+        """
+        Encode the game as a compact binary snapshot (see modules.snapshot).
+
+        Returns:
+            bytes: The snapshot, 94 bytes with 7 tableau stacks.
+        """
+        return encode_games([self]).tobytes()
+
+    @classmethod
+    def from_bytes(cls, data, config):
+        """
+        Create a game from a snapshot made by to_bytes.
+
+        Args:
+            data (bytes): The snapshot.
+            config (dict): Game configuration for settings the snapshot does not hold.
+
+        Returns:
+            Solitaire: The restored game, with an empty undo history.
+        """
+        return decode_games([read_snapshot(data)], config, cls)[0]
+
+    def load_bytes(self, data):
+        """
+        Restore this game in place from a snapshot made by to_bytes.
+        """
+        return restore_game(self, read_snapshot(data))
+
     def save_state(self):
         """
         Save the current state of the game.
         """
+        if not self.keep_history:
+            return
         # Create a deep copy of the current state
         state = {
             "points": self.points,
@@ -666,10 +1054,23 @@ class Solitaire(object):
             "waste": deepcopy(self.waste),
             "next_cards": deepcopy(self.next_cards),
             "deck": deepcopy(self.deck),
+            "state_hash": self.state_hash,
+            "num_hidden": self.num_hidden,
         }
         # Push the copied state onto a stack
         self.history.append(state)
 
+    def memory_usage(self):
+        """
+        Bytes held by the undo history, which keeps a full copy of the game per move.
+
+        Returns:
+            dict: ``{"engine/history": bytes}``, estimated from a sample of the states.
+        """
+        from modules.memory import container_sizeof
+
+        return {"engine/history": container_sizeof(self.history)}
+
     def undo_move(self):
         """
         Undo the last move.
@@ -682,6 +1083,9 @@ class Solitaire(object):
             self.waste = last_state["waste"]
             self.next_cards = last_state["next_cards"]
             self.deck = last_state["deck"]
+            self.state_hash = last_state["state_hash"]
+            self.num_hidden = last_state["num_hidden"]
+            self.rebuild_stock_index()
             print("Last move undone.")
         else:
             print("No more moves to undo.")
@@ -772,12 +1176,4 @@ class Solitaire(object):
         return possible_moves
 
     def get_available_cards(self):
-        available_cards = [self.next_cards.get_top_card()] + (self.deck.cards)[2::3]
-        if self.deck.cards:
-            if self.deck.cards[-1] not in available_cards:
-                available_cards.append(self.deck.cards[-1])
-
-        available_cards.extend(
-            (self.waste.cards + self.next_cards.cards + self.deck.cards)[2::3]
-        )
-        return available_cards
+        return self.reachable_stock_cards()
@@ -1,13 +1,21 @@
 import gymnasium
 from gymnasium import spaces
 from modules.solitaire import Solitaire
+from modules.deal_index import make_deal_sampler
+from modules.canonical import canonical_game_hash
+from modules.actions import (
+    action_mask,
+    decode_action,
+    encode_action,
+    play_action,
+    stack_id,
+)
+from modules.game_record import GameRecord, append_record, config_hash
 
 import numpy as np
-import random
-import csv
-import pandas as pd
 import os
 import time
+from collections import OrderedDict
 
 
 def exploration_rate(
@@ -65,6 +73,8 @@ class SolitaireEnv(gymnasium.Env):
         # Initialize the Solitaire game
         self.config = config
         self.game = Solitaire(config=config)
+        # Every reset creates a new game, parse the reward table only once
+        self.config.setdefault("reward_dict", self.game.reward_dict)
         self.action_log = []
         self.num_destinations = self.config.get("num_t_stacks", 7) + 4
         self.num_source_stacks = self.num_destinations + 1
@@ -90,6 +100,9 @@ class SolitaireEnv(gymnasium.Env):
         )
 
         self.current_seed = None
+        self.current_bucket = None
+        # Draws deals by difficulty when env.deal_index is configured
+        self.deal_sampler = make_deal_sampler(self.config, instance)
         self.prev_state = {"foundation_count": [0, 0, 0, 0], "hidden_cards": set()}
 
         self.current_episode = 0
@@ -99,19 +112,36 @@ class SolitaireEnv(gymnasium.Env):
         self.games_completed = 0
         self.env_instance = instance
 
+        # Bounded table of game states visited this episode, keyed by Zobrist hash
+        self.visited_states = OrderedDict()
+        self.repeated_states = 0
+
+        # Actions of the current episode, saved as a compact game record
+        self.episode_actions = []
+
         self.time = time.time()
 
     def reset(self, seed=2, options=None):
         self.steps_since_progress = 0
-        seed = next(number_gen)
+        if options and options.get("deal_seed") is not None:
+            seed = options["deal_seed"]
+            self.current_bucket = None
+        elif self.deal_sampler is not None:
+            seed, self.current_bucket = self.deal_sampler.sample(self.current_episode)
+        else:
+            seed = next(number_gen)
         self.current_seed = seed
         config = self.config
         print(f"Successful moves: {self.move_count}")
         config.update({"random_seed": seed})
         self.game = Solitaire(config)
+        self.visited_states.clear()
+        self.visited_states[self.visited_state_key()] = 0
+        self.repeated_states = 0
+        self.episode_actions = []
         print("New game started.")
         observation = self.get_observation()
-        info = {}  # You can add additional reset info if needed
+        info = {"deal_seed": seed, "deal_bucket": self.current_bucket}
         self.current_episode += 1
         self.current_step = 0
         self.move_count = 0
@@ -129,17 +159,20 @@ class SolitaireEnv(gymnasium.Env):
         end_message = ""
 
         # Execute the action
+        state_hash = self.game.state_hash
 
+        move_result, messages = play_action(
+            self.game, source_idx, dest_idx, num_cards, self.config["env"]
+        )
         if source_idx == self.game.num_t_stacks + 4 + 1:  # Deal next cards action
-            messages = self.game.deal_next_cards()
             self.steps_since_progress += 1
-            move_result = False
-        else:
-            source_stack = self.get_stack(source_idx)
-            dest_stack = self.get_stack(dest_idx)
-            move_result, messages = self.game.execute_move(
-                source_stack, dest_stack, num_cards=num_cards
-            )
+        self.episode_actions.append(action)
+
+        repeated = False
+        if self.config["env"].get("cycle_detection", False):
+            repeated = self.check_repetition(state_hash)
+            if repeated and self.config["env"].get("penalize_repeated_states", False):
+                messages = messages + ["repeated_state"]
 
         reward = self.game.reward_points(messages)
 
@@ -165,6 +198,21 @@ class SolitaireEnv(gymnasium.Env):
                 terminated = True
                 end_message = "Stagnation threshold reached."
 
+        if (
+            self.config["env"].get("dead_end_detection", False)
+            and not self.game.complete
+            and self.game.is_dead_end(
+                max_nodes=self.config["env"].get("dead_end_max_nodes", 2000)
+            )
+        ):
+            terminated = True
+            end_message = "Dead end: no productive moves left."
+
+        repeated_state_limit = self.config["env"].get("repeated_state_limit", 0)
+        if repeated and repeated_state_limit and self.repeated_states >= repeated_state_limit:
+            truncated = True
+            end_message = "Repeated state limit reached."
+
         if self.current_step >= self.config.get("env").get(
             "max_steps_per_game", 100000
         ):
@@ -176,6 +224,7 @@ class SolitaireEnv(gymnasium.Env):
         info = {
             "games_completed": self.games_completed,
             "move_count": self.move_count,
+            "repeated_states": self.repeated_states,
         }
         self.current_step += 1
         SolitaireEnv.total_steps += 1
@@ -187,6 +236,8 @@ class SolitaireEnv(gymnasium.Env):
             terminated = True
 
         if terminated or truncated:
+            if self.config["env"].get("record_games", False):
+                self.save_game_record()
             print(f"Current seed: {self.current_seed}")
             self.game.show_score()
             #self.game.show_cards()
@@ -236,6 +287,40 @@ class SolitaireEnv(gymnasium.Env):
 
         return observation, reward, terminated, truncated, info
 
+    def check_repetition(self, previous_hash):
+        """
+        Record the current game state and report whether it was visited before
+        in this episode. Actions that leave the state unchanged (invalid moves)
+        are not repetitions.
+
+        Args:
+            previous_hash (int): Hash of the state before the action.
+
+        Returns:
+            bool: True if the action led back to an already visited state.
+        """
+        if self.game.state_hash == previous_hash:
+            return False
+        state_key = self.visited_state_key()
+        if state_key in self.visited_states:
+            self.visited_states.move_to_end(state_key)
+            self.repeated_states += 1
+            return True
+        self.visited_states[state_key] = self.current_step
+        if len(self.visited_states) > self.config["env"].get("visited_states_max", 100000):
+            self.visited_states.popitem(last=False)
+        return False
+
+    def visited_state_key(self):
+        """
+        Key of the current state in the visited-state table: the game's Zobrist hash,
+        or with env.canonical_states the hash of its canonical form, so moving a king
+        between empty stacks also counts as a repeat.
+        """
+        if self.config["env"].get("canonical_states", False):
+            return canonical_game_hash(self.game)
+        return self.game.state_hash
+
     def adjust_reward(self, reward):
         if reward > 0:
             reward *= 1 + self.game.get_foundation_count() / 52
@@ -250,14 +335,7 @@ class SolitaireEnv(gymnasium.Env):
 
     def get_stack(self, idx):
         # Map index to the corresponding stack in the game
-        if idx < self.game.num_t_stacks:
-            return str(idx + 1)  # Tableau stacks 0-6
-        elif self.game.num_t_stacks - 1 < idx < self.game.num_t_stacks + 4:
-            return f"f{idx+1-self.game.num_t_stacks}"  # Foundation stacks 0-3
-        elif idx == self.game.num_t_stacks + 4:
-            return "n"  # Next cards stack
-        else:
-            raise ValueError(f"Invalid stack index: {idx}")
+        return stack_id(idx, self.game.num_t_stacks)
 
     def get_observation(self):
         # Initialize the observation array
@@ -284,30 +362,77 @@ class SolitaireEnv(gymnasium.Env):
     def encode_card(self, card):
         if card is None:
             return 0  # Represent missing cards as 0
-        suit_order = {"Hearts": 0, "Diamonds": 13, "Clubs": 26, "Spades": 39}
-        card_number = suit_order[card.suit] + card.number
-        return card_number
+        return card.code()
 
     def decode_action(self, action):
-        num_destinations = self.game.num_t_stacks + 4
-        DEAL_ACTION = self.action_space.n - 1
-        if action == DEAL_ACTION:
-            return (
-                num_destinations + 1,
-                1,
-                1,
-            )  # Explicit immediate return for special action
-        source_stack = action // (num_destinations * self.max_cards_per_move)
-        action %= num_destinations * self.max_cards_per_move
-        destination_stack = action // self.max_cards_per_move
-        num_cards = action % self.max_cards_per_move + 1
-        return source_stack, destination_stack, num_cards
+        return decode_action(action, self.game.num_t_stacks)
+
+    def encode_action(self, source_idx, dest_idx, num_cards):
+        """
+        Inverse of decode_action for a move between stacks.
+        """
+        return encode_action(source_idx, dest_idx, num_cards, self.game.num_t_stacks)
+
+    def action_masks(self):
+        """
+        Boolean mask of the legal actions in the current state.
+        """
+        return action_mask(self.game)
+
+    def get_stack_index(self, stack_id):
+        """
+        Inverse of get_stack: map a stack identifier ("1"-"7", "f1"-"f4", "n") to its index.
+        """
+        if stack_id == "n":
+            return self.game.num_t_stacks + 4
+        if stack_id.startswith("f"):
+            return self.game.num_t_stacks + int(stack_id[1:]) - 1
+        return int(stack_id) - 1
+
+    def action_from_move(self, source, dest, num_cards):
+        """
+        Encode a move given as engine stack identifiers (as in Solitaire.execute_move),
+        or a deal when ``source`` is "deal", as an action of this env.
+        """
+        if source == "deal":
+            return self.action_space.n - 1
+        return self.encode_action(
+            self.get_stack_index(source), self.get_stack_index(dest), num_cards
+        )
+
+    def save_game_record(self):
+        """
+        Append the episode to this env's game record file in the log directory, as
+        the deal seed plus 2 bytes per action (see modules.game_record).
+        """
+        os.makedirs(self.log_path, exist_ok=True)
+        append_record(
+            os.path.join(self.log_path, f"{self.env_instance}_games.bin"),
+            GameRecord(self.current_seed, config_hash(self.config), self.episode_actions),
+        )
+
+    def memory_usage(self):
+        """
+        Bytes held by the game and the per-episode and per-step buffers of this env.
+
+        Returns:
+            dict: Bytes per component, ``engine/...`` and ``env/...``.
+        """
+        from modules.memory import container_sizeof
+
+        usage = self.game.memory_usage()
+        usage["env/action_log"] = container_sizeof(self.action_log)
+        usage["env/visited_states"] = container_sizeof(self.visited_states)
+        usage["env/episode_actions"] = container_sizeof(self.episode_actions)
+        return usage
 
     def log_action(self, log_row):
         self.action_log.append(log_row)
 
     def save_log(self):
         # Save the action log to a CSV file
+        import pandas as pd  # Only needed here, keeps env worker startup light
+
         log_df = pd.DataFrame(self.action_log)
         full_log_path = f"{self.log_path}/{self.env_instance}_{log_df.loc[0,'total_steps']}_{log_df['step'].max()}.csv"
         os.makedirs(self.log_path, exist_ok=True)
@@ -0,0 +1,431 @@
+import argparse
+import multiprocessing
+import time
+from array import array
+from functools import partial
+from typing import NamedTuple
+
+import yaml
+
+from modules.canonical import canonical_state
+from modules.solitaire import Solitaire
+from modules.state import (
+    FOUNDATION_IDS,
+    OPPOSITE_SUITS,
+    RANK,
+    RED,
+    SUIT,
+    is_won,
+    state_from_game,
+)
+
+SOLVED = "solved"
+UNSOLVABLE = "unsolvable"
+UNKNOWN = "unknown"
+
+
+class Move(NamedTuple):
+    """A move in the terms of ``Solitaire.execute_move`` (or a deal from the stock)."""
+
+    source: str
+    dest: str
+    num_cards: int
+
+
+DEAL = Move("deal", "", 0)
+
+
+class SolveResult(NamedTuple):
+    seed: object
+    status: str
+    moves: list
+    nodes: int
+    elapsed: float
+
+
+def is_safe_foundation_card(code, foundation):
+    """
+    A card is safe to move to the foundation when no other card could still need it:
+    aces and twos always, otherwise when both foundations of the other color
+    already hold the cards that could be placed onto it.
+    """
+    rank = RANK[code]
+    if rank <= 2:
+        return True
+    first, second = OPPOSITE_SUITS[SUIT[code]]
+    return foundation[first] >= rank - 1 and foundation[second] >= rank - 1
+
+
+def play_moves(game, moves):
+    """
+    Apply solver moves to a Solitaire game through its regular move methods,
+    scoring each move's reward messages like interactive play does.
+
+    Returns:
+        bool: True if the game is complete afterwards.
+    """
+    for move in moves:
+        if move.source == DEAL.source:
+            messages = game.deal_next_cards()
+        else:
+            _, messages = game.execute_move(move.source, move.dest, move.num_cards)
+        game.reward_points(messages, hide=True)
+    return game.status()
+
+
+class TranspositionTable(object):
+    """
+    Fixed-size, always-replace table of state hashes.
+
+    Memory is bounded by ``size`` 8-byte slots. A collision evicts the older state,
+    which may cost re-searching it but never a wrong answer for states still stored
+    (a full 64-bit hash is compared, not only the slot).
+    """
+
+    def __init__(self, size=1 << 22):
+        self.size = 1 << max(int(size) - 1, 0).bit_length()
+        self.mask = self.size - 1
+        self.table = array("q", bytes(8 * self.size))
+
+    def check_and_store(self, key):
+        """
+        Record a state and report whether it was already present.
+
+        Returns:
+            bool: True if the state was stored before this call.
+        """
+        h = hash(key) or 1
+        slot = h & self.mask
+        if self.table[slot] == h:
+            return True
+        self.table[slot] = h
+        return False
+
+
+class Solver(object):
+    def __init__(
+        self,
+        cards_per_turn=3,
+        max_nodes=1_000_000,
+        time_limit=None,
+        table_size=1 << 22,
+        foundation_to_tableau=False,
+        canonical=True,
+        remap_suits=False,
+        prune_moves=True,
+    ):
+        """
+        Depth-first Klondike solver.
+
+        Moves are ordered by how much progress they make (foundation moves and
+        reveals first, dealing last). A safe foundation move dominates everything
+        else and is played alone. Tableau moves that neither reveal a card, empty a
+        stack, nor expose a foundation card are pruned.
+
+        Real solutions occasionally need a pruned move (a partial run moved to
+        expose a card for another tableau stack), so an exhausted search only proves
+        a deal unsolvable if no legal move was pruned on the way; otherwise the
+        result is ``"unknown"``.
+
+        Args:
+            cards_per_turn (int): Cards dealt from the stock per deal (1 or 3).
+            max_nodes (int): Node budget per solve, after which the result is unknown.
+            time_limit (float, optional): Time budget per solve in seconds.
+            table_size (int): Number of slots of the transposition table.
+            foundation_to_tableau (bool): Also search moves back off the foundation.
+                They are legal but almost never needed and widen the search considerably.
+            canonical (bool): Key the transposition table by the canonical form of a
+                state, so permutations of the tableau stacks are searched once.
+            remap_suits (bool): Also treat same-color suit swaps as one state.
+            prune_moves (bool): Prune the tableau moves described above. Without
+                pruning, they are generated after the deal.
+        """
+        self.cards_per_turn = cards_per_turn
+        self.max_nodes = max_nodes
+        self.time_limit = time_limit
+        self.table_size = table_size
+        self.foundation_to_tableau = foundation_to_tableau
+        self.canonical = canonical
+        self.remap_suits = remap_suits
+        self.prune_moves = prune_moves
+        # Set when successors skipped a legal move, see solve
+        self.pruned = False
+
+    def table_key(self, state):
+        if self.canonical:
+            return canonical_state(state, remap_suits=self.remap_suits)
+        return state
+
+    def solve_game(self, game, seed=None):
+        return self.solve(state_from_game(game), seed=seed)
+
+    def solve(self, state, seed=None):
+        """
+        Search for a sequence of moves that completes the game.
+
+        Args:
+            state (tuple): A state from :func:`state_from_game`.
+            seed (optional): Identifier copied to the result.
+
+        Returns:
+            SolveResult: ``status`` is ``"solved"`` with the winning ``moves``,
+                ``"unsolvable"`` if the search space was exhausted, or ``"unknown"``
+                if a budget ran out first or a legal move was left out.
+        """
+        start = time.time()
+        deadline = start + self.time_limit if self.time_limit else None
+        table = TranspositionTable(self.table_size)
+        table.check_and_store(self.table_key(state))
+        nodes = 0
+        self.pruned = False
+
+        if is_won(state):
+            return SolveResult(seed, SOLVED, [], nodes, time.time() - start)
+
+        path = []
+        stack = [iter(self.successors(state))]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                if path:
+                    path.pop()
+                continue
+
+            move, child_state = child
+            if is_won(child_state):
+                return SolveResult(
+                    seed, SOLVED, path + [move], nodes, time.time() - start
+                )
+            if table.check_and_store(self.table_key(child_state)):
+                continue
+
+            nodes += 1
+            if nodes >= self.max_nodes or (
+                deadline and nodes & 1023 == 0 and time.time() > deadline
+            ):
+                return SolveResult(seed, UNKNOWN, [], nodes, time.time() - start)
+            path.append(move)
+            stack.append(iter(self.successors(child_state)))
+
+        status = UNKNOWN if self.pruned else UNSOLVABLE
+        return SolveResult(seed, status, [], nodes, time.time() - start)
+
+    def successors(self, state):
+        """
+        Generate the (ordered, pruned) moves of a state.
+
+        Returns:
+            list: ``(move, next_state)`` pairs, most promising first.
+        """
+        tableau, foundation, stock, pointer, num_next = state
+        candidates = []
+        next_card = stock[pointer - 1] if num_next else 0
+
+        # Moves to the foundation
+        for index, (hidden, cards) in enumerate(tableau):
+            if len(cards) > hidden:
+                code = cards[-1]
+                if foundation[SUIT[code]] == RANK[code] - 1:
+                    child = self._tableau_to_foundation(state, index)
+                    move = Move(str(index + 1), FOUNDATION_IDS[SUIT[code]], 1)
+                    if is_safe_foundation_card(code, foundation):
+                        return [(move, child)]
+                    revealing = hidden == len(cards) - 1 and hidden > 0
+                    candidates.append((1 if revealing else 3, move, child))
+        if next_card and foundation[SUIT[next_card]] == RANK[next_card] - 1:
+            child = self._next_to_foundation(state)
+            move = Move("n", FOUNDATION_IDS[SUIT[next_card]], 1)
+            if is_safe_foundation_card(next_card, foundation):
+                return [(move, child)]
+            candidates.append((3, move, child))
+
+        # Moves between tableau stacks
+        empty_dest = next(
+            (index for index, (_, cards) in enumerate(tableau) if not cards), None
+        )
+        for source, (hidden, cards) in enumerate(tableau):
+            for start in range(hidden, len(cards)):
+                code = cards[start]
+                if start == hidden and hidden > 0:
+                    priority = 2
+                elif start == hidden:
+                    # Emptying a stack only helps if it is not already a king's base;
+                    # moving the whole stack to another empty one just swaps the two
+                    if RANK[code] == 13:
+                        continue
+                    priority = 6
+                else:
+                    # A partial move is only useful to free the card below it
+                    below = cards[start - 1]
+                    if foundation[SUIT[below]] == RANK[below] - 1:
+                        priority = 5
+                    elif self.prune_moves:
+                        self._skip(tableau, code, source, empty_dest)
+                        continue
+                    else:
+                        priority = 9
+                for dest in self._tableau_destinations(tableau, code, source, empty_dest):
+                    child = self._tableau_to_tableau(state, source, dest, start)
+                    candidates.append(
+                        (priority, Move(str(source + 1), str(dest + 1), len(cards) - start), child)
+                    )
+
+        # Next card to the tableau
+        if next_card:
+            for dest in self._tableau_destinations(tableau, next_card, None, empty_dest):
+                child = self._next_to_tableau(state, dest)
+                candidates.append((4, Move("n", str(dest + 1), 1), child))
+
+        for suit, count in enumerate(foundation):
+            if count:
+                code = suit * 13 + count
+                if not self.foundation_to_tableau:
+                    self._skip(tableau, code, None, empty_dest)
+                    continue
+                for dest in self._tableau_destinations(tableau, code, None, empty_dest):
+                    child = self._foundation_to_tableau(state, suit, dest)
+                    candidates.append((7, Move(FOUNDATION_IDS[suit], str(dest + 1), 1), child))
+
+        if stock:
+            candidates.append((8, DEAL, self._deal(state)))
+
+        # Stable sort keeps the generation order within a priority
+        candidates.sort(key=lambda candidate: candidate[0])
+        return [(move, child) for _, move, child in candidates]
+
+    def _skip(self, tableau, code, source, empty_dest):
+        # Record a pruned move, the search is no longer exhaustive
+        if not self.pruned and next(
+            self._tableau_destinations(tableau, code, source, empty_dest), None
+        ) is not None:
+            self.pruned = True
+
+    def _tableau_destinations(self, tableau, code, source, empty_dest):
+        rank = RANK[code]
+        red = RED[code]
+        for dest, (_, cards) in enumerate(tableau):
+            if dest == source or not cards:
+                continue
+            top = cards[-1]
+            if RANK[top] == rank + 1 and RED[top] != red:
+                yield dest
+        # Empty stacks are interchangeable, so only the first one is tried
+        if rank == 13 and empty_dest is not None and empty_dest != source:
+            yield empty_dest
+
+    def _deal(self, state):
+        tableau, foundation, stock, pointer, _ = state
+        if pointer == len(stock):
+            pointer = 0  # Recycle the waste pile
+        dealt = min(len(stock) - pointer, self.cards_per_turn)
+        return tableau, foundation, stock, pointer + dealt, dealt
+
+    @staticmethod
+    def _replace_stack(tableau, index, hidden, cards):
+        # Reveal the new top card if it is hidden
+        if hidden and hidden >= len(cards):
+            hidden = len(cards) - 1
+        return tableau[:index] + ((hidden, cards),) + tableau[index + 1 :]
+
+    @staticmethod
+    def _add_to_foundation(foundation, suit):
+        return foundation[:suit] + (foundation[suit] + 1,) + foundation[suit + 1 :]
+
+    def _tableau_to_foundation(self, state, index):
+        tableau, foundation, stock, pointer, num_next = state
+        hidden, cards = tableau[index]
+        code = cards[-1]
+        tableau = self._replace_stack(tableau, index, hidden, cards[:-1])
+        return tableau, self._add_to_foundation(foundation, SUIT[code]), stock, pointer, num_next
+
+    def _tableau_to_tableau(self, state, source, dest, start):
+        tableau, foundation, stock, pointer, num_next = state
+        hidden, cards = tableau[source]
+        dest_hidden, dest_cards = tableau[dest]
+        tableau = self._replace_stack(tableau, dest, dest_hidden, dest_cards + cards[start:])
+        tableau = self._replace_stack(tableau, source, hidden, cards[:start])
+        return tableau, foundation, stock, pointer, num_next
+
+    def _next_to_foundation(self, state):
+        tableau, foundation, stock, pointer, num_next = state
+        code = stock[pointer - 1]
+        stock = stock[: pointer - 1] + stock[pointer:]
+        return tableau, self._add_to_foundation(foundation, SUIT[code]), stock, pointer - 1, num_next - 1
+
+    def _next_to_tableau(self, state, dest):
+        tableau, foundation, stock, pointer, num_next = state
+        code = stock[pointer - 1]
+        hidden, cards = tableau[dest]
+        tableau = self._replace_stack(tableau, dest, hidden, cards + (code,))
+        stock = stock[: pointer - 1] + stock[pointer:]
+        return tableau, foundation, stock, pointer - 1, num_next - 1
+
+    def _foundation_to_tableau(self, state, suit, dest):
+        tableau, foundation, stock, pointer, num_next = state
+        code = suit * 13 + foundation[suit]
+        hidden, cards = tableau[dest]
+        tableau = self._replace_stack(tableau, dest, hidden, cards + (code,))
+        foundation = foundation[:suit] + (foundation[suit] - 1,) + foundation[suit + 1 :]
+        return tableau, foundation, stock, pointer, num_next
+
+
+def deal_game(config, seed):
+    """Deal the game for a seed without printing game messages."""
+    config = dict(config, random_seed=seed, show_messages=False)
+    return Solitaire(config=config)
+
+
+def _solve_seed(seed, config, solver_kwargs):
+    game = deal_game(config, seed)
+    solver = Solver(cards_per_turn=config.get("cards_per_turn", 3), **solver_kwargs)
+    return solver.solve_game(game, seed=seed)
+
+
+def solve_seeds(seeds, config, processes=None, chunksize=4, **solver_kwargs):
+    """
+    Solve a batch of deals across a process pool.
+
+    Args:
+        seeds (iterable): Deal seeds, as used for ``random_seed`` in the config.
+        config (dict): Game configuration (``cards_per_turn``, ``num_t_stacks``...).
+        processes (int, optional): Worker processes. Defaults to the CPU count.
+        chunksize (int): Seeds handed to a worker at a time.
+        **solver_kwargs: Budgets and options passed to :class:`Solver`.
+
+    Yields:
+        SolveResult: One result per seed, in completion order.
+    """
+    worker = partial(_solve_seed, config=config, solver_kwargs=solver_kwargs)
+    with multiprocessing.Pool(processes) as pool:
+        for result in pool.imap_unordered(worker, seeds, chunksize=chunksize):
+            yield result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve a range of Solitaire deals.")
+    parser.add_argument("--config", default="configs/config.yaml")
+    parser.add_argument("--start", type=int, default=1)
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--max-nodes", type=int, default=1_000_000)
+    parser.add_argument("--time-limit", type=float, default=10.0)
+    args = parser.parse_args()
+
+    with open(args.config, "r") as file:
+        config = yaml.safe_load(file)
+    counts = {SOLVED: 0, UNSOLVABLE: 0, UNKNOWN: 0}
+    start = time.time()
+    for result in solve_seeds(
+        range(args.start, args.start + args.count),
+        config,
+        processes=args.processes,
+        max_nodes=args.max_nodes,
+        time_limit=args.time_limit,
+    ):
+        counts[result.status] += 1
+        print(
+            f"Seed {result.seed}: {result.status} ({len(result.moves)} moves, "
+            f"{result.nodes} nodes, {result.elapsed:.2f}s)"
+        )
+    print(f"{counts} in {time.time() - start:.1f}s")
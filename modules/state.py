@@ -0,0 +1,54 @@
+from modules.solitaire import Solitaire
+
+# Card codes are 1-52 (see Card.code): suit = (code - 1) // 13 in Hearts, Diamonds,
+# Clubs, Spades order, rank = (code - 1) % 13 + 1. Index 0 is unused.
+SUIT = [0] + [(code - 1) // 13 for code in range(1, 53)]
+RANK = [0] + [(code - 1) % 13 + 1 for code in range(1, 53)]
+RED = [False] + [(code - 1) // 13 < 2 for code in range(1, 53)]
+# Suit index of the two suits of the other color
+OPPOSITE_SUITS = [(2, 3), (2, 3), (0, 1), (0, 1)]
+SUIT_NAMES = ["Hearts", "Diamonds", "Clubs", "Spades"]
+# Foundation identifier (f1-f4) for each suit index
+FOUNDATION_IDS = [
+    f"f{Solitaire.FOUNDATION_SUITS.index(suit) + 1}" for suit in SUIT_NAMES
+]
+
+
+def state_from_game(game):
+    """
+    Extract a compact, hashable state from a Solitaire game.
+
+    The state is ``(tableau, foundation, stock, pointer, num_next)``:
+
+    - ``tableau``: one ``(num_hidden, cards)`` pair per tableau stack, bottom card first.
+    - ``foundation``: number of cards on the foundation of each suit.
+    - ``stock``: waste + next cards + deck. Dealing and recycling never reorder these
+      cards, so the stock is one fixed sequence with the deal position in ``pointer``
+      (``len(waste) + len(next_cards)``) and ``num_next`` cards showing.
+
+    Args:
+        game (Solitaire): The game to read.
+
+    Returns:
+        tuple: The compact state.
+    """
+    tableau = tuple(
+        (
+            sum(1 for card in stack.cards if not card.visible),
+            tuple(card.code() for card in stack.cards),
+        )
+        for stack in game.t_stack
+    )
+    foundation = tuple(
+        len(game.foundation[suit].cards) for suit in SUIT_NAMES
+    )
+    stock = tuple(
+        card.code()
+        for card in game.waste.cards + game.next_cards.cards + game.deck.cards
+    )
+    pointer = len(game.waste.cards) + len(game.next_cards.cards)
+    return tableau, foundation, stock, pointer, len(game.next_cards.cards)
+
+
+def is_won(state):
+    return sum(state[1]) == 52
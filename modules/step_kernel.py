@@ -0,0 +1,768 @@
+import argparse
+import random
+import time
+
+import numpy as np
+import yaml
+
+try:
+    from numba import njit
+except ImportError:  # The same functions then run as plain Python
+    njit = None
+
+from modules.actions import MAX_CARDS_PER_MOVE, num_actions
+
+NUMBA_AVAILABLE = njit is not None
+
+
+def _jit(function):
+    return njit(cache=True)(function) if NUMBA_AVAILABLE else function
+
+
+# Reward messages of SolitaireEnv.step, as indices into the reward table of the kernel
+VALID_SOURCE_AND_VALID_DESTINATION = 0
+REQUESTED_TOO_MANY_CARDS = 1
+REQUESTED_VALID_NUMBER_OF_CARDS = 2
+CARDS_NOT_MOVABLE = 3
+CARDS_MOVABLE = 4
+VALID_FOUNDATION_TO_TABLEAU_MOVE = 5
+INVALID_FOUNDATION_MOVE_NUMBER = 6
+INVALID_TABLEAU_MOVE_KING = 7
+INVALID_FOUNDATION_MOVE_SUIT = 8
+INVALID_FOUNDATION_MOVE_FOUNDATION = 9
+ACE_TO_FOUNDATION = 10
+SUCCESSFUL_FOUNDATION_MOVE = 11
+INVALID_FOUNDATION_MOVE_ACE = 12
+SUCCESSFUL_TABLEAU_MOVE_KING_TO_EMPTY = 13
+SUCCESSFUL_NEXT_CARDS_TRANSFER_KING = 14
+SUCCESSFUL_MOVE_KING_AROUND = 15
+SUCCESSFUL_TABLEAU_MOVE = 16
+INVALID_TABLEAU_MOVE_NUMBER = 17
+INVALID_TABLEAU_MOVE_COLOR = 18
+INVALID_TABLEAU_MOVE_COLOR_NUMBER = 19
+REVEAL_HIDDEN_CARD = 20
+RECYCLE_WASTE_PILE_AND_USED_CARDS = 21
+RECYCLING_WASTE_PILE = 22
+DEALING_NEXT_CARDS = 23
+NO_CARDS_TO_DEAL = 24
+GAME_COMPLETE = 25
+MESSAGES = [
+    "valid_source_and_valid_destination",
+    "requested_too_many_cards",
+    "requested_valid_number_of_cards",
+    "cards_not_movable",
+    "cards_movable",
+    "valid_foundation_to_tableau_move",
+    "invalid_foundation_move_number",
+    "invalid_tableau_move_king",
+    "invalid_foundation_move_suit",
+    "invalid_foundation_move_foundation",
+    "ace_to_foundation",
+    "successful_foundation_move",
+    "invalid_foundation_move_ace",
+    "successful_tableau_move_king_to_empty",
+    "successful_next_cards_transfer_king",
+    "successful_move_king_around",
+    "successful_tableau_move",
+    "invalid_tableau_move_number",
+    "invalid_tableau_move_color",
+    "invalid_tableau_move_color_number",
+    "reveal_hidden_card",
+    "recycle_waste_pile_and_used_cards",
+    "recycling_waste_pile",
+    "dealing_next_cards",
+    "no_cards_to_deal",
+    "game_complete",
+]
+
+# Columns of the per-game scalar array
+STOCK_LEN = 0  # Cards in waste + next cards + deck, see modules.state
+POINTER = 1  # len(waste) + len(next cards)
+NUM_NEXT = 2
+NUM_WASTE_CARDS = 3  # Waste size at the last recycle (Solitaire.num_waste_cards)
+NUM_HIDDEN = 4
+COMPLETE = 5
+STEPS_SINCE_PROGRESS = 6
+CURRENT_STEP = 7
+MOVE_COUNT = 8
+GAMES_COMPLETED = 9
+NUM_SCALARS = 10
+
+# Deepest tableau stack: 6 face-down cards under a run from king to ace
+MAX_TABLEAU_CARDS = 19
+MAX_STOCK_CARDS = 24
+# Observation layout of SolitaireEnv.get_observation
+OBSERVATION_ROWS = 13
+OBSERVATION_COLUMNS = 24
+# Card codes are 1-52 (Card.code), suit index (code - 1) // 13 in Hearts, Diamonds,
+# Clubs, Spades order. Foundations f1-f4 hold Spades, Hearts, Clubs, Diamonds.
+FOUNDATION_SUIT = (3, 0, 2, 1)
+SUIT_FOUNDATION = (1, 3, 2, 0)
+
+
+class GameArrays(object):
+    def __init__(self, num_games, num_t_stacks=7):
+        """
+        State of a batch of games as NumPy arrays, the input of the step kernel.
+
+        Tableau stacks hold card codes bottom first, with their face-down cards at
+        the bottom. The stock is the fixed waste + next cards + deck sequence of
+        modules.state, with the deal position in the POINTER column.
+
+        Args:
+            num_games (int): Number of games.
+            num_t_stacks (int): Tableau stacks per game.
+        """
+        if num_t_stacks + 6 > OBSERVATION_ROWS:
+            raise ValueError(f"The observation has no room for {num_t_stacks} stacks.")
+        self.num_games = num_games
+        self.num_t_stacks = num_t_stacks
+        self.tableau = np.zeros((num_games, num_t_stacks, MAX_TABLEAU_CARDS), np.int8)
+        self.t_len = np.zeros((num_games, num_t_stacks), np.int64)
+        self.t_hidden = np.zeros((num_games, num_t_stacks), np.int64)
+        self.foundation = np.zeros((num_games, 4), np.int64)  # Cards on f1-f4
+        self.stock = np.zeros((num_games, MAX_STOCK_CARDS), np.int8)
+        self.scalars = np.zeros((num_games, NUM_SCALARS), np.int64)
+
+    def load_state(self, index, state, num_waste_cards=0):
+        """
+        Set a game from a modules.state tuple, keeping its env counters except the
+        per-episode ones.
+        """
+        tableau, foundation, stock, pointer, num_next = state
+        self.tableau[index] = 0
+        for stack_idx, (num_hidden, cards) in enumerate(tableau):
+            self.tableau[index, stack_idx, : len(cards)] = cards
+            self.t_len[index, stack_idx] = len(cards)
+            self.t_hidden[index, stack_idx] = num_hidden
+        # modules.state counts foundations in suit order
+        for suit, count in enumerate(foundation):
+            self.foundation[index, SUIT_FOUNDATION[suit]] = count
+        self.stock[index] = 0
+        self.stock[index, : len(stock)] = stock
+        scalars = self.scalars[index]
+        scalars[STOCK_LEN] = len(stock)
+        scalars[POINTER] = pointer
+        scalars[NUM_NEXT] = num_next
+        scalars[NUM_WASTE_CARDS] = num_waste_cards
+        scalars[NUM_HIDDEN] = sum(num_hidden for num_hidden, _ in tableau)
+        scalars[COMPLETE] = sum(foundation) == 52
+        scalars[STEPS_SINCE_PROGRESS] = 0
+        scalars[CURRENT_STEP] = 0
+        scalars[MOVE_COUNT] = 0
+
+    def load_game(self, index, game):
+        """Set a game from a Solitaire game."""
+        from modules.state import state_from_game
+
+        self.load_state(index, state_from_game(game), game.num_waste_cards)
+
+    def state(self, index):
+        """The modules.state tuple of a game, to compare with state_from_game."""
+        tableau = tuple(
+            (
+                int(self.t_hidden[index, stack_idx]),
+                tuple(int(code) for code in self.tableau[index, stack_idx, : self.t_len[index, stack_idx]]),
+            )
+            for stack_idx in range(self.num_t_stacks)
+        )
+        foundation = tuple(int(self.foundation[index, SUIT_FOUNDATION[suit]]) for suit in range(4))
+        scalars = self.scalars[index]
+        stock = tuple(int(code) for code in self.stock[index, : scalars[STOCK_LEN]])
+        return tableau, foundation, stock, int(scalars[POINTER]), int(scalars[NUM_NEXT])
+
+
+def deal_state(seed, num_t_stacks=7, cards_per_turn=3):
+    """
+    The modules.state tuple of the deal of a seed, without building the game: the
+    same shuffle and dealing order as Deck and Solitaire.deal_cards.
+    """
+    codes = [
+        offset + number
+        for offset in (39, 0, 13, 26)  # Spades, Hearts, Diamonds, Clubs, as in Deck
+        for number in range(1, 14)
+    ]
+    random.Random(int(seed)).shuffle(codes)
+    tableau = []
+    for index in range(num_t_stacks):
+        cards = tuple(codes.pop() for _ in range(index + 1))
+        tableau.append((index, cards))
+    num_next = min(cards_per_turn, len(codes))
+    next_cards = [codes.pop() for _ in range(num_next)]
+    return tuple(tableau), (0, 0, 0, 0), tuple(next_cards + codes), num_next, num_next
+
+
+def reward_table(reward_dict):
+    """Points of each kernel message, from the reward table of the config."""
+    return np.array([reward_dict[message][0] for message in MESSAGES], dtype=np.float64)
+
+
+@_jit
+def _is_red(code):
+    return (code - 1) // 13 < 2
+
+
+@_jit
+def _rank(code):
+    return (code - 1) % 13 + 1
+
+
+@_jit
+def _deal(g, stock, scalars, table, cards_per_turn):
+    """Solitaire.deal_next_cards."""
+    reward = 0.0
+    # The next cards join the waste, which keeps the pointer in place
+    scalars[g, NUM_NEXT] = 0
+    pointer = scalars[g, POINTER]
+    stock_len = scalars[g, STOCK_LEN]
+    if pointer == stock_len and pointer > 0:
+        if pointer < scalars[g, NUM_WASTE_CARDS]:
+            reward += table[RECYCLE_WASTE_PILE_AND_USED_CARDS]
+        else:
+            reward += table[RECYCLING_WASTE_PILE]
+        scalars[g, NUM_WASTE_CARDS] = pointer
+        pointer = 0
+    num_cards = min(stock_len - pointer, cards_per_turn)
+    if num_cards > 0:
+        scalars[g, POINTER] = pointer + num_cards
+        scalars[g, NUM_NEXT] = num_cards
+        reward += table[DEALING_NEXT_CARDS]
+    else:
+        scalars[g, POINTER] = pointer
+        reward += table[NO_CARDS_TO_DEAL]
+    return reward
+
+
+@_jit
+def _move(g, source, dest, num_cards, reward, tableau, t_len, t_hidden, foundation, stock, scalars, table):
+    """
+    Solitaire.move_card with the validation order and messages of validate_move.
+
+    Returns:
+        tuple: (whether the move was made, reward with the move's messages added).
+    """
+    num_t = t_len.shape[1]
+    source_tableau = source < num_t
+    source_foundation = num_t <= source < num_t + 4
+    source_next = source == num_t + 4
+    dest_tableau = dest < num_t
+
+    if source_tableau:
+        length = t_len[g, source]
+    elif source_foundation:
+        length = foundation[g, source - num_t]
+    else:
+        length = scalars[g, NUM_NEXT]
+    if length < num_cards:
+        return False, reward + table[REQUESTED_TOO_MANY_CARDS]
+    reward += table[REQUESTED_VALID_NUMBER_OF_CARDS]
+
+    if source_next and num_cards > 1:
+        movable = False
+    elif source_tableau:
+        movable = num_cards <= t_len[g, source] - t_hidden[g, source]
+    else:
+        movable = True
+    if not movable:
+        return False, reward + table[CARDS_NOT_MOVABLE]
+    reward += table[CARDS_MOVABLE]
+
+    # Deepest card moved
+    if source_tableau:
+        card = tableau[g, source, length - num_cards]
+    elif source_foundation:
+        card = FOUNDATION_SUIT[source - num_t] * 13 + length - num_cards + 1
+    else:
+        card = stock[g, scalars[g, POINTER] - num_cards]
+
+    valid = False
+    if source_foundation and dest_tableau:
+        if num_cards > 1:
+            message = INVALID_FOUNDATION_MOVE_NUMBER
+        elif t_len[g, dest] == 0:
+            if _rank(card) == 13:
+                valid = True
+                message = VALID_FOUNDATION_TO_TABLEAU_MOVE
+            else:
+                message = INVALID_TABLEAU_MOVE_KING
+        else:
+            top = tableau[g, dest, t_len[g, dest] - 1]
+            if _is_red(card) == _is_red(top):
+                message = INVALID_FOUNDATION_MOVE_SUIT
+            elif _rank(card) != _rank(top) - 1:
+                message = INVALID_FOUNDATION_MOVE_NUMBER
+            else:
+                valid = True
+                message = VALID_FOUNDATION_TO_TABLEAU_MOVE
+    elif not dest_tableau:
+        dest_foundation = dest - num_t
+        if num_cards > 1:
+            message = INVALID_FOUNDATION_MOVE_NUMBER
+        elif source_foundation:
+            message = INVALID_FOUNDATION_MOVE_FOUNDATION
+        elif (card - 1) // 13 != FOUNDATION_SUIT[dest_foundation]:
+            message = INVALID_FOUNDATION_MOVE_SUIT
+        elif _rank(card) == 1:
+            valid = True
+            message = ACE_TO_FOUNDATION
+        elif foundation[g, dest_foundation] > 0:
+            if _rank(card) == foundation[g, dest_foundation] + 1:
+                valid = True
+                message = SUCCESSFUL_FOUNDATION_MOVE
+            else:
+                message = INVALID_FOUNDATION_MOVE_NUMBER
+        else:
+            message = INVALID_FOUNDATION_MOVE_ACE
+    elif t_len[g, dest] == 0:
+        if _rank(card) == 13:
+            valid = True
+            if length != num_cards:
+                message = SUCCESSFUL_TABLEAU_MOVE_KING_TO_EMPTY
+            elif source_next:
+                message = SUCCESSFUL_NEXT_CARDS_TRANSFER_KING
+            else:
+                message = SUCCESSFUL_MOVE_KING_AROUND
+        else:
+            message = INVALID_TABLEAU_MOVE_KING
+    else:
+        top = tableau[g, dest, t_len[g, dest] - 1]
+        correct_color = _is_red(top) != _is_red(card)
+        correct_number = _rank(top) == _rank(card) + 1
+        if correct_color and correct_number:
+            valid = True
+            message = SUCCESSFUL_TABLEAU_MOVE
+        elif correct_color:
+            message = INVALID_TABLEAU_MOVE_NUMBER
+        elif correct_number:
+            message = INVALID_TABLEAU_MOVE_COLOR
+        else:
+            message = INVALID_TABLEAU_MOVE_COLOR_NUMBER
+    reward += table[message]
+    if not valid:
+        return False, reward
+
+    # Apply the move
+    if dest_tableau:
+        for offset in range(num_cards):
+            if source_tableau:
+                code = tableau[g, source, length - num_cards + offset]
+            else:
+                code = card
+            tableau[g, dest, t_len[g, dest]] = code
+            t_len[g, dest] += 1
+    else:
+        foundation[g, dest - num_t] += 1
+    if source_tableau:
+        t_len[g, source] -= num_cards
+        # Turn over the card under the moved ones
+        if t_len[g, source] > 0 and t_hidden[g, source] == t_len[g, source]:
+            t_hidden[g, source] -= 1
+            scalars[g, NUM_HIDDEN] -= 1
+            reward += table[REVEAL_HIDDEN_CARD]
+    elif source_foundation:
+        foundation[g, source - num_t] -= 1
+    else:
+        # Playing the top next card shifts the rest of the stock down
+        pointer = scalars[g, POINTER]
+        for i in range(pointer - 1, scalars[g, STOCK_LEN] - 1):
+            stock[g, i] = stock[g, i + 1]
+        scalars[g, STOCK_LEN] -= 1
+        scalars[g, POINTER] = pointer - 1
+        scalars[g, NUM_NEXT] -= 1
+    if not dest_tableau:
+        scalars[g, COMPLETE] = foundation[g].sum() == 52
+    return True, reward
+
+
+@_jit
+def _auto_complete(g, reward, t_len, t_hidden, foundation, scalars, table):
+    """Solitaire.auto_complete: every card not on a foundation, lowest rank first."""
+    for rank in range(1, 14):
+        for f in range(4):
+            if foundation[g, f] < rank:
+                if rank == 1:
+                    reward += table[ACE_TO_FOUNDATION]
+                else:
+                    reward += table[SUCCESSFUL_FOUNDATION_MOVE]
+    foundation[g, :] = 13
+    t_len[g, :] = 0
+    t_hidden[g, :] = 0
+    scalars[g, STOCK_LEN] = 0
+    scalars[g, POINTER] = 0
+    scalars[g, NUM_NEXT] = 0
+    scalars[g, COMPLETE] = 1
+    return reward
+
+
+@_jit
+def _observe(g, tableau, t_len, t_hidden, foundation, stock, scalars, observations):
+    """SolitaireEnv.get_observation."""
+    num_t = t_len.shape[1]
+    obs = observations[g]
+    obs[:] = 0
+    for stack in range(num_t):
+        for depth in range(min(t_len[g, stack], OBSERVATION_COLUMNS)):
+            if depth < t_hidden[g, stack]:
+                obs[stack * OBSERVATION_COLUMNS + depth] = -1
+            else:
+                obs[stack * OBSERVATION_COLUMNS + depth] = tableau[g, stack, depth]
+    for f in range(4):
+        row = (num_t + f) * OBSERVATION_COLUMNS
+        for depth in range(foundation[g, f]):
+            obs[row + depth] = FOUNDATION_SUIT[f] * 13 + depth + 1
+    num_waste = scalars[g, POINTER] - scalars[g, NUM_NEXT]
+    row = (num_t + 4) * OBSERVATION_COLUMNS
+    for depth in range(min(num_waste, OBSERVATION_COLUMNS)):
+        obs[row + depth] = stock[g, depth]
+    row = (num_t + 5) * OBSERVATION_COLUMNS
+    for depth in range(scalars[g, NUM_NEXT]):
+        obs[row + depth] = stock[g, num_waste + depth]
+
+
+@_jit
+def _step_game(
+    g,
+    action,
+    tableau,
+    t_len,
+    t_hidden,
+    foundation,
+    stock,
+    scalars,
+    table,
+    cards_per_turn,
+    auto_complete,
+    stagnation_threshold,
+    max_steps,
+    observations,
+):
+    num_t = t_len.shape[1]
+    num_destinations = num_t + 4
+    reward = 0.0
+    deal = action == (num_t + 5) * num_destinations * MAX_CARDS_PER_MOVE
+    if deal:
+        moved = False
+        reward = _deal(g, stock, scalars, table, cards_per_turn)
+        scalars[g, STEPS_SINCE_PROGRESS] += 1
+    else:
+        source = action // (num_destinations * MAX_CARDS_PER_MOVE)
+        rest = action % (num_destinations * MAX_CARDS_PER_MOVE)
+        dest = rest // MAX_CARDS_PER_MOVE
+        num_cards = rest % MAX_CARDS_PER_MOVE + 1
+        reward = table[VALID_SOURCE_AND_VALID_DESTINATION]
+        moved, reward = _move(
+            g, source, dest, num_cards, reward, tableau, t_len, t_hidden, foundation, stock, scalars, table
+        )
+    if (
+        auto_complete
+        and not scalars[g, COMPLETE]
+        and scalars[g, NUM_HIDDEN] == 0
+        and (cards_per_turn == 1 or scalars[g, STOCK_LEN] == 0)
+    ):
+        reward = _auto_complete(g, reward, t_len, t_hidden, foundation, scalars, table)
+        moved = True
+
+    if moved:
+        scalars[g, MOVE_COUNT] += 1
+    if moved and reward > 10:
+        scalars[g, STEPS_SINCE_PROGRESS] = 0
+    else:
+        scalars[g, STEPS_SINCE_PROGRESS] += 1
+    terminated = scalars[g, STEPS_SINCE_PROGRESS] >= stagnation_threshold
+    truncated = scalars[g, CURRENT_STEP] >= max_steps
+    _observe(g, tableau, t_len, t_hidden, foundation, stock, scalars, observations)
+    scalars[g, CURRENT_STEP] += 1
+    if scalars[g, COMPLETE]:
+        scalars[g, GAMES_COMPLETED] += 1
+        reward += table[GAME_COMPLETE]
+        terminated = True
+    if reward > 0:
+        reward *= 1 + foundation[g].sum() / 52
+    return reward, terminated, truncated
+
+
+@_jit
+def step_batch(
+    actions,
+    tableau,
+    t_len,
+    t_hidden,
+    foundation,
+    stock,
+    scalars,
+    table,
+    cards_per_turn,
+    auto_complete,
+    stagnation_threshold,
+    max_steps,
+    observations,
+    rewards,
+    terminated,
+    truncated,
+):
+    """
+    SolitaireEnv.step for every game of a batch, in one compiled loop. Results are
+    written to ``observations`` (int8, one flat observation per game), ``rewards``,
+    ``terminated`` and ``truncated``.
+    """
+    for g in range(actions.shape[0]):
+        rewards[g], terminated[g], truncated[g] = _step_game(
+            g,
+            actions[g],
+            tableau,
+            t_len,
+            t_hidden,
+            foundation,
+            stock,
+            scalars,
+            table,
+            cards_per_turn,
+            auto_complete,
+            stagnation_threshold,
+            max_steps,
+            observations,
+        )
+
+
+@_jit
+def observe_batch(indices, tableau, t_len, t_hidden, foundation, stock, scalars, observations):
+    """Write the observations of the games in ``indices``, e.g. after a reset."""
+    for g in indices:
+        _observe(g, tableau, t_len, t_hidden, foundation, stock, scalars, observations)
+
+
+# Env settings the kernel implements; the others need SolitaireEnv
+UNSUPPORTED_ENV_OPTIONS = [
+    "macro_actions",
+    "dead_end_detection",
+    "cycle_detection",
+    "deal_index",
+]
+
+
+def unsupported_options(config):
+    """Settings of a config that the kernel does not implement."""
+    env_config = config.get("env", {})
+    options = [key for key in UNSUPPORTED_ENV_OPTIONS if env_config.get(key)]
+    if config.get("check_available_moves", False):
+        options.append("check_available_moves")
+    return options
+
+
+class StepKernel(object):
+    def __init__(self, config, num_games, jit=True):
+        """
+        SolitaireEnv.step on NumPy state arrays, for a batch of games.
+
+        Rewards, observations and episode ends are identical to SolitaireEnv's (see
+        :func:`differential_check`), for configs without the options in
+        :data:`UNSUPPORTED_ENV_OPTIONS`. Logging, printing and undo history are left
+        out.
+
+        Args:
+            config (dict): The training config.
+            num_games (int): Batch size.
+            jit (bool): Use the Numba-compiled kernel when Numba is installed,
+                otherwise the same code runs as plain Python.
+        """
+        unsupported = unsupported_options(config)
+        if unsupported:
+            raise ValueError(f"The step kernel does not support: {', '.join(unsupported)}")
+        env_config = config.get("env", {})
+        self.num_t_stacks = config.get("num_t_stacks", 7)
+        self.cards_per_turn = config.get("cards_per_turn", 3)
+        self.auto_complete = bool(env_config.get("auto_complete", False))
+        self.stagnation_threshold = env_config.get("stagnation_threshold", 1000)
+        self.max_steps = env_config.get("max_steps_per_game", 100000)
+        reward_dict = config.get("reward_dict")
+        if reward_dict is None:
+            with open("configs/rewards.yaml", "r") as file:
+                reward_dict = yaml.safe_load(file)
+        self.table = reward_table(reward_dict)
+        self.num_actions = num_actions(self.num_t_stacks)
+
+        self.games = GameArrays(num_games, self.num_t_stacks)
+        self.observations = np.zeros(
+            (num_games, OBSERVATION_ROWS * OBSERVATION_COLUMNS), dtype=np.int8
+        )
+        self.rewards = np.zeros(num_games, dtype=np.float64)
+        self.terminated = np.zeros(num_games, dtype=bool)
+        self.truncated = np.zeros(num_games, dtype=bool)
+        compiled = jit and NUMBA_AVAILABLE
+        self.step_batch = step_batch if compiled or not NUMBA_AVAILABLE else step_batch.py_func
+        self.observe_batch = (
+            observe_batch if compiled or not NUMBA_AVAILABLE else observe_batch.py_func
+        )
+
+    def reset(self, index, seed):
+        """Deal a new game into slot ``index`` and write its observation."""
+        self.games.load_state(index, deal_state(seed, self.num_t_stacks, self.cards_per_turn))
+        self.observe(np.array([index]))
+
+    def observe(self, indices):
+        games = self.games
+        self.observe_batch(
+            np.asarray(indices, dtype=np.int64),
+            games.tableau,
+            games.t_len,
+            games.t_hidden,
+            games.foundation,
+            games.stock,
+            games.scalars,
+            self.observations,
+        )
+
+    def step(self, actions):
+        """
+        Step every game. The returned arrays are reused by the next call.
+
+        Returns:
+            tuple: (observations, rewards, terminated, truncated).
+        """
+        games = self.games
+        self.step_batch(
+            np.asarray(actions, dtype=np.int64),
+            games.tableau,
+            games.t_len,
+            games.t_hidden,
+            games.foundation,
+            games.stock,
+            games.scalars,
+            self.table,
+            self.cards_per_turn,
+            self.auto_complete,
+            self.stagnation_threshold,
+            self.max_steps,
+            self.observations,
+            self.rewards,
+            self.terminated,
+            self.truncated,
+        )
+        return self.observations, self.rewards, self.terminated, self.truncated
+
+
+def differential_check(config, num_games=20, max_steps=2000, seed=0, jit=True):
+    """
+    Play random actions (biased towards legal ones) on SolitaireEnv and the kernel
+    side by side and compare observations, rewards, episode ends and full game
+    states after every step.
+
+    Returns:
+        int: Steps compared.
+
+    Raises:
+        AssertionError: At the first difference.
+    """
+    import contextlib
+    import os
+
+    from modules.actions import action_mask
+    from modules.solitaire_env import SolitaireEnv
+    from modules.state import state_from_game
+
+    config = dict(config, show_messages=False, keep_history=False)
+    config["env"] = dict(config["env"], record_games=False, save_every=2**62)
+    rng = np.random.default_rng(seed)
+    kernel = StepKernel(config, 1, jit=jit)
+    steps = 0
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        env = SolitaireEnv(config=config, instance="kernel_check")
+        for game in range(num_games):
+            deal_seed = seed * num_games + game
+            env.reset(options={"deal_seed": deal_seed})
+            kernel.reset(0, deal_seed)
+            assert kernel.games.state(0) == state_from_game(env.game), f"Deal {deal_seed} differs"
+            for step in range(max_steps):
+                if rng.random() < 0.5:
+                    action = int(rng.choice(np.flatnonzero(action_mask(env.game))))
+                else:
+                    action = int(rng.integers(kernel.num_actions))
+                obs, reward, terminated, truncated, _ = env.step(action)
+                env.action_log = []
+                k_obs, k_rewards, k_terminated, k_truncated = kernel.step([action])
+                where = f"deal {deal_seed}, step {step}, action {action}"
+                assert np.array_equal(obs, k_obs[0]), f"Observation differs at {where}"
+                assert np.float64(reward) == k_rewards[0], (
+                    f"Reward differs at {where}: {reward} vs {k_rewards[0]}"
+                )
+                assert (terminated, truncated) == (k_terminated[0], k_truncated[0]), (
+                    f"Episode end differs at {where}"
+                )
+                assert kernel.games.state(0) == state_from_game(env.game), (
+                    f"State differs at {where}"
+                )
+                steps += 1
+                if terminated or truncated:
+                    break
+    return steps
+
+
+def benchmark(config, num_games=64, steps=2000, seed=0):
+    """
+    Random-action steps per second of SolitaireEnv, of the kernel one game at a time
+    and of the batched kernel.
+
+    Returns:
+        dict: Steps per second by variant.
+    """
+    import contextlib
+    import os
+
+    from modules.solitaire_env import SolitaireEnv
+
+    config = dict(config, show_messages=False)
+    config["env"] = dict(config["env"], record_games=False, save_every=2**62)
+    rng = np.random.default_rng(seed)
+    results = {}
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        env = SolitaireEnv(config=config, instance="kernel_benchmark")
+        env.reset(options={"deal_seed": seed})
+        actions = rng.integers(env.action_space.n, size=steps)
+        start = time.perf_counter()
+        for action in actions:
+            _, _, terminated, truncated, _ = env.step(int(action))
+            env.action_log = []
+            if terminated or truncated:
+                env.reset(options={"deal_seed": seed})
+        results["SolitaireEnv"] = steps / (time.perf_counter() - start)
+
+    for name, batch in [("kernel", 1), ("kernel batch", num_games)]:
+        kernel = StepKernel(config, batch)
+        for index in range(batch):
+            kernel.reset(index, seed + index)
+        kernel.step(np.full(batch, kernel.num_actions - 1))  # Compile before timing
+        actions = rng.integers(kernel.num_actions, size=(steps, batch))
+        start = time.perf_counter()
+        for row in actions:
+            _, _, terminated, truncated = kernel.step(row)
+            for index in np.flatnonzero(terminated | truncated):
+                kernel.reset(index, seed + index)
+        results[name] = steps * batch / (time.perf_counter() - start)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Array step kernel of SolitaireEnv.")
+    parser.add_argument("command", choices=["check", "benchmark"])
+    parser.add_argument("--config", default="configs/config.yaml")
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-jit", action="store_true", help="Check the Python fallback.")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as file:
+        config = yaml.safe_load(file)
+    # Turn off what the kernel does not implement
+    config["env"].update({key: False for key in UNSUPPORTED_ENV_OPTIONS})
+    config["check_available_moves"] = False
+    print(f"Numba {'available' if NUMBA_AVAILABLE else 'not installed, using plain Python'}")
+    if args.command == "check":
+        steps = differential_check(
+            config, args.games, args.steps, args.seed, jit=not args.no_jit
+        )
+        print(f"Kernel matches SolitaireEnv on {steps} steps of {args.games} games")
+    else:
+        for name, rate in benchmark(config, args.games, args.steps, args.seed).items():
+            print(f"{name:<14} {rate:10.0f} steps/s")
@@ -0,0 +1,84 @@
+from modules.card import Card
+
+_BLACK_SUITS = [suit for suit in Card.SUIT_OFFSETS if suit not in Card.RED_SUITS]
+# Codes of the cards that can be placed on a card, by the code of that card
+PLAYABLE_ONTO = [()] + [
+    tuple(
+        Card.SUIT_OFFSETS[suit] + (code - 1) % 13
+        for suit in (_BLACK_SUITS if (code - 1) // 13 < 2 else Card.RED_SUITS)
+    )
+    if (code - 1) % 13
+    else ()
+    for code in range(1, 53)
+]
+KING_CODES = tuple(offset + 13 for offset in Card.SUIT_OFFSETS.values())
+
+
+class StockIndex(object):
+    """
+    Index of the stock cards that can reach the top of the next cards by dealing.
+
+    Dealing and recycling never reorder waste + next cards + deck. With
+    ``cards_per_turn`` k and the next cards ending at position p of that sequence,
+    the cards that can show are p - 1 (the current top), every k-th card after it,
+    the last card, and every k-th card from the start after a recycle.
+    """
+
+    def __init__(self, cards_per_turn=3):
+        self.cards_per_turn = cards_per_turn
+        self.reachable = {}  # Card code -> Card
+
+    def rebuild(self, waste, next_cards, deck):
+        """
+        Recompute the index from the stock stacks.
+        """
+        stock = waste.cards + next_cards.cards + deck.cards
+        self.reachable = {}
+        if not stock:
+            return
+        k = self.cards_per_turn
+        pointer = len(waste.cards) + len(next_cards.cards)
+        positions = set(range(pointer + k - 1, len(stock), k))
+        positions.update(range(k - 1, len(stock), k))
+        positions.add(len(stock) - 1)
+        if next_cards.cards:
+            positions.add(pointer - 1)
+        for position in sorted(positions):
+            self.reachable[stock[position].code()] = stock[position]
+
+    def deal(self, previous_top, previous_pointer, stock_size):
+        """
+        Update the index after a deal that did not recycle the waste pile.
+
+        The cards showing next are already indexed, so the only change is that the
+        previous top card can only come back after a recycle.
+
+        Args:
+            previous_top (Card): Top next card before the deal, or None.
+            previous_pointer (int): Waste + next cards count before the deal.
+            stock_size (int): Number of cards in waste + next cards + deck.
+        """
+        if previous_top is None:
+            return
+        position = previous_pointer - 1
+        if (position + 1) % self.cards_per_turn and position != stock_size - 1:
+            self.reachable.pop(previous_top.code(), None)
+
+    def is_reachable(self, card):
+        return card.code() in self.reachable
+
+    def playable_onto(self, top_card):
+        """
+        Reachable stock cards that can be placed on a tableau stack.
+
+        Args:
+            top_card (Card): Top card of the tableau stack, or None if it is empty.
+
+        Returns:
+            list: The matching reachable cards.
+        """
+        codes = KING_CODES if top_card is None else PLAYABLE_ONTO[top_card.code()]
+        return [self.reachable[code] for code in codes if code in self.reachable]
+
+    def cards(self):
+        return list(self.reachable.values())
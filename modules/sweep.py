@@ -0,0 +1,410 @@
+import argparse
+import copy
+import itertools
+import math
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+import yaml
+
+from modules.placement import THREAD_VARIABLES
+
+# Sampling distributions of random search parameters
+DISTRIBUTIONS = {
+    "uniform": lambda rng, low, high: float(rng.uniform(low, high)),
+    "log_uniform": lambda rng, low, high: float(
+        math.exp(rng.uniform(math.log(low), math.log(high)))
+    ),
+    "int_uniform": lambda rng, low, high: int(rng.integers(low, high + 1)),
+}
+# Replay buffer a trial keeps in memmap files between rungs, for each configured buffer
+MEMMAP_BUFFER_CLASSES = {
+    None: "MemmapReplayBuffer",
+    "ReplayBuffer": "MemmapReplayBuffer",
+    "MemmapReplayBuffer": "MemmapReplayBuffer",
+    "PrioritizedReplayBuffer": "PrioritizedMemmapReplayBuffer",
+    "PrioritizedMemmapReplayBuffer": "PrioritizedMemmapReplayBuffer",
+}
+
+
+def set_value(config, key, value):
+    """
+    Set a dotted key of a config, e.g. ``dqn.model.learning_rate``. Keys starting
+    with ``rewards.`` set the points of a reward message.
+    """
+    if key.startswith("rewards."):
+        message = key[len("rewards."):]
+        if message not in config["reward_dict"]:
+            raise KeyError(f"Unknown reward message: {message}")
+        config["reward_dict"][message] = [value, config["reward_dict"][message][1]]
+        return
+    *parents, name = key.split(".")
+    for parent in parents:
+        config = config.setdefault(parent, {})
+    config[name] = value
+
+
+def expand_spec(spec):
+    """
+    Expand the parameters of a sweep spec into one dict of overrides per trial.
+
+    ``method: grid`` takes every combination of the listed values. ``method: random``
+    draws ``num_samples`` trials, picking from lists or sampling from a
+    ``{distribution, low, high}`` mapping (see :data:`DISTRIBUTIONS`).
+    """
+    parameters = spec["parameters"]
+    if spec.get("method", "grid") == "grid":
+        for key, values in parameters.items():
+            if not isinstance(values, list):
+                raise ValueError(f"Grid search needs a list of values for {key}")
+        keys = list(parameters)
+        return [
+            dict(zip(keys, values))
+            for values in itertools.product(*(parameters[key] for key in keys))
+        ]
+
+    rng = np.random.default_rng(spec.get("seed", 0))
+    trials = []
+    for _ in range(spec["num_samples"]):
+        overrides = {}
+        for key, values in parameters.items():
+            if isinstance(values, list):
+                overrides[key] = values[rng.integers(len(values))]
+            else:
+                sample = DISTRIBUTIONS[values["distribution"]]
+                overrides[key] = sample(rng, values["low"], values["high"])
+        trials.append(overrides)
+    return trials
+
+
+def trial_config(base_config, overrides, trial_dir):
+    """Config of one trial, writing all of its output under ``trial_dir``."""
+    config = copy.deepcopy(base_config)
+    if "reward_dict" not in config:
+        with open(config.get("rewards_path", "configs/rewards.yaml"), "r") as file:
+            config["reward_dict"] = yaml.safe_load(file)
+    for key, value in overrides.items():
+        set_value(config, key, value)
+    config.update(
+        log_path=os.path.join(trial_dir, "logs"),
+        tb_log_path=os.path.join(trial_dir, "tb_logs"),
+        monitor_path=os.path.join(trial_dir, "monitor"),
+        checkpoint_path=os.path.join(trial_dir, "checkpoints"),
+        clear_logs=False,
+    )
+    return config
+
+
+def cpu_slots(threads_per_run, max_parallel=None):
+    """Split the CPUs this process may use into disjoint sets, one per concurrent run."""
+    cpus = sorted(os.sched_getaffinity(0))
+    threads_per_run = min(threads_per_run, len(cpus))
+    slots = [
+        cpus[i : i + threads_per_run]
+        for i in range(0, len(cpus) - threads_per_run + 1, threads_per_run)
+    ]
+    return slots[:max_parallel] if max_parallel else slots
+
+
+def rung_timesteps(rung, min_timesteps, eta):
+    """Total env steps a trial has trained for once it finishes ``rung``."""
+    return int(min_timesteps * eta**rung)
+
+
+def score(result):
+    """Ranking key of an evaluation result: win rate, then mean foundation cards."""
+    return (result["win_rate"], result["mean_foundation"])
+
+
+def run_trial(trial_dir, rung, timesteps, threads, evaluation):
+    """
+    Train a trial up to ``timesteps`` env steps, resuming its saved model and replay
+    buffer, then evaluate it and write ``rung_<rung>.yaml`` in its directory.
+
+    The replay buffer lives in memmap files in the trial directory (the memmap
+    variant of the configured buffer class), which the next rung reopens, instead
+    of a pickle of the whole buffer written after every rung.
+    """
+    import torch
+
+    from dqn import create_vector_env, load_model, train_dqn_agent
+    from modules.evaluation import evaluate
+
+    torch.set_num_threads(threads)
+    with open(os.path.join(trial_dir, "config.yaml"), "r") as file:
+        config = yaml.safe_load(file)
+    os.makedirs(config["log_path"], exist_ok=True)
+    # The scheduler already pinned this process to the trial's CPUs
+    config["resources"] = dict(
+        config.get("resources") or {},
+        auto=False,
+        learner_cpus=None,
+        env_cpus=None,
+        learner_threads=threads,
+    )
+    model_config = config["dqn"]["model"]
+    model_config["replay_buffer_class"] = MEMMAP_BUFFER_CLASSES[
+        model_config.get("replay_buffer_class")
+    ]
+    model_config["replay_buffer_kwargs"] = dict(
+        model_config.get("replay_buffer_kwargs") or {},
+        path=os.path.join(trial_dir, "replay_buffer"),
+        mode="r+",
+    )
+    num_envs = config["env"].get("num", 1)
+    # total_timesteps counts steps per env in dqn.py
+    config["dqn"]["train"]["total_timesteps"] = max(1, timesteps // num_envs)
+
+    model_path = os.path.join(trial_dir, "model.zip")
+    vec_env = create_vector_env(config, num_envs=num_envs)
+    model = None
+    if os.path.exists(model_path):
+        # Reopens the memmap buffer, where the last rung left it
+        model = load_model(model_path, vec_env, config)
+    model = train_dqn_agent(vec_env, config, model=model)
+    model.save(model_path)
+    model.replay_buffer.flush()
+    vec_env.close()
+
+    report = evaluate(model_path, config, processes=threads, **evaluation)
+    print(report.summary())
+    result = {
+        "rung": rung,
+        "timesteps": int(model.num_timesteps),
+        "games": report.games,
+        "win_rate": float(report.win_rate),
+        "mean_foundation": float(np.mean([r.foundation for r in report.results])),
+    }
+    with open(os.path.join(trial_dir, f"rung_{rung}.yaml"), "w") as file:
+        yaml.safe_dump(result, file)
+    return result
+
+
+class Trial(object):
+    def __init__(self, trial_id, overrides, trial_dir):
+        self.trial_id = trial_id
+        self.overrides = overrides
+        self.trial_dir = trial_dir
+        self.results = {}  # Rung to evaluation result
+        self.next_rung = 0
+        self.stopped = False
+        self.failed = False
+
+    @property
+    def best_rung(self):
+        return max(self.results) if self.results else -1
+
+
+class Sweep(object):
+    def __init__(self, spec, base_config):
+        """
+        Hyperparameter sweep of dqn.py trainings with successive halving.
+
+        Every trial trains for ``min_timesteps`` env steps and is evaluated on the
+        fixed evaluation deals. The best ``1 / eta`` of the trials of a rung train on
+        to ``eta`` times the steps of that rung, the others are stopped. Promotions
+        happen as soon as enough results of a rung are in (asynchronous successive
+        halving), so free CPU slots never wait for the slowest trial of a rung.
+
+        Runs are separate processes, each pinned to its own set of
+        ``threads_per_run`` CPUs with torch and BLAS limited to that many threads.
+
+        Args:
+            spec (dict): The sweep spec, see ``configs/sweep.yaml``.
+            base_config (dict): The training config the overrides apply to.
+        """
+        self.spec = spec
+        self.output_dir = spec["output_dir"]
+        halving = spec.get("successive_halving", {})
+        self.min_timesteps = halving.get("min_timesteps", 1_000_000)
+        self.eta = halving.get("eta", 3)
+        self.num_rungs = halving.get("rungs", 3)
+        self.evaluation = spec.get("evaluation", {})
+        self.threads_per_run = spec.get("threads_per_run", 1)
+        self.slots = cpu_slots(self.threads_per_run, spec.get("max_parallel"))
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.trials = []
+        for trial_id, overrides in enumerate(expand_spec(spec)):
+            trial_dir = os.path.join(self.output_dir, f"trial_{trial_id:03d}")
+            os.makedirs(trial_dir, exist_ok=True)
+            config = trial_config(base_config, overrides, trial_dir)
+            with open(os.path.join(trial_dir, "config.yaml"), "w") as file:
+                yaml.safe_dump(config, file)
+            with open(os.path.join(trial_dir, "overrides.yaml"), "w") as file:
+                yaml.safe_dump(overrides, file)
+            self.trials.append(Trial(trial_id, overrides, trial_dir))
+
+    def promotable(self, rung):
+        """Trials finished at ``rung`` that rank in its top ``1 / eta`` and may go on."""
+        finished = [t for t in self.trials if rung in t.results]
+        ranked = sorted(finished, key=lambda t: score(t.results[rung]), reverse=True)
+        top = ranked[: len(finished) // self.eta]
+        return [t for t in top if t.next_rung == rung + 1 and not t.stopped]
+
+    def next_job(self, running):
+        """The trial to start next and its rung: promotions first, highest rung first."""
+        self.stop_losers(running)
+        for rung in reversed(range(self.num_rungs - 1)):
+            for trial in self.promotable(rung):
+                if trial not in running:
+                    return trial, rung + 1
+        for trial in self.trials:
+            if trial.next_rung == 0 and not trial.failed and trial not in running:
+                return trial, 0
+        return None
+
+    def start(self, trial, rung, slot):
+        env = dict(os.environ, **{name: str(len(slot)) for name in THREAD_VARIABLES})
+        log = open(os.path.join(trial.trial_dir, f"rung_{rung}.log"), "w")
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "modules.sweep",
+                "trial",
+                trial.trial_dir,
+                "--rung",
+                str(rung),
+                "--timesteps",
+                str(rung_timesteps(rung, self.min_timesteps, self.eta)),
+                "--threads",
+                str(len(slot)),
+                "--evaluation",
+                yaml.safe_dump(self.evaluation),
+            ],
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            # Pinned before exec, so torch and env worker threads all inherit it
+            preexec_fn=lambda: os.sched_setaffinity(0, slot),
+        )
+        log.close()
+        print(
+            f"Started trial {trial.trial_id} rung {rung} on CPUs {slot[0]}-{slot[-1]}: "
+            f"{trial.overrides}"
+        )
+        return process
+
+    def finish(self, trial, rung, returncode):
+        result_path = os.path.join(trial.trial_dir, f"rung_{rung}.yaml")
+        if returncode != 0 or not os.path.exists(result_path):
+            trial.failed = trial.stopped = True
+            self.free_replay_buffer(trial)
+            print(f"Trial {trial.trial_id} failed at rung {rung}, see its rung_{rung}.log")
+            return
+        with open(result_path, "r") as file:
+            trial.results[rung] = yaml.safe_load(file)
+        trial.next_rung = rung + 1
+        if trial.next_rung == self.num_rungs:
+            trial.stopped = True
+            self.free_replay_buffer(trial)
+        print(
+            f"Trial {trial.trial_id} rung {rung}: win rate {trial.results[rung]['win_rate']:.3f}, "
+            f"mean foundation {trial.results[rung]['mean_foundation']:.1f}"
+        )
+
+    def free_replay_buffer(self, trial):
+        """Delete the memmap replay buffer of a trial that will not train again."""
+        buffer_path = os.path.join(trial.trial_dir, "replay_buffer")
+        if os.path.exists(buffer_path):
+            shutil.rmtree(buffer_path)
+
+    def eliminated(self, trial):
+        """
+        Whether a trial can no longer make the top ``1 / eta`` of its last rung, even
+        if every trial that may still finish that rung does worse.
+        """
+        rung = trial.best_rung
+        finished = [t for t in self.trials if rung in t.results]
+        pending = [t for t in self.trials if t.next_rung <= rung and not t.stopped]
+        ranked = sorted(finished, key=lambda t: score(t.results[rung]), reverse=True)
+        return ranked.index(trial) >= (len(finished) + len(pending)) // self.eta
+
+    def stop_losers(self, running=()):
+        """Stop the trials that can no longer be promoted and free their replay buffers."""
+        for trial in self.trials:
+            if trial.stopped or not trial.results or trial in running:
+                continue
+            if self.eliminated(trial):
+                trial.stopped = True
+                self.free_replay_buffer(trial)
+
+    def run(self, poll_interval=5.0):
+        """
+        Run the sweep until every trial is finished or stopped.
+
+        Returns:
+            list: The trials, best first.
+        """
+        running = {}  # Trial to (process, rung, slot)
+        free_slots = list(self.slots)
+        while True:
+            while free_slots:
+                job = self.next_job(running)
+                if job is None:
+                    break
+                trial, rung = job
+                running[trial] = (self.start(trial, rung, free_slots[0]), rung, free_slots[0])
+                free_slots.pop(0)
+            if not running:
+                break
+            time.sleep(poll_interval)
+            for trial, (process, rung, slot) in list(running.items()):
+                returncode = process.poll()
+                if returncode is not None:
+                    del running[trial]
+                    free_slots.append(slot)
+                    self.finish(trial, rung, returncode)
+        self.stop_losers()
+        return self.leaderboard()
+
+    def leaderboard(self):
+        trials = [t for t in self.trials if t.results]
+        trials.sort(key=lambda t: (t.best_rung, score(t.results[t.best_rung])), reverse=True)
+        rows = []
+        for trial in trials:
+            result = trial.results[trial.best_rung]
+            rows.append(dict(trial_id=trial.trial_id, **result, overrides=trial.overrides))
+            print(
+                f"Trial {trial.trial_id}: rung {trial.best_rung}, {result['timesteps']} steps, "
+                f"win rate {result['win_rate']:.3f}, mean foundation "
+                f"{result['mean_foundation']:.1f} - {trial.overrides}"
+            )
+        with open(os.path.join(self.output_dir, "leaderboard.yaml"), "w") as file:
+            yaml.safe_dump(rows, file, sort_keys=False)
+        return trials
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hyperparameter sweeps of dqn.py.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sweep_parser = subparsers.add_parser("run", help="Run a sweep.")
+    sweep_parser.add_argument("spec", help="Sweep spec, e.g. configs/sweep.yaml.")
+    sweep_parser.add_argument("--config", default=None, help="Overrides base_config.")
+    trial_parser = subparsers.add_parser("trial", help="Train and evaluate one trial rung.")
+    trial_parser.add_argument("trial_dir")
+    trial_parser.add_argument("--rung", type=int, required=True)
+    trial_parser.add_argument("--timesteps", type=int, required=True)
+    trial_parser.add_argument("--threads", type=int, default=1)
+    trial_parser.add_argument("--evaluation", default="{}")
+    args = parser.parse_args()
+
+    if args.command == "trial":
+        run_trial(
+            args.trial_dir,
+            args.rung,
+            args.timesteps,
+            args.threads,
+            yaml.safe_load(args.evaluation),
+        )
+    else:
+        with open(args.spec, "r") as file:
+            spec = yaml.safe_load(file)["sweep"]
+        with open(args.config or spec.get("base_config", "configs/config.yaml"), "r") as file:
+            base_config = yaml.safe_load(file)
+        Sweep(spec, base_config).run()
@@ -0,0 +1,39 @@
+import random
+from functools import lru_cache
+
+# Stacks whose cards are hashed by zone only. Dealing and recycling never reorder the
+# waste, next cards and deck (see modules.state.state_from_game), and foundations
+# only grow in rank order, so the zone of each card pins down the layout of a game.
+ZONES = {"Foundation": 0, "Waste": 1, "Next Cards": 2, "Deck": 3}
+MAX_STACK_DEPTH = 52
+
+
+class ZobristKeys(object):
+    """
+    Random 64-bit keys for every (card, location) feature of a game.
+
+    Tableau cards are keyed by stack, depth and visibility. The hash of a game is the
+    XOR of the keys of all its cards, so moving a card updates it with two XORs.
+    """
+
+    def __init__(self, num_t_stacks, seed=0x5EED):
+        rng = random.Random(seed)
+        self.num_t_stacks = num_t_stacks
+        self.tableau = [
+            rng.getrandbits(64) for _ in range(num_t_stacks * MAX_STACK_DEPTH * 2 * 53)
+        ]
+        self.zones = [rng.getrandbits(64) for _ in range(len(ZONES) * 53)]
+
+    def tableau_key(self, code, stack_index, depth, visible):
+        return self.tableau[
+            ((stack_index * MAX_STACK_DEPTH + depth) * 2 + visible) * 53 + code
+        ]
+
+    def zone_key(self, code, zone):
+        return self.zones[ZONES[zone] * 53 + code]
+
+
+@lru_cache(maxsize=None)
+def get_zobrist_keys(num_t_stacks):
+    """Keys are shared by every game with the same number of tableau stacks."""
+    return ZobristKeys(num_t_stacks)
@@ -0,0 +1,46 @@
+import pytest
+import yaml
+
+from modules.step_kernel import UNSUPPORTED_ENV_OPTIONS, differential_check
+
+
+def kernel_config(cards_per_turn):
+    with open("configs/config.yaml", "r") as file:
+        config = yaml.safe_load(file)
+    config["env"].update({key: False for key in UNSUPPORTED_ENV_OPTIONS})
+    config["check_available_moves"] = False
+    config["cards_per_turn"] = cards_per_turn
+    return config
+
+
+@pytest.mark.parametrize("jit", [True, False], ids=["numba", "python"])
+@pytest.mark.parametrize("cards_per_turn", [1, 3])
+def test_kernel_matches_env(cards_per_turn, jit):
+    # Without Numba installed both variants run the Python fallback
+    steps = differential_check(
+        kernel_config(cards_per_turn), num_games=5, max_steps=500, seed=cards_per_turn, jit=jit
+    )
+    assert steps > 0
+
+
+def test_state_action_mask_matches_env():
+    import numpy as np
+
+    from modules.actions import action_mask
+    from modules.kernel_env import state_action_mask
+    from modules.solitaire_env import SolitaireEnv
+    from modules.state import state_from_game
+
+    config = kernel_config(3)
+    config["env"]["record_games"] = False
+    config["env"]["save_every"] = 2**62
+    env = SolitaireEnv(config=config)
+    rng = np.random.default_rng(0)
+    for game in range(3):
+        env.reset(options={"deal_seed": game})
+        for _ in range(300):
+            mask = action_mask(env.game)
+            assert np.array_equal(state_action_mask(state_from_game(env.game), 7), mask)
+            _, _, terminated, truncated, _ = env.step(int(rng.choice(np.flatnonzero(mask))))
+            if terminated or truncated:
+                break
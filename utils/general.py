@@ -1,3 +1,4 @@
+import multiprocessing
 import os
 import xml.etree.ElementTree as ET
 from copy import deepcopy
@@ -34,6 +35,129 @@ def parse_xmls_as_dataframe(xmls, stop_on_error=False, logger=None) -> pd.DataFr
     return df
 
 
+def _cleanup(column: str) -> str:
+    """Drop the xmltodict markers from a flattened column name: "@" of attributes and ".#text" of element text"""
+    return column.replace("@", "").replace(".#text", "")
+
+
+def _element_value(element: ET.Element, children: dict, attributes: dict):
+    """Value of a parsed element in the layout of xmltodict: text only, or a dict of @attributes, children and #text"""
+    text = (element.text or "").strip() or None
+    if not attributes and not children:
+        return text
+    value = {"@" + key: attr for key, attr in attributes.items()}
+    value.update(children)
+    if text is not None:
+        value["#text"] = text
+    return value
+
+
+def _prefixed_name(name: str, prefixes: dict) -> str:
+    """Turn an ElementTree "{uri}name" back into the "prefix:name" of the source, as xmltodict keeps it"""
+    if not name.startswith("{"):
+        return name
+    uri, local = name[1:].split("}", 1)
+    prefix = prefixes.get(uri)
+    if prefix is None:
+        return name
+    return f"{prefix}:{local}" if prefix else local
+
+
+def iterparse_xml_to_dict(xml_fp: str, flatten=True) -> dict:
+    """Streaming version of parse_xml_to_dict using ElementTree.iterparse, same layout as xmltodict.
+    Elements are cleared as soon as they are converted, so the parsed tree is never held in memory.
+    Namespaced names keep the prefix they were declared with ("r:run", plus an "@xmlns:r" attribute);
+    a namespace bound to several prefixes in the same scope uses the innermost declaration."""
+    # Children of every open element, repeated tags become lists as in xmltodict
+    stack = [{}]
+    # Namespace uri -> prefix in scope, and the xmlns attributes of every open element
+    scopes = [{}]
+    declarations = []
+    pending = {}
+    for event, item in ET.iterparse(xml_fp, events=("start-ns", "start", "end")):
+        if event == "start-ns":
+            prefix, uri = item
+            pending["xmlns:" + prefix if prefix else "xmlns"] = uri
+            continue
+        element = item
+        if event == "start":
+            prefixes = dict(scopes[-1])
+            for name, uri in pending.items():
+                prefixes[uri] = name[len("xmlns:") :] if ":" in name else ""
+            scopes.append(prefixes)
+            declarations.append(pending)
+            pending = {}
+            stack.append({})
+            continue
+        prefixes = scopes.pop()
+        attributes = dict(declarations.pop())
+        attributes.update(
+            (_prefixed_name(key, prefixes), attr) for key, attr in element.attrib.items()
+        )
+        value = _element_value(element, stack.pop(), attributes)
+        tag = _prefixed_name(element.tag, prefixes)
+        siblings = stack[-1]
+        if tag in siblings:
+            if not isinstance(siblings[tag], list):
+                siblings[tag] = [siblings[tag]]
+            siblings[tag].append(value)
+        else:
+            siblings[tag] = value
+        element.clear()
+    data_dict = stack[0]
+
+    if flatten:
+        data_dict = flatten_dict(data_dict)
+    return data_dict
+
+
+def _parse_xml_record(xml: str):
+    """Pool worker: (path, flattened record with cleaned up keys, error message)"""
+    try:
+        record = iterparse_xml_to_dict(xml)
+        return xml, {_cleanup(k): v for k, v in record.items()}, None
+    except Exception as e:
+        return xml, None, str(e)
+
+
+def iter_xml_records(xmls, batch_size=1000, processes=None, stop_on_error=False, logger=None, path_column=None):
+    """Parse xmls across a process pool and yield the flattened records in batches (lists of dicts), in file order.
+    Missing files are skipped. Only one batch is held at a time, so memory is bounded by batch_size."""
+    xmls = [xml for xml in xmls if os.path.exists(xml)]
+    batch = []
+    with multiprocessing.Pool(processes) as pool:
+        for xml, record, error in pool.imap(_parse_xml_record, xmls, chunksize=16):
+            if error is not None:
+                if logger is not None:
+                    logger.warn("Exception occured while parsing {}: {}".format(xml, error))
+                if stop_on_error:
+                    raise ValueError("Could not parse {}: {}".format(xml, error))
+                continue
+            if path_column:
+                record[path_column] = xml
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def parse_xmls_streaming(xmls, processes=None, stop_on_error=False, logger=None, path_column=None) -> pd.DataFrame:
+    """Streaming, parallel alternative to parse_xmls_as_dataframe with one row per xml, built once at the end in linear time.
+    Returns None when no xml could be parsed, like parse_xmls_as_dataframe."""
+    records = [
+        record
+        for batch in iter_xml_records(
+            xmls, processes=processes, stop_on_error=stop_on_error, logger=logger, path_column=path_column
+        )
+        for record in batch
+    ]
+    if not records:
+        return None
+    return pd.DataFrame.from_records(records)
+
+
 def parse_xml_to_dict(xml_fp: str, flatten=True) -> dict:
     """Parses a XML as an orderd dict. Attributes in the XML will be prefixed with @"""
     with open(xml_fp) as xml_file: